@@ -22,7 +22,7 @@ import numpy as np
 from procgen import ProcgenGym3Env
 from procgen_tools import maze
 from procgen_tools.models import load_policy
-from procgen_tools.metrics import metrics, decision_square 
+from procgen_tools.metrics import metrics, metrics_table, decision_square 
 from procgen_tools.data_utils import load_episode
 from data_util import load_episode
 
@@ -64,17 +64,14 @@ for f in files:
 print(f'Loaded {len(runs)} runs')
 
 # %%
-recorded_metrics = defaultdict(list)
-recorded_runs = []
-got_cheese = []
-for run in tqdm(runs):
-    g = run.grid()
-    if decision_square(g) is None or (g[-5:, -5:] == maze.CHEESE).any():
-        continue
-    for name, metric in metrics.items():
-        recorded_metrics[name].append(metric(g))
-    got_cheese.append(float(run.got_cheese))
-    recorded_runs.append(run)
+recorded_runs = [
+    run for run in tqdm(runs)
+    if decision_square(run.grid()) is not None and not (run.grid()[-5:, -5:] == maze.CHEESE).any()
+]
+# Shared intermediates are computed once per grid, then every metric at once
+metrics_df = metrics_table(recorded_runs, num_workers=os.cpu_count())
+recorded_metrics = {name: list(metrics_df[name]) for name in metrics}
+got_cheese = [float(run.got_cheese) for run in recorded_runs]
 
 runs = recorded_runs; del recorded_runs
 got_cheese = np.array(got_cheese)
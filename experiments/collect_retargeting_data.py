@@ -11,7 +11,7 @@ from procgen_tools.utils import setup
 setup()  # create directory structure and download data
 
 from procgen_tools.imports import *
-from procgen_tools import maze, visualization, models, patch_utils
+from procgen_tools import maze, visualization, models, patch_utils, disk_cache
 from typing import Tuple, Dict, List, Optional, Union
 from ipywidgets import interact, interactive, fixed, interact_manual
 import ipywidgets as widgets
@@ -64,8 +64,11 @@ def retarget_to_square(
         default=default,
     )
 
+    # Only the squares on the path matter for the probability
     with hook.use_patches(patches):
-        vf: Dict = visualization.vector_field(venv, hook.network)
+        vf: Dict = visualization.vector_field_at(
+            venv, hook.network, targets=[inner_coord]
+        )
 
     return maze.geometric_probability_path((0, 0), inner_coord, vf)
 
@@ -88,20 +91,52 @@ def cheese_at_square(
         inner_coord[1] + padding,
     )
     moved_venv = maze.move_cheese(venv, new_coord)
-    vf: Dict = visualization.vector_field(moved_venv, hook.network)
+    vf: Dict = visualization.vector_field_at(
+        moved_venv, hook.network, targets=[inner_coord]
+    )
     return maze.geometric_probability_path((0, 0), inner_coord, vf)
 
 
+HEATMAP_COLUMNS = ["row", "col", "filter_coord", "maze_size", "d_to_coord"]
+
+
+def heatmap_to_arrays(data: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """The columns of a retarget_heatmap DataFrame as arrays, for the cache."""
+    arrays = {col: np.array(data[col].tolist()) for col in HEATMAP_COLUMNS}
+    arrays["probability"] = data["probability"].to_numpy(dtype=float)
+    return arrays
+
+
+def heatmap_from_arrays(arrays: Dict[str, np.ndarray]) -> pd.DataFrame:
+    data = {col: arrays[col].tolist() for col in HEATMAP_COLUMNS}
+    data["filter_coord"] = list(map(tuple, data["filter_coord"]))
+    data["probability"] = arrays["probability"]
+    return pd.DataFrame(data)
+
+
 # Define the main processing routine for a single seed in a function
-def process_seed(seed, args, SAVE_DIR):
+def process_seed(seed, args, SAVE_DIR, cache, model_fp):
     filepath = os.path.join(SAVE_DIR, f"maze_retarget_{seed}.csv")
 
     # Initialize the model and hook inside the function for each process
     venv = maze.create_venv(num=1, start_level=seed, num_levels=1)
     new_venv = maze.remove_cheese(venv) if args.remove_cheese else venv
-    if os.path.exists(filepath):
+
+    # A setting's results are put in the cache once its rows are in the CSV,
+    # so finished settings are skipped without reading the CSV
+    key = disk_cache.cache_key(
+        new_venv.env.callmethod("get_state")[0],
+        model_fp,
+        patches=(str(args.intervention), args.magnitude),
+        kind="retarget_heatmap",
+    )
+    if key in cache and os.path.exists(filepath):
+        return
+    cached = cache.get(key)
+
+    if cached is None and os.path.exists(filepath):
+        # Rows written before the cache was used, or whose entry was evicted
         data = pd.read_csv(filepath)
-        # See if we already have the data for this setting
         mask = (
             (data["magnitude"] == args.magnitude)
             & (data["removed_cheese"] == args.remove_cheese)
@@ -113,7 +148,9 @@ def process_seed(seed, args, SAVE_DIR):
             return
 
     # Don't overwrite TODO
-    if args.intervention == "cheese":
+    if cached is not None:  # The CSV was removed, but we have the results
+        new_data = heatmap_from_arrays(cached)
+    elif args.intervention == "cheese":
         new_data: pd.DataFrame = visualization.retarget_heatmap(
             new_venv,
             hook,
@@ -133,6 +170,7 @@ def process_seed(seed, args, SAVE_DIR):
             channels=args.intervention,
             magnitude=args.magnitude,
         )
+    if args.intervention not in ("cheese", "normal"):
         # TODO check that the "probability" column is floats
         new_data["magnitude"] = args.magnitude
     new_data["intervention"] = [args.intervention] * len(new_data)
@@ -149,6 +187,8 @@ def process_seed(seed, args, SAVE_DIR):
     data.to_csv(
         os.path.join(SAVE_DIR, f"maze_retarget_{seed}.csv"), index=False
     )
+    if cached is None:
+        cache.put(key, heatmap_to_arrays(new_data))
 
 
 # Parsing arguments
@@ -182,6 +222,10 @@ if __name__ == "__main__":
         "--intervention", type=intervention_type, default=effective_channels
     )
     parser.add_argument("--magnitude", type=float, default=2.3)
+    parser.add_argument(
+        "--cache_dir", type=str, default=os.path.join(SAVE_DIR, "cache")
+    )
+    parser.add_argument("--cache_gb", type=float, default=10.0)
     args = parser.parse_args()
 
     print(type(args.intervention), args.intervention)
@@ -196,7 +240,11 @@ if __name__ == "__main__":
     device = t.device(args.device)
     policy = models.load_policy(args.model_file, 15, device)
     hook = cmh.ModuleHook(policy)
+    cache = disk_cache.DiskCache(
+        args.cache_dir, max_bytes=int(args.cache_gb * 2**30)
+    )
+    model_fp = disk_cache.fingerprint(policy)
 
     # Strength of the intervention
     for seed in seeds:
-        process_seed(seed, args, SAVE_DIR)
+        process_seed(seed, args, SAVE_DIR, cache, model_fp)
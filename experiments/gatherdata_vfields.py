@@ -7,7 +7,7 @@ import matplotlib.pyplot as plt
 import circrl.module_hook as cmh
 
 import procgen_tools.models as models
-from procgen_tools import maze, patch_utils
+from procgen_tools import maze, patch_utils, visualization, disk_cache
 
 # %%
 # Load two levels and get values
@@ -37,6 +37,10 @@ if __name__ == "__main__":
     )
     parser.add_argument("--save-figures", default=True, action="store_false")
     parser.add_argument("--vector_type", type=str, default="cheese")
+    parser.add_argument(
+        "--cache_dir", type=str, default="experiments/statistics/data/cache"
+    )
+    parser.add_argument("--cache_gb", type=float, default=10.0)
     args = parser.parse_args()
 
     rand_region = 5
@@ -49,23 +53,69 @@ if __name__ == "__main__":
     policy = models.load_policy(args.model_file, 15, device)
     hook = cmh.ModuleHook(policy)
 
+    # Activations and vector fields are shared between coeffs and reruns
+    cache = disk_cache.DiskCache(
+        args.cache_dir, max_bytes=int(args.cache_gb * 2**30)
+    )
+    model_fp = disk_cache.fingerprint(policy)
+
+    def cached_vfield(venv, patches):
+        def compute():
+            with hook.use_patches(patches):
+                vf = visualization.vector_field(venv, hook.network)
+            return vf.to_arrays()
+
+        state_bytes = venv.env.callmethod("get_state")[0]
+        key = disk_cache.cache_key(
+            state_bytes, model_fp, patches=patches, kind="vfield"
+        )
+        return visualization.VectorField.from_arrays(
+            cache.get_or_put(key, compute)
+        )
+
     for seed, coeff in tqdm(list(itertools.product(seeds, coeffs))):
         name = f"seed-{seed}_coeff-{coeff}_rr-{rand_region}_label-{label}"
         filepath = f"{path_prefix}data/vfields/{args.vector_type}/{name}.pkl"
         if os.path.exists(filepath):
             continue
-        values = None
         if args.vector_type == "top_right":
             venv_pair = maze.get_top_right_venv_pair(seed=seed)
-            values = patch_utils.values_from_venv(
-                layer_name=label, venv=venv_pair, hook=hook
-            )
+        else:
+            venv_pair = maze.get_cheese_venv_pair(seed)
+        values_key = disk_cache.cache_key(
+            venv_pair.env.callmethod("get_state"),
+            model_fp,
+            layers=[label],
+            kind="activations",
+        )
+        values = cache.get_or_put(
+            values_key,
+            lambda: {
+                "values": np.asarray(
+                    patch_utils.values_from_venv(
+                        layer_name=label, venv=venv_pair, hook=hook
+                    )
+                )
+            },
+        )["values"]
 
-        fig, _, obj = plot_patched_vfields(
-            seed, coeff, label, hook, values=values
+        # Vector fields on the maze with cheese, without and with the patch
+        venv = maze.copy_venv(maze.get_cheese_venv_pair(seed), 0)
+        patches = patch_utils.get_values_diff_patch(values, coeff, label)
+        original_vfield = cached_vfield(venv, {})
+        patched_vfield = cached_vfield(venv, patches)
+        fig, _, vf_diff = visualization.plot_vfs(
+            original_vfield, patched_vfield
         )
+        obj = {
+            "original_vfield": original_vfield,
+            "patched_vfield": patched_vfield,
+            "diff_vfield": vf_diff,
+            "seed": seed,
+            "coeff": coeff,
+            "patch_layer_name": label,
+        }
         with open(filepath, "wb") as fp:
-            del obj["patches"]  # can't pickle lambda
             pickle.dump(obj, fp)
 
         if args.save_figures:
@@ -37,7 +37,7 @@ class NotReachedDecisionSquareException(PostprocException):
 def get_cheese_and_dec_nodes(seq):
     maze_env_state = maze.EnvState(seq.custom['state_bytes'][0].values[()])
     inner_grid = maze_env_state.inner_grid()
-    grid_graph = maze.maze_grid_to_graph(inner_grid)
+    grid_graph = maze.maze_grid_to_csr(inner_grid)
     #px.imshow(rearrange(episode_data['seq'].obs[0].values, 'c h w -> h w c')).show()
     cheese_node = maze.get_cheese_pos(inner_grid)
     dec_node = maze.get_decision_square_from_grid_graph(inner_grid, grid_graph)
@@ -112,19 +112,14 @@ def get_obs_batch_on_grid(
             level_seeds.append(level_seed)
             padding = (states[0].world_dim - maze_dim_this) // 2
                         
-            # TODO: speed this way up!  Should be able to just have one or two EnvStates and
-            # just save out bytes from these?
+            # Mouse positions are given as (x, y), i.e. flipped relative to (row, col)
+            mouse_poss_outer = np.array(mouse_poss)[:, ::-1] + padding
                     
             # Position the mouse as needed in all no-cheese envs, and remove the cheese
-            state_bytes_new = []
-            for idx, mouse_pos in enumerate(mouse_poss):
-                state = maze.EnvState(state_bytes_list[idx])
-                # Place/remove objects
-                remove_cheese_from_state(state)
-                state.set_mouse_pos(mouse_pos[1]+padding, mouse_pos[0]+padding)
-                # Update state bytes
-                state_bytes_new.append(state.state_bytes)
-            venv_no_cheese.env.callmethod("set_state", state_bytes_new)
+            batch = maze.StateBatch(state_bytes_list)
+            batch.remove_cheese()
+            batch.set_mouse_positions(mouse_poss_outer)
+            venv_no_cheese.env.callmethod("set_state", batch.to_state_bytes())
 
             # Get the "no cheese" observations
             obs_no_cheese_list.append(venv_no_cheese.reset().astype(np.float32))
@@ -135,19 +130,11 @@ def get_obs_batch_on_grid(
                 start_level=level_seed, num_levels=1)
             state_bytes_list = venv_cheese.env.callmethod("get_state")
 
-            # Position the cheese and mouse as needed in each venv
-            state_bytes_new = []
-            for idx_mouse, mouse_pos in enumerate(mouse_poss):
-                for idx_cheese, cheese_pos in enumerate(cheese_poss):
-                    idx = idx_mouse * num_cheese_pos + idx_cheese
-                    state = maze.EnvState(state_bytes_list[idx])
-                    # Place objects
-                    move_cheese_in_state(state, 
-                        (cheese_pos[0]+padding, cheese_pos[1]+padding))
-                    state.set_mouse_pos(mouse_pos[1]+padding, mouse_pos[0]+padding)
-                    # Update state bytes
-                    state_bytes_new.append(state.state_bytes)
-            venv_cheese.env.callmethod("set_state", state_bytes_new)
+            # Position the cheese and mouse as needed in each venv, mouse-major
+            batch = maze.StateBatch(state_bytes_list)
+            batch.move_cheese(np.tile(np.array(cheese_poss) + padding, (num_mouse_pos, 1)))
+            batch.set_mouse_positions(np.repeat(mouse_poss_outer, num_cheese_pos, axis=0))
+            venv_cheese.env.callmethod("set_state", batch.to_state_bytes())
 
             # Get the "with cheese" observations
             obs_cheese_list.append(venv_cheese.reset().astype(np.float32))
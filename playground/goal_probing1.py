@@ -71,7 +71,7 @@ def process_rollout(fn):
     # Get the decision square location
     maze_env_state = maze.EnvState(seq.custom['state_bytes'][0].values[()])
     inner_grid = maze_env_state.inner_grid()
-    grid_graph = maze.maze_grid_to_graph(inner_grid)
+    grid_graph = maze.maze_grid_to_csr(inner_grid)
     #px.imshow(rearrange(episode_data['seq'].obs[0].values, 'c h w -> h w c')).show()
     if not maze.grid_graph_has_decision_square(inner_grid, grid_graph):
         raise NoDecisionSquareException
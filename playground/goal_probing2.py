@@ -37,10 +37,8 @@ import gatherdata_rich
 # %%
 # Functions
 def get_node_probe_targets(data_all, world_loc):
-    node_data = [maze.get_node_type_by_world_loc(dd['dec_state_bytes'], world_loc)
-        for dd in data_all]
-    node_types = [tt for tt, ngb in node_data]
-    node_ngb = [ngb for tt, ngb in node_data]
+    node_types, node_ngb = maze.get_node_types_by_world_loc(
+        [dd['dec_state_bytes'] for dd in data_all], world_loc)
     return xr.Dataset(dict(
         node_type = xr.DataArray(node_types),
         node_ngb = xr.DataArray(node_ngb),
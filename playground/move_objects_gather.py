@@ -32,7 +32,7 @@ def make_maze_and_move_object():
     # Put the mouse on a random square chosen from the set of squares that are on either path-to-cheese, path-to-corner or both
     env_state = maze.EnvState(venv.env.callmethod('get_state')[0])
     inner_grid = env_state.inner_grid()
-    graph = maze.maze_grid_to_graph(inner_grid)
+    graph = maze.maze_grid_to_csr(inner_grid)
     path_to_cheese = maze.get_path_to_cheese(inner_grid, graph)
     path_to_corner = maze.get_path_to_corner(inner_grid, graph)
     path_nodes = list(set(path_to_corner) + set(path_to_cheese))
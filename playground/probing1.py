@@ -40,12 +40,8 @@ def get_node_probe_targets(data_all, world_loc, state_bytes_key):
     the maze square located at world_loc, which should be (row, col).
     Targets returned are node type (wall, path, branch, etc.) and
     neighbour "is open" status for left, right, down, up.'''
-    node_data = []
-    for dd in tqdm(data_all):
-        node_data.append(
-            maze.get_node_type_by_world_loc(dd[state_bytes_key], world_loc))
-    node_types = [tt for tt, ngb in node_data]
-    node_ngb = [ngb for tt, ngb in node_data]
+    node_types, node_ngb = maze.get_node_types_by_world_loc(
+        [dd[state_bytes_key] for dd in data_all], world_loc)
     return xr.Dataset(dict(
         node_type = xr.DataArray(node_types, dims=['batch']),
         node_ngb = xr.DataArray(node_ngb, dims=['batch', 'dir']),
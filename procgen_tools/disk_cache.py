@@ -0,0 +1,271 @@
+"""
+A content-addressed on-disk cache of arrays computed from maze states, like
+vector fields and captured activations, so reruns of notebooks and sweeps
+reuse earlier work.
+
+Entries are keyed by cache_key: a hash of the state bytes, a fingerprint of
+the model weights, the patch spec and the layer set. Each entry is a dict of
+numpy arrays stored as an .npz blob, and an sqlite index records the size and
+last use of each blob, so the cache can be kept under max_bytes by evicting
+the least recently used entries. Several processes can share a cache: blobs
+are written to a temporary file and renamed into place before the index is
+updated, and a blob evicted under a reader is just a cache miss.
+
+    cache = DiskCache("data/cache", max_bytes=10 * 2**30)
+    key = cache_key(state_bytes, policy, patches=("cheese", label, coeff))
+    vf = VectorField.from_arrays(
+        cache.get_or_put(key, lambda: vector_field(venv, policy).to_arrays())
+    )
+"""
+
+import collections.abc
+import dis
+import functools
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import types
+from typing import Callable, Dict, Iterable, Optional
+
+import numpy as np
+import torch
+
+_hashing = threading.local()
+
+
+def _global_names(code: types.CodeType) -> set:
+    """
+    The global names code and the functions defined in it look up. co_names
+    also has attribute names, like mean in o.mean(), so the names are taken
+    from the instructions that load globals.
+    """
+    names = {
+        instr.argval
+        for instr in dis.get_instructions(code)
+        if instr.opname in ("LOAD_GLOBAL", "LOAD_NAME")
+    }
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _global_names(const)
+    return names
+
+
+def _globals_read(func: types.FunctionType) -> list:
+    """
+    The (name, value) pairs of the module globals func reads, so changing
+    e.g. a global coeff a patch lambda uses changes its fingerprint. Names
+    which aren't in the globals, like builtins, are left out.
+    """
+    return [
+        (name, func.__globals__[name])
+        for name in sorted(_global_names(func.__code__))
+        if name in func.__globals__
+    ]
+
+
+def _update(h, obj):
+    "Feed obj into the hash h, tagged with its type so e.g. 1 != '1'."
+    h.update(type(obj).__name__.encode() + b":")
+    if isinstance(obj, torch.nn.Module):
+        _update(h, obj.state_dict())
+    elif isinstance(obj, torch.Tensor):
+        _update(h, obj.detach().cpu().numpy())
+    elif isinstance(obj, np.ndarray):
+        h.update(f"{obj.dtype.str}{obj.shape}".encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        h.update(len(obj).to_bytes(8, "little"))
+        h.update(obj)
+    elif isinstance(obj, str):
+        _update(h, obj.encode())
+    elif obj is None or isinstance(
+        obj, (bool, int, float, complex, np.generic)
+    ):
+        h.update(repr(obj).encode())
+    elif isinstance(obj, collections.abc.Mapping):
+        items = sorted((fingerprint(k), v) for k, v in obj.items())
+        _update(h, [item for kv in items for item in kv])
+    elif isinstance(obj, (set, frozenset)):
+        _update(h, sorted(map(fingerprint, obj)))
+    elif isinstance(obj, (list, tuple)):
+        h.update(len(obj).to_bytes(8, "little"))
+        for item in obj:
+            _update(h, item)
+    elif isinstance(obj, types.CodeType):
+        _update(h, (obj.co_code, obj.co_consts, obj.co_names))
+    elif isinstance(obj, types.ModuleType):
+        _update(h, obj.__name__)  # Named: library code isn't part of the key
+    elif isinstance(obj, (type, types.BuiltinFunctionType, np.ufunc)):
+        _update(h, f"{getattr(obj, '__module__', None)}.{obj.__name__}")
+    elif isinstance(obj, types.FunctionType):
+        # Patches are usually lambdas; what they do follows from their code,
+        # the values they close over, the globals they read and their defaults
+        active = _hashing.__dict__.setdefault("functions", set())
+        if id(obj) in active:  # Recursion; the code is already being hashed
+            _update(h, obj.__qualname__)
+            return
+        active.add(id(obj))
+        try:
+            cells = [cell.cell_contents for cell in obj.__closure__ or ()]
+            _update(
+                h,
+                (obj.__code__, cells, _globals_read(obj), obj.__defaults__),
+            )
+        finally:
+            active.discard(id(obj))
+    elif isinstance(obj, functools.partial):
+        _update(h, (obj.func, obj.args, obj.keywords))
+    else:
+        raise TypeError(f"Can't fingerprint {type(obj).__name__} {obj!r}")
+
+
+def fingerprint(obj) -> str:
+    """
+    A hex digest of obj's content. Handles models (their weights), tensors,
+    arrays, bytes, strings, numbers, containers of these and patch functions.
+    """
+    h = hashlib.sha256()
+    _update(h, obj)
+    return h.hexdigest()
+
+
+def cache_key(
+    state_bytes: bytes,
+    model,
+    patches=None,
+    layers: Iterable[str] = (),
+    kind: str = "",
+) -> str:
+    """
+    The cache key of what model computes on the state (or a sequence of
+    states, e.g. a venv pair's): model is a model or its fingerprint (compute
+    that once when making many keys); patches is the patches dict or any
+    description of the patches fingerprint accepts; layers the labels of
+    captured activations. kind tells apart the things cached for the same
+    inputs, e.g. "vfield" and "activations".
+    """
+    model_fp = model if isinstance(model, str) else fingerprint(model)
+    return fingerprint(
+        (kind, state_bytes, model_fp, patches, sorted(set(layers)))
+    )
+
+
+class DiskCache:
+    """
+    Dicts of numpy arrays (no object arrays), stored under path by key. If
+    max_bytes is given, the least recently used entries are evicted after a
+    put to keep the blobs under max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: Optional[int] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(path, "blobs"), exist_ok=True)
+        self._conn, self._pid = None, None
+        with self._db as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # sqlite connections don't survive a fork, so one per process
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(
+                os.path.join(self.path, "index.sqlite"), timeout=60
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._conn
+
+    def __getstate__(self) -> dict:
+        # For passing the cache to worker processes
+        return {"path": self.path, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    def _blob_path(self, key: str) -> str:
+        return os.path.join(self.path, "blobs", key[:2], f"{key}.npz")
+
+    def __contains__(self, key: str) -> bool:
+        query = "SELECT 1 FROM entries WHERE key = ?"
+        return self._db.execute(query, (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @property
+    def nbytes(self) -> int:
+        "The total size of the blobs."
+        query = "SELECT COALESCE(SUM(size), 0) FROM entries"
+        return self._db.execute(query).fetchone()[0]
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        "The arrays stored under key, or None if there are none."
+        if key not in self:
+            return None
+        try:
+            with np.load(self._blob_path(key)) as blob:
+                arrays = dict(blob)
+        except FileNotFoundError:  # Evicted by another process
+            with self._db as db:
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        with self._db as db:
+            db.execute(
+                "UPDATE entries SET last_used = ? WHERE key = ?",
+                (time.time(), key),
+            )
+        return arrays
+
+    def put(self, key: str, arrays: Dict[str, np.ndarray]):
+        path = self._blob_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so readers never see a partial blob
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        # Sized before the rename: another process may evict it right after
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        with self._db as db:
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                (key, size, time.time()),
+            )
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def get_or_put(
+        self, key: str, compute: Callable[[], Dict[str, np.ndarray]]
+    ) -> Dict[str, np.ndarray]:
+        "The arrays stored under key, computing and storing them if needed."
+        arrays = self.get(key)
+        if arrays is None:
+            arrays = compute()
+            self.put(key, arrays)
+        return arrays
+
+    def evict(self, max_bytes: int = 0):
+        "Evict least recently used entries until the rest take max_bytes."
+        with self._db as db:
+            total = self.nbytes
+            evicted = []
+            query = "SELECT key, size FROM entries ORDER BY last_used"
+            for key, size in db.execute(query).fetchall():
+                if total <= max_bytes:
+                    break
+                evicted.append(key)
+                total -= size
+            db.executemany(
+                "DELETE FROM entries WHERE key = ?", [(k,) for k in evicted]
+            )
+        for key in evicted:
+            try:
+                os.remove(self._blob_path(key))
+            except FileNotFoundError:
+                pass
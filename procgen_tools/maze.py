@@ -15,9 +15,17 @@ import os
 import numpy as np
 import functools
 import collections
+import contextlib
+import itertools
+import collections.abc
+import sys
 import heapq
+import multiprocessing
+import threading
 import networkx as nx
-import copy
+import scipy.sparse
+from scipy.sparse import csgraph
+from scipy import ndimage
 from warnings import warn
 from tqdm.auto import tqdm
 from ipywidgets import GridspecLayout, Button, Layout, HBox, Output
@@ -53,6 +61,26 @@ class StateValue:
     val: typing.Any
     idx: int
 
+    def __eq__(self, other):
+        # Compare by value, so read-only values from a view equal edited copies
+        if not isinstance(other, StateValue):
+            return NotImplemented
+        return (self.val, self.idx) == (other.val, other.idx)
+
+
+class _ReadOnlyStateValue(StateValue):
+    "A StateValue read from a StateValuesView, which may be shared between callers."
+
+    def __init__(self, val: typing.Any, idx: int):
+        object.__setattr__(self, "val", val)
+        object.__setattr__(self, "idx", idx)
+
+    def __setattr__(self, name, value):
+        raise TypeError(
+            f"Cannot set {name}, state values are read-only. Use .edit() on"
+            " the state values for a mutable copy."
+        )
+
 
 # fancy type just caused excessive checking / errors ;(
 StateValues = typing.Dict[
@@ -202,84 +230,354 @@ MAZE_STATE_DICT_TEMPLATE = [
 ]
 
 
-# version of LRU cache that returns deepcopy of cached value
-def lru_cache(maxsize: int):
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "nbytes", "maxbytes"]
+)
+
+
+# LRU cache bounded by the memory of its values rather than their count. Hits
+# return the cached value itself, so values must be safe to share.
+def lru_cache(
+    maxbytes: int, sizeof: Callable[[typing.Any], int] = sys.getsizeof
+):
     def decorator(func):
-        cache = collections.OrderedDict()
+        cache = collections.OrderedDict()  # key -> (value, nbytes)
+        stats = {"hits": 0, "misses": 0, "nbytes": 0}
 
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             key = (args, tuple(kwargs.items()))
             try:
-                value = cache.pop(key)
+                value, nbytes = cache.pop(key)
+                stats["hits"] += 1
             except KeyError:
                 value = func(*args, **kwargs)
-            cache[key] = value
-            if len(cache) > maxsize:
-                cache.popitem(last=False)
-            return copy.deepcopy(value)
+                nbytes = sizeof(value)
+                stats["misses"] += 1
+                stats["nbytes"] += nbytes
+            cache[key] = (value, nbytes)
+            while stats["nbytes"] > maxbytes and len(cache) > 1:
+                _, (_, evicted_nbytes) = cache.popitem(last=False)
+                stats["nbytes"] -= evicted_nbytes
+            return value
+
+        def cache_info() -> CacheInfo:
+            return CacheInfo(
+                stats["hits"], stats["misses"], stats["nbytes"], maxbytes
+            )
+
+        def cache_clear():
+            cache.clear()
+            stats.update(hits=0, misses=0, nbytes=0)
 
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
         return wrapper
 
     return decorator
 
 
-@lru_cache(maxsize=128)
-def _parse_maze_state_bytes(state_bytes: bytes, assert_=DEBUG) -> StateValues:
-    # Functions to read values of different types
-    def read_fixed(sb, idx, fmt):
-        sz = struct.calcsize(fmt)
-        # print(f'{idx} chomp {sz} got {len(sb[idx:(idx+sz)])} fmt {fmt}')
-        val = struct.unpack(fmt, sb[idx : (idx + sz)])[0]
-        idx += sz
-        return val, idx
-
-    read_int = lambda sb, idx: read_fixed(sb, idx, "@i")
-    read_float = lambda sb, idx: read_fixed(sb, idx, "@f")
-
-    def read_string(sb, idx):
-        sz, idx = read_int(sb, idx)
-        val = sb[idx : (idx + sz)].decode("ascii")
-        idx += sz
-        return val, idx
-
-    # Function to process a value definition and return a value (called recursively for loops)
-    def parse_value(vals, val_def, idx):
-        typ = val_def[0]
-        name = val_def[1]
-        # print((typ, name))
-        if typ == "int":
-            val, idx = read_int(state_bytes, idx)
-            vals[name] = StateValue(val, idx)
-        elif typ == "float":
-            val, idx = read_float(state_bytes, idx)
-            vals[name] = StateValue(val, idx)
-        elif typ == "string":
-            val, idx = read_string(state_bytes, idx)
-            vals[name] = StateValue(val, idx)
+# ============== Compiled state codec ==============
+# The byte offset of a field only depends on the lengths of the strings and
+# loops that come before it. We compile the template once into fixed-size runs
+# and variable-size steps, resolve every offset once per set of variable
+# lengths (memoized), and then read fields with struct.unpack_from at a known
+# offset instead of walking the whole template.
+
+_FIELD_FORMATS = {"int": "@i", "float": "@f"}
+_FIELD_SIZE = 4  # "@i" and "@f" are both 4 bytes, so there is no padding
+
+
+def _compile_template(template) -> List[Tuple[str, int, typing.Any]]:
+    """
+    Compile the template into (kind, size, extra) steps:
+    - ("fixed", run_size, {loop_len_name: offset_in_run}) for runs of ints/floats
+    - ("string", 4, None) for a length-prefixed string
+    - ("loop", stride, loop_len_name) for a loop over fixed-size elements
+    """
+    loop_len_names = {d[2] for d in template if d[0] == "loop"}
+    steps = []
+    run = []
+
+    def flush_run():
+        if run:
+            len_offsets = {
+                name: i * _FIELD_SIZE
+                for i, name in enumerate(run)
+                if name in loop_len_names
+            }
+            steps.append(("fixed", _FIELD_SIZE * len(run), len_offsets))
+            run.clear()
+
+    for val_def in template:
+        typ, name = val_def[0], val_def[1]
+        if typ in _FIELD_FORMATS:
+            run.append(name)
+            continue
+        flush_run()
+        if typ == "string":
+            steps.append(("string", _FIELD_SIZE, None))
         elif typ == "loop":
-            len_name = val_def[2]
             loop_val_defs = val_def[3]
-            loop_len = vals[len_name].val
-            vals[name] = []
-            for _ in range(loop_len):
-                vals_this = {}
-                for loop_val_def in loop_val_defs:
-                    idx = parse_value(vals_this, loop_val_def, idx)
-                vals[name].append(vals_this)
-        return idx
-
-    # Dict to hold values
-    vals = {}
-
-    # Loop over list of value defs, parsing each
+            assert all(
+                d[0] in _FIELD_FORMATS for d in loop_val_defs
+            ), f"loop {name} must only contain ints and floats"
+            steps.append(
+                ("loop", _FIELD_SIZE * len(loop_val_defs), val_def[2])
+            )
+        else:
+            raise ValueError(f"Unknown field type {typ} for {name}")
+    flush_run()
+    return steps
+
+
+_TEMPLATE_STEPS = _compile_template(MAZE_STATE_DICT_TEMPLATE)
+
+
+@dataclass(frozen=True)
+class _LoopLayout:
+    offset: int  # byte offset of the first element
+    count: int
+    stride: int  # bytes per element
+    fields: Dict[str, Tuple[str, int]]  # name -> (type, offset in element)
+    fmt: str  # struct format of one element
+
+
+@dataclass(frozen=True)
+class _StateLayout:
+    # top-level name -> (type, offset). Strings point at their length prefix.
+    fields: Dict[str, Tuple[str, int]]
+    loops: Dict[str, _LoopLayout]
+    keys: Tuple[str, ...]  # top-level names, in template order
+    size: int
+
+
+def _variable_lengths(state_bytes: bytes) -> Tuple[int, ...]:
+    "Read the string lengths and loop counts of a state, in template order."
+    idx = 0
+    lengths = []
+    loop_counts = {}
+    for kind, size, extra in _TEMPLATE_STEPS:
+        if kind == "fixed":
+            for len_name, offset in extra.items():
+                loop_counts[len_name] = struct.unpack_from(
+                    "@i", state_bytes, idx + offset
+                )[0]
+            idx += size
+        elif kind == "string":
+            length = struct.unpack_from("@i", state_bytes, idx)[0]
+            lengths.append(length)
+            idx += size + length
+        else:
+            count = loop_counts[extra]
+            lengths.append(count)
+            idx += size * count
+    return tuple(lengths)
+
+
+@functools.lru_cache(maxsize=1024)
+def _layout_for_lengths(lengths: Tuple[int, ...]) -> _StateLayout:
+    "Resolve the offset of every field, given the variable lengths of a state."
+    lengths_it = iter(lengths)
+    fields, loops, keys = {}, {}, []
     idx = 0
     for val_def in MAZE_STATE_DICT_TEMPLATE:
-        idx = parse_value(vals, val_def, idx)
+        typ, name = val_def[0], val_def[1]
+        keys.append(name)
+        if typ in _FIELD_FORMATS:
+            fields[name] = (typ, idx)
+            idx += _FIELD_SIZE
+        elif typ == "string":
+            fields[name] = (typ, idx)
+            idx += _FIELD_SIZE + next(lengths_it)
+        else:
+            loop_val_defs = val_def[3]
+            loop = _LoopLayout(
+                offset=idx,
+                count=next(lengths_it),
+                stride=_FIELD_SIZE * len(loop_val_defs),
+                fields={
+                    d[1]: (d[0], i * _FIELD_SIZE)
+                    for i, d in enumerate(loop_val_defs)
+                },
+                fmt="@"
+                + "".join(_FIELD_FORMATS[d[0]][1:] for d in loop_val_defs),
+            )
+            loops[name] = loop
+            idx += loop.stride * loop.count
+    return _StateLayout(fields, loops, tuple(keys), idx)
+
+
+def _state_layout(state_bytes: bytes) -> _StateLayout:
+    "Get the layout of state_bytes. States whose strings and loops have equal lengths share one layout."
+    return _layout_for_lengths(_variable_lengths(state_bytes))
+
+
+def _read_value(
+    state_bytes: bytes, typ: str, offset: int
+) -> Tuple[typing.Any, int]:
+    "Read the value of type typ at offset, returning (value, offset just past the value)."
+    if typ == "string":
+        length = struct.unpack_from("@i", state_bytes, offset)[0]
+        start = offset + _FIELD_SIZE
+        val = bytes(state_bytes[start : start + length]).decode("ascii")
+        return val, start + length
+    val = struct.unpack_from(_FIELD_FORMATS[typ], state_bytes, offset)[0]
+    return val, offset + _FIELD_SIZE
+
+
+def _read_field(state_bytes: bytes, layout: _StateLayout, name: str):
+    "Read the top-level field name from state_bytes."
+    return _read_value(state_bytes, *layout.fields[name])[0]
+
+
+def _loop_field_offset(
+    layout: _StateLayout, loop_name: str, i: int, name: str
+) -> Tuple[str, int]:
+    "Get (type, offset) of field name in element i of the loop loop_name."
+    loop = layout.loops[loop_name]
+    typ, offset = loop.fields[name]
+    return typ, loop.offset + i * loop.stride + offset
+
+
+def _read_loop_field(
+    state_bytes: bytes, layout: _StateLayout, loop_name: str, i: int, name: str
+):
+    "Read field name of element i of the loop loop_name, e.g. ('ents', 0, 'x')."
+    typ, offset = _loop_field_offset(layout, loop_name, i, name)
+    return struct.unpack_from(_FIELD_FORMATS[typ], state_bytes, offset)[0]
+
+
+def _write_loop_field(
+    buffer: bytearray,
+    layout: _StateLayout,
+    loop_name: str,
+    i: int,
+    name: str,
+    val,
+):
+    "Overwrite field name of element i of the loop loop_name, in place."
+    typ, offset = _loop_field_offset(layout, loop_name, i, name)
+    struct.pack_into(_FIELD_FORMATS[typ], buffer, offset, val)
+
+
+def _grid_view(state_bytes: bytes, layout: _StateLayout) -> np.ndarray:
+    """Zero-copy (world_dim, world_dim) view of the grid block of state_bytes.
+    The view is writable (and patches the state in place) if state_bytes is a bytearray.
+    """
+    data = layout.loops["data"]
+    world_dim = _read_field(state_bytes, layout, "world_dim")
+    return np.frombuffer(
+        state_bytes, dtype=np.intc, count=data.count, offset=data.offset
+    ).reshape(world_dim, world_dim)
+
+
+class StateValuesView(collections.abc.Mapping):
+    """
+    Read-only StateValues, read lazily from the state bytes. Views are cached and
+    shared between callers, so they can't be edited; call .edit() to get a
+    mutable StateValues copy which can be passed to _serialize_maze_state.
+    """
+
+    def __init__(
+        self,
+        state_bytes: bytes,
+        layout: Optional[_StateLayout],
+        fields: Dict[str, Tuple[str, int]],
+        loops: Dict[str, _LoopLayout],
+        keys: Tuple[str, ...],
+        base: int = 0,
+    ):
+        self._state_bytes = state_bytes
+        self._layout = layout  # only set for the top-level view
+        self._fields = fields  # name -> (type, offset relative to base)
+        self._loops = loops
+        self._keys = keys
+        self._base = base
+
+    @classmethod
+    def from_state_bytes(cls, state_bytes: bytes) -> "StateValuesView":
+        layout = _state_layout(state_bytes)
+        return cls(
+            state_bytes, layout, layout.fields, layout.loops, layout.keys
+        )
+
+    def _loop_elements(self, loop: _LoopLayout) -> List["StateValuesView"]:
+        keys = tuple(loop.fields)
+        return [
+            StateValuesView(
+                self._state_bytes,
+                None,
+                loop.fields,
+                {},
+                keys,
+                base=loop.offset + i * loop.stride,
+            )
+            for i in range(loop.count)
+        ]
+
+    def __getitem__(self, name: str):
+        if name in self._loops:
+            return self._loop_elements(self._loops[name])
+        typ, offset = self._fields[name]
+        return _ReadOnlyStateValue(
+            *_read_value(self._state_bytes, typ, self._base + offset)
+        )
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __repr__(self) -> str:
+        return f"StateValuesView({len(self._state_bytes)} bytes)"
+
+    @property
+    def nbytes(self) -> int:
+        "Approximate memory held by the view, for bounding caches."
+        return sys.getsizeof(self._state_bytes) + sys.getsizeof(self)
+
+    def edit(self) -> StateValues:
+        "Get a mutable copy of the values, as nested dicts and lists of StateValue."
+        vals = {}
+        for name in self._keys:
+            if name not in self._loops:
+                leaf = self[name]
+                vals[name] = StateValue(leaf.val, leaf.idx)
+                continue
+
+            loop = self._loops[name]
+            rel_ends = [
+                offset + _FIELD_SIZE for _, offset in loop.fields.values()
+            ]
+            block = self._state_bytes[
+                loop.offset : loop.offset + loop.stride * loop.count
+            ]
+            vals[name] = [
+                {
+                    field_name: StateValue(val, elem_start + rel_end)
+                    for field_name, val, rel_end in zip(
+                        loop.fields, elem_vals, rel_ends
+                    )
+                }
+                for elem_start, elem_vals in zip(
+                    range(loop.offset, loop.offset + len(block), loop.stride),
+                    struct.iter_unpack(loop.fmt, block),
+                )
+            ]
+        return vals
+
+
+@lru_cache(maxbytes=64 * 2**20, sizeof=lambda view: view.nbytes)
+def _parse_maze_state_bytes(
+    state_bytes: bytes, assert_=DEBUG
+) -> StateValuesView:
+    vals = StateValuesView.from_state_bytes(state_bytes)
 
     if assert_:
         assert (
-            _serialize_maze_state(vals, assert_=False) == state_bytes
+            _serialize_maze_state(vals.edit(), assert_=False) == state_bytes
         ), "serialize(deserialize(state_bytes)) != state_bytes"
     return vals
 
@@ -300,7 +598,7 @@ def _serialize_maze_state(state_vals: StateValues, assert_=DEBUG) -> bytes:
 
     # Flatten the nested values into a single list of primitives
     def flatten_vals(vals, flat_list=[]):
-        if isinstance(vals, dict):
+        if isinstance(vals, collections.abc.Mapping):
             for val in vals.values():
                 flatten_vals(val, flat_list)
         elif isinstance(vals, list):
@@ -325,6 +623,10 @@ def _serialize_maze_state(state_vals: StateValues, assert_=DEBUG) -> bytes:
 # Backwards compatability with data_utils
 def get_grid(state_vals: StateValues):
     "Get the grid from state_vals"
+    if isinstance(state_vals, StateValuesView) and state_vals._layout:
+        return _grid_view(state_vals._state_bytes, state_vals._layout).astype(
+            int
+        )
     world_dim = state_vals["world_dim"].val
     grid_vals = np.array([dd["i"].val for dd in state_vals["data"]]).reshape(
         world_dim, world_dim
@@ -343,20 +645,53 @@ class EnvState:
     def __init__(self, state_bytes: bytes):
         self.state_bytes = state_bytes
 
+    @property
+    def state_bytes(self) -> bytes:
+        if self._state_bytes is None:
+            # Edits went into the buffer; only copy them out when asked for
+            self._state_bytes = bytes(self._buffer)
+        return self._state_bytes
+
+    @state_bytes.setter
+    def state_bytes(self, state_bytes: bytes):
+        self._state_bytes = state_bytes
+        self._buffer = None  # bytearray copy, made on the first edit
+        self._layout = None  # recomputed lazily, the new bytes may differ
+
+    def _current_bytes(self):
+        "The up-to-date state, without copying edits out of the buffer."
+        return self._state_bytes if self._buffer is None else self._buffer
+
+    def _writable_buffer(self) -> bytearray:
+        """
+        Get a buffer to patch in place. Edits never change the length of strings
+        or loops, so the layout stays valid.
+        """
+        if self._buffer is None:
+            self._buffer = bytearray(self._state_bytes)
+        self._state_bytes = None  # stale until state_bytes is read again
+        return self._buffer
+
+    def _byte_layout(self) -> _StateLayout:
+        if self._layout is None:
+            self._layout = _state_layout(self._current_bytes())
+        return self._layout
+
     @property
     def state_vals(self):
         return _parse_maze_state_bytes(self.state_bytes)
 
     @property
     def world_dim(self):
-        return self.state_vals["world_dim"].val
+        return _read_field(
+            self._current_bytes(), self._byte_layout(), "world_dim"
+        )
 
     def full_grid(self, with_mouse=True):
         "Get numpy (world_dim, world_dim) grid of the maze. Includes the mouse by default."
-        world_dim = self.world_dim
-        grid = np.array(
-            [dd["i"].val for dd in self.state_vals["data"]]
-        ).reshape(world_dim, world_dim)
+        grid = _grid_view(self._current_bytes(), self._byte_layout()).astype(
+            int
+        )
         if with_mouse:
             grid[self.mouse_pos] = MOUSE
 
@@ -369,20 +704,32 @@ class EnvState:
     @property
     def mouse_pos(self) -> Tuple[int, int]:
         "Get (x, y) position of mouse in grid."
-        ents = self.state_vals["ents"][0]
+        state_bytes, layout = self._current_bytes(), self._byte_layout()
+        x = _read_loop_field(state_bytes, layout, "ents", 0, "x")
+        y = _read_loop_field(state_bytes, layout, "ents", 0, "y")
         # flipped turns out to be oriented right for grid.
-        return int(ents["y"].val), int(ents["x"].val)
+        return int(y), int(x)
+
+    @property
+    def cheese_pos(self) -> Optional[Square]:
+        "Get (row, col) position of the cheese in the outer grid, or None if there is no cheese."
+        return get_cheese_pos(
+            _grid_view(self._current_bytes(), self._byte_layout())
+        )
 
     def set_mouse_pos(self, x: int, y: int):
         """
         Set the mouse position in the maze state bytes. Much more optimized than parsing and serializing the whole state.
         *WARNING*: This uses *outer coordinates*, not inner.
         """
-        # FIXME(slow): grabbing state_vals requires a call to parse the state bytes.
-        state_vals = self.state_vals
-        state_vals["ents"][0]["x"].val = float(y) + 0.5
-        state_vals["ents"][0]["y"].val = float(x) + 0.5
-        self.state_bytes = _serialize_maze_state(state_vals)
+        buffer, layout = self._writable_buffer(), self._byte_layout()
+        # flip again to get back to original orientation
+        _write_loop_field(buffer, layout, "ents", 0, "x", float(y) + 0.5)
+        _write_loop_field(buffer, layout, "ents", 0, "y", float(x) + 0.5)
+
+    def _writable_grid(self) -> np.ndarray:
+        "View of the grid block which patches the state bytes when written to."
+        return _grid_view(self._writable_buffer(), self._byte_layout())
 
     def set_grid(self, grid: np.ndarray, pad=False):
         """
@@ -392,24 +739,310 @@ class EnvState:
             grid = outer_grid(grid, assert_=False)
         assert grid.shape == (self.world_dim, self.world_dim)
 
-        state_vals = self.state_vals
         grid = grid.copy()  # might need to remove mouse if in grid
         if (grid == MOUSE).sum() > 0:
             x, y = get_mouse_pos(grid)
+            self.set_mouse_pos(x, y)
+            grid[x, y] = EMPTY
 
-            state_vals["ents"][0]["x"].val = (
-                float(y) + 0.5
-            )  # flip again to get back to original orientation
-            state_vals["ents"][0]["y"].val = float(x) + 0.5
+        self._writable_grid()[:] = grid
 
-            grid[x, y] = EMPTY
+    def remove_cheese(self):
+        "Replace any cheese in the grid with an empty square."
+        grid = self._writable_grid()
+        grid[grid == CHEESE] = EMPTY
+
+    def set_cheese_pos(self, x: int, y: int):
+        """
+        Move the cheese to (x, y), removing it from its old square.
+        *WARNING*: This uses *outer coordinates*, not inner.
+        """
+        grid = self._writable_grid()
+        grid[grid == CHEESE] = EMPTY
+        grid[x, y] = CHEESE
 
-        world_dim = state_vals["world_dim"].val
-        assert grid.shape == (world_dim, world_dim)
-        for i, dd in enumerate(state_vals["data"]):
-            dd["i"].val = int(grid.ravel()[i])
 
-        self.state_bytes = _serialize_maze_state(state_vals)
+class StateBatch:
+    """
+    N maze states held as rows of an (N, max_len) uint8 array, for editing many
+    states at once. The rand_gen strings vary in length, so states don't always
+    share a layout; offsets are therefore kept per state.
+
+    *WARNING*: Positions use *outer coordinates* (row, col), like EnvState.
+    """
+
+    def __init__(self, state_bytes_list: typing.Sequence[bytes]):
+        self.lengths = np.array(
+            [len(sb) for sb in state_bytes_list], dtype=int
+        )
+        self.data = np.zeros(
+            (len(state_bytes_list), self.lengths.max(initial=0)),
+            dtype=np.uint8,
+        )
+        for i, state_bytes in enumerate(state_bytes_list):
+            self.data[i, : len(state_bytes)] = np.frombuffer(
+                state_bytes, dtype=np.uint8
+            )
+        self.layouts = [_state_layout(sb) for sb in state_bytes_list]
+        self._offsets = {}
+
+    @classmethod
+    def from_states(cls, states: typing.Iterable) -> "StateBatch":
+        "Make a batch from EnvStates and/or state bytes."
+        return cls(
+            [s.state_bytes if isinstance(s, EnvState) else s for s in states]
+        )
+
+    @classmethod
+    def from_levels(cls, levels: typing.Iterable) -> "StateBatch":
+        "Make a batch from level seeds (their initial states), EnvStates and/or state bytes."
+        return cls.from_states(
+            (
+                _state_bytes_from_seed(int(level))
+                if isinstance(level, (int, np.integer))
+                else level
+            )
+            for level in levels
+        )
+
+    @classmethod
+    def from_venv(cls, venv) -> "StateBatch":
+        return cls(venv.env.callmethod("get_state"))
+
+    @classmethod
+    def from_template(cls, state_bytes: bytes, num: int) -> "StateBatch":
+        "Make a batch of num copies of one state, e.g. to edit into variants."
+        batch = cls([])
+        batch.lengths = np.full(num, len(state_bytes), dtype=int)
+        batch.data = np.tile(
+            np.frombuffer(state_bytes, dtype=np.uint8), (num, 1)
+        )
+        batch.layouts = [_state_layout(state_bytes)] * num
+        return batch
+
+    def __len__(self) -> int:
+        return len(self.layouts)
+
+    def __getitem__(self, idx: int) -> EnvState:
+        return EnvState(self.data[idx, : self.lengths[idx]].tobytes())
+
+    def select(self, rows) -> "StateBatch":
+        "A new batch of the states at rows, an index array or boolean mask."
+        rows = np.arange(len(self))[rows]
+        batch = StateBatch([])
+        batch.data = self.data[rows]
+        batch.lengths = self.lengths[rows]
+        batch.layouts = [self.layouts[i] for i in rows]
+        return batch
+
+    def to_state_bytes(self) -> List[bytes]:
+        "The states as a list of bytes, e.g. for venv.env.callmethod('set_state', ...)."
+        return [
+            row[:length].tobytes()
+            for row, length in zip(self.data, self.lengths)
+        ]
+
+    # Offsets and raw access
+
+    def _field_offsets(self, *key) -> np.ndarray:
+        """
+        Per-state byte offsets of a top-level field (name,) or a loop field
+        (loop_name, i, name).
+        """
+        if key not in self._offsets:
+            if len(key) == 1:
+                offsets = [layout.fields[key[0]][1] for layout in self.layouts]
+            else:
+                offsets = [
+                    _loop_field_offset(layout, *key)[1]
+                    for layout in self.layouts
+                ]
+            self._offsets[key] = np.array(offsets, dtype=int)
+        return self._offsets[key]
+
+    def _field_type(self, *key) -> str:
+        if len(key) == 1:
+            return self.layouts[0].fields[key[0]][0]
+        return _loop_field_offset(self.layouts[0], *key)[0]
+
+    def _read_block(
+        self, offsets: np.ndarray, count: int, dtype
+    ) -> np.ndarray:
+        "Read count values of dtype from each state, starting at its offset."
+        dtype = np.dtype(dtype)
+        out = np.empty((len(self), count), dtype=dtype)
+        # States of one level nearly always share offsets, so this loop is short
+        for offset in np.unique(offsets):
+            rows = offsets == offset
+            block = self.data[rows, offset : offset + count * dtype.itemsize]
+            out[rows] = block.view(dtype)
+        return out
+
+    def _write_block(self, offsets: np.ndarray, values, dtype):
+        "Write values, of shape (N, count) or broadcastable to it, at the offsets."
+        if len(self) == 0:
+            return
+        values = np.asarray(values, dtype=dtype).reshape(len(self), -1)
+        raw = np.ascontiguousarray(values).view(np.uint8)
+        for offset in np.unique(offsets):
+            rows = offsets == offset
+            self.data[rows, offset : offset + raw.shape[1]] = raw[rows]
+
+    def field(self, name: str) -> np.ndarray:
+        "Get the int or float top-level field name of every state, e.g. 'maze_dim'."
+        dtype = _FIELD_FORMATS[self._field_type(name)][1:]
+        return self._read_block(self._field_offsets(name), 1, dtype)[:, 0]
+
+    def set_field(self, name: str, values):
+        "Set the int or float top-level field name of every state."
+        dtype = _FIELD_FORMATS[self._field_type(name)][1:]
+        values = np.broadcast_to(values, (len(self),))
+        self._write_block(self._field_offsets(name), values, dtype)
+
+    @property
+    def records(self) -> np.ndarray:
+        """
+        Structured (N,) view of the int and float fields, plus the 'ents' and
+        'data' loops. Writes go through to the states. Only available when all
+        states share a layout.
+        """
+        layout = self.layouts[0] if self.layouts else None
+        if layout is None or any(l is not layout for l in self.layouts):
+            raise ValueError(
+                "States don't share a layout, use field/set_field instead"
+            )
+        names, formats, offsets = [], [], []
+        for name, (typ, offset) in layout.fields.items():
+            if typ in _FIELD_FORMATS:
+                names.append(name)
+                formats.append(_FIELD_FORMATS[typ][1:])
+                offsets.append(offset)
+        for name, loop in layout.loops.items():
+            elem_dtype = np.dtype(
+                {
+                    "names": list(loop.fields),
+                    "formats": [
+                        _FIELD_FORMATS[typ][1:]
+                        for typ, _ in loop.fields.values()
+                    ],
+                    "offsets": [offset for _, offset in loop.fields.values()],
+                    "itemsize": loop.stride,
+                }
+            )
+            names.append(name)
+            formats.append((elem_dtype, (loop.count,)))
+            offsets.append(loop.offset)
+        dtype = np.dtype(
+            {
+                "names": names,
+                "formats": formats,
+                "offsets": offsets,
+                "itemsize": layout.size,
+            }
+        )
+        return self.data.view(dtype)[:, 0]
+
+    # Vectorized edits
+
+    @property
+    def world_dim(self) -> int:
+        world_dims = np.unique(self.field("world_dim"))
+        if len(world_dims) != 1:
+            raise ValueError(f"States have different world dims {world_dims}")
+        return int(world_dims[0])
+
+    def grids(self, with_mouse=True) -> np.ndarray:
+        "Get the (N, world_dim, world_dim) grids. Includes the mouse by default."
+        world_dim = self.world_dim
+        grids = self._read_block(
+            self._field_offsets("data", 0, "i"), world_dim**2, np.intc
+        )
+        grids = grids.reshape(-1, world_dim, world_dim).astype(int)
+        if with_mouse:
+            rows, cols = self.mouse_positions().T
+            grids[np.arange(len(self)), rows, cols] = MOUSE
+        return grids
+
+    def set_grids(self, grids: np.ndarray):
+        """
+        Set the grids from an (N, world_dim, world_dim) array, or one grid for all
+        states. States whose grid contains the mouse get their mouse moved there.
+        """
+        world_dim = self.world_dim
+        grids = np.array(
+            np.broadcast_to(grids, (len(self), world_dim, world_dim))
+        )
+        flat = grids.reshape(len(self), -1)
+        has_mouse = (flat == MOUSE).any(axis=1)
+        if has_mouse.any():
+            positions = self.mouse_positions()
+            mouse_idx = (flat == MOUSE).argmax(axis=1)
+            positions[has_mouse] = np.stack(
+                np.unravel_index(mouse_idx[has_mouse], grids.shape[1:]), axis=1
+            )
+            self.set_mouse_positions(positions)
+            flat[flat == MOUSE] = EMPTY
+        self._write_block(self._field_offsets("data", 0, "i"), flat, np.intc)
+
+    def mouse_positions(self) -> np.ndarray:
+        "Get the (N, 2) outer (row, col) positions of the mice."
+        x = self._read_block(self._field_offsets("ents", 0, "x"), 1, np.single)
+        y = self._read_block(self._field_offsets("ents", 0, "y"), 1, np.single)
+        # flipped turns out to be oriented right for grid, as in EnvState
+        return np.concatenate([y, x], axis=1).astype(int)
+
+    def set_mouse_positions(self, positions: np.ndarray):
+        "Set the mice to the (N, 2) outer (row, col) positions, or one position for all."
+        positions = np.broadcast_to(positions, (len(self), 2))
+        self._write_block(
+            self._field_offsets("ents", 0, "x"),
+            positions[:, 1] + 0.5,
+            np.single,
+        )
+        self._write_block(
+            self._field_offsets("ents", 0, "y"),
+            positions[:, 0] + 0.5,
+            np.single,
+        )
+
+    def object_positions(self, obj_value: int) -> np.ndarray:
+        """
+        Get the (N, 2) outer (row, col) position of the first obj_value square of
+        each grid, or (-1, -1) where there is none.
+        """
+        flat = self.grids(with_mouse=obj_value == MOUSE).reshape(len(self), -1)
+        found = flat == obj_value
+        idx = found.argmax(axis=1)
+        positions = np.stack(
+            np.unravel_index(idx, (self.world_dim, self.world_dim)), axis=1
+        )
+        positions[~found.any(axis=1)] = -1
+        return positions
+
+    def cheese_positions(self) -> np.ndarray:
+        return self.object_positions(CHEESE)
+
+    def remove_cheese(self):
+        "Replace any cheese in the grids with empty squares."
+        grids = self.grids(with_mouse=False)
+        grids[grids == CHEESE] = EMPTY
+        self._write_block(
+            self._field_offsets("data", 0, "i"),
+            grids.reshape(len(self), -1),
+            np.intc,
+        )
+
+    def move_cheese(self, positions: np.ndarray):
+        "Move the cheese to the (N, 2) outer (row, col) positions, or one position for all."
+        positions = np.broadcast_to(positions, (len(self), 2))
+        grids = self.grids(with_mouse=False)
+        grids[grids == CHEESE] = EMPTY
+        grids[np.arange(len(self)), positions[:, 0], positions[:, 1]] = CHEESE
+        self._write_block(
+            self._field_offsets("data", 0, "i"),
+            grids.reshape(len(self), -1),
+            np.intc,
+        )
 
 
 # ============== Grid helpers ==============
@@ -438,12 +1071,10 @@ def remove_cheese(venv, idx: int = 0):
     Remove the cheese from the grid, modifying venv in-place.
     """
     state_bytes_list = venv.env.callmethod("get_state")
-    state = state_from_venv(venv, idx)
+    state = EnvState(state_bytes_list[idx])
 
     # TODO(uli): The multiple sources of truth here suck. Ideally one object linked to venv auto-updates(?)
-    grid = state.full_grid()
-    grid[grid == CHEESE] = EMPTY
-    state.set_grid(grid)
+    state.remove_cheese()
     state_bytes_list[idx] = state.state_bytes
     venv.env.callmethod("set_state", state_bytes_list)
     return venv
@@ -457,12 +1088,9 @@ def move_cheese(venv, new_pos: Tuple[int, int], idx: int = 0):
         0 <= new_pos[0] < WORLD_DIM and 0 <= new_pos[1] < WORLD_DIM
     ), f"new_pos={new_pos} out of bounds"
     state_bytes_list = venv.env.callmethod("get_state")
-    state = state_from_venv(venv, idx)
+    state = EnvState(state_bytes_list[idx])
 
-    grid = state.full_grid()
-    grid[grid == CHEESE] = EMPTY
-    grid[new_pos] = CHEESE
-    state.set_grid(grid)
+    state.set_cheese_pos(*new_pos)
     state_bytes_list[idx] = state.state_bytes
     venv.env.callmethod("set_state", state_bytes_list)
     return venv
@@ -472,14 +1100,9 @@ def remove_all_cheese(venv):
     """
     Remove the cheese from each env in venv, inplace.
     """
-    state_bytes_list = venv.env.callmethod("get_state")
-    states = [EnvState(state_bytes) for state_bytes in state_bytes_list]
-    for i, s in enumerate(states):
-        g = s.full_grid()
-        g[g == CHEESE] = EMPTY
-        s.set_grid(g)
-        state_bytes_list[i] = s.state_bytes
-    venv.env.callmethod("set_state", state_bytes_list)
+    batch = StateBatch.from_venv(venv)
+    batch.remove_cheese()
+    venv.env.callmethod("set_state", batch.to_state_bytes())
     return venv
 
 
@@ -619,38 +1242,331 @@ def reconstruct_path(
     return path
 
 
+class MazeTree:
+    """
+    Rooted index of the open squares of an (inner) grid, for path queries
+    without a search per query. On-distribution mazes are spanning trees, so
+    the path between two squares goes through their lowest common ancestor,
+    found in O(1) with a sparse table over an Euler tour. Grids with cycles
+    or unreachable squares (e.g. made by editing) fall back to a BFS per
+    query source.
+
+    Squares are (row, col) tuples in inner grid coordinates. Use
+    get_maze_tree(grid) to reuse the tree of a grid across calls.
+    """
+
+    def __init__(self, grid: np.ndarray, root: Square = (0, 0)):
+        self.grid = inner_grid(grid).copy()
+        self.root = tuple(root)
+        self.shape = self.grid.shape
+        self.graph = GridGraph(self.grid)
+
+        # BFS from the root; it's a tree if it reaches every open square,
+        # with one edge less than squares
+        order, parent = self.graph.bfs(self.root)
+        self.order = np.array(order, dtype=np.intp)
+        self.parent = np.array(parent, dtype=np.intp)
+        self.depth = self._depths(order, parent)
+        self.is_tree = (
+            len(order) == (self.grid != BLOCKED).sum()
+            and self.graph.num_edges == len(order) - 1
+        )
+        self._bfs_cache = {}
+        if self.is_tree:
+            self._build_lca()
+
+    def _index(self, sq: Square) -> int:
+        return sq[0] * self.shape[1] + sq[1]
+
+    def _square(self, idx: int) -> Square:
+        return divmod(int(idx), self.shape[1])
+
+    def _depths(self, order: List[int], parent: List[int]) -> np.ndarray:
+        "Depth of each square in a BFS tree, -1 where unreachable"
+        depth = [-1] * self.grid.size
+        depth[order[0]] = 0
+        for node in order[1:]:
+            depth[node] = depth[parent[node]] + 1
+        return np.array(depth, dtype=np.intp)
+
+    def _build_lca(self):
+        "Euler tour of the tree, and a sparse table of its shallowest nodes"
+        children = {int(node): [] for node in self.order}
+        for node in self.order[1:]:
+            children[int(self.parent[node])].append(int(node))
+
+        tour = []
+        stack = [(int(self.order[0]), 0)]
+        while stack:
+            node, child_idx = stack.pop()
+            tour.append(node)
+            if child_idx < len(children[node]):
+                stack.append((node, child_idx + 1))
+                stack.append((children[node][child_idx], 0))
+        self._tour = np.array(tour, dtype=np.intp)
+        self._first = np.full(self.grid.size, -1, dtype=np.intp)
+        self._first[self._tour[::-1]] = np.arange(len(tour))[::-1]
+
+        # table[k, i] is the shallowest node in tour[i : i + 2**k]
+        table = [self._tour]
+        while 2 ** len(table) <= len(tour):
+            prev, half = table[-1], 2 ** (len(table) - 1)
+            left, right = prev[:-half], prev[half:]
+            shallowest = np.where(
+                self.depth[left] <= self.depth[right], left, right
+            )
+            table.append(np.pad(shallowest, (0, len(tour) - len(shallowest))))
+        self._table = np.stack(table)
+
+    def _lca_idx(self, a, b):
+        "LCA of node indices a and b, which may be arrays"
+        if np.ndim(a) == 0 and np.ndim(b) == 0:
+            lo, hi = sorted((int(self._first[a]), int(self._first[b])))
+            level = (hi - lo + 1).bit_length() - 1
+            left = int(self._table[level, lo])
+            right = int(self._table[level, hi - 2**level + 1])
+            return left if self.depth[left] <= self.depth[right] else right
+        first_a, first_b = self._first[a], self._first[b]
+        lo, hi = np.minimum(first_a, first_b), np.maximum(first_a, first_b)
+        level = np.log2(hi - lo + 1).astype(np.intp)
+        left = self._table[level, lo]
+        right = self._table[level, hi - 2**level + 1]
+        return np.where(self.depth[left] <= self.depth[right], left, right)
+
+    def _bfs(self, source: int) -> Tuple[np.ndarray, np.ndarray]:
+        "(parent, distance) arrays of a BFS from source, for non-tree grids"
+        if source not in self._bfs_cache:
+            order, parent = self.graph.bfs(self._square(source))
+            self._bfs_cache[source] = (
+                np.array(parent, dtype=np.intp),
+                self._depths(order, parent),
+            )
+        return self._bfs_cache[source]
+
+    def _climb(self, parent: np.ndarray, node: int, stop: int) -> List[int]:
+        "Nodes from node up to (and including) stop, following parent"
+        nodes = [node]
+        while nodes[-1] != stop:
+            nodes.append(int(parent[nodes[-1]]))
+        return nodes
+
+    def lca(self, a: Square, b: Square) -> Square:
+        "The lowest common ancestor of a and b, with the tree rooted at root"
+        assert self.is_tree, "lca is only defined on tree grids"
+        return self._square(self._lca_idx(self._index(a), self._index(b)))
+
+    def distance(self, a: Square, b: Square) -> int:
+        "Number of steps between a and b, or -1 if b can't be reached from a"
+        a_idx, b_idx = self._index(a), self._index(b)
+        if self.is_tree:
+            lca = self._lca_idx(a_idx, b_idx)
+            return int(
+                self.depth[a_idx] + self.depth[b_idx] - 2 * self.depth[lca]
+            )
+        return int(self._bfs(a_idx)[1][b_idx])
+
+    def distances(self, a: Square) -> np.ndarray:
+        "Grid of the number of steps from a to every square, -1 where unreachable"
+        a_idx = self._index(a)
+        if not self.is_tree:
+            return self._bfs(a_idx)[1].reshape(self.shape).copy()
+        dist = np.full(self.grid.size, -1, dtype=np.intp)
+        lca = self._lca_idx(a_idx, self.order)
+        dist[self.order] = (
+            self.depth[a_idx] + self.depth[self.order] - 2 * self.depth[lca]
+        )
+        return dist.reshape(self.shape)
+
+    def path(self, a: Square, b: Square) -> List[Square]:
+        "The squares from a to b inclusive, or [] if b can't be reached from a"
+        a_idx, b_idx = self._index(a), self._index(b)
+        if self.is_tree:
+            lca = self._lca_idx(a_idx, b_idx)
+            up = self._climb(self.parent, a_idx, lca)
+            down = self._climb(self.parent, b_idx, lca)[::-1]
+            nodes = up + down[1:]
+        else:
+            parent, dist = self._bfs(a_idx)
+            if dist[b_idx] < 0:
+                return []
+            nodes = self._climb(parent, b_idx, a_idx)[::-1]
+        return [self._square(node) for node in nodes]
+
+    def next_step(self, a: Square, b: Square) -> Optional[Square]:
+        "The square after a on the path from a to b, or None if a == b or b is unreachable"
+        if not self.is_tree:
+            path = self.path(a, b)
+            return path[1] if len(path) > 1 else None
+        a_idx, b_idx = self._index(a), self._index(b)
+        if a_idx == b_idx:
+            return None
+        if self._lca_idx(a_idx, b_idx) != a_idx:
+            return self._square(self.parent[a_idx])
+        # b is below a: the ancestor of b one level below a
+        node = b_idx
+        while self.parent[node] != a_idx:
+            node = self.parent[node]
+        return self._square(node)
+
+    def decision_square(
+        self, cheese: Optional[Square] = None, target: Optional[Square] = None
+    ) -> Optional[Square]:
+        """
+        The last square the paths from the root to the cheese and to target
+        (default: the top right) share, or None if one path contains the other.
+        """
+        if cheese is None:
+            cheese = get_cheese_pos(self.grid)
+        if target is None:
+            target = (self.shape[0] - 1, self.shape[1] - 1)
+        if self.is_tree:
+            sq = self.lca(cheese, target)
+            return None if sq in (tuple(cheese), tuple(target)) else sq
+        path_to_cheese = self.path(self.root, cheese)
+        path_to_target = self.path(self.root, target)
+        for i, (n1, n2) in enumerate(zip(path_to_cheese, path_to_target)):
+            if n1 != n2:
+                return path_to_cheese[i - 1]
+        return None
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.grid, self.parent, self.depth, self.order]
+        if self.is_tree:
+            arrays += [self._tour, self._first, self._table]
+        return sum(a.nbytes for a in arrays)
+
+
+@lru_cache(maxbytes=64 * 2**20, sizeof=lambda tree: tree.nbytes)
+def _maze_tree(
+    grid_bytes: bytes, shape: Tuple[int, int], root: Square
+) -> MazeTree:
+    grid = np.frombuffer(grid_bytes, dtype=np.int64).reshape(shape)
+    return MazeTree(grid, root=root)
+
+
+def get_maze_tree(grid: np.ndarray, root: Square = (0, 0)) -> MazeTree:
+    "The MazeTree of the inner grid of grid, cached by grid and root."
+    grid = np.ascontiguousarray(inner_grid(grid), dtype=np.int64)
+    return _maze_tree(grid.tobytes(), grid.shape, tuple(root))
+
+
+# Reasons validate_grids gives for a grid being off distribution, in the order
+# they are checked
+ON_DISTRIBUTION = 0
+WRONG_MOUSE_COUNT = 1
+WRONG_CHEESE_COUNT = 2
+ODD_SQUARE_OPEN = 3
+EVEN_SQUARE_BLOCKED = 4
+DISCONNECTED = 5
+HAS_CYCLE = 6
+INVALID_REASONS = {
+    WRONG_MOUSE_COUNT: "grid has {mice} mice",
+    WRONG_CHEESE_COUNT: "grid has {cheeses} cheeses",
+    ODD_SQUARE_OPEN: "Squares where row,col are both odd must always be blocked",
+    EVEN_SQUARE_BLOCKED: "Squares where row,col are both even must always be empty",
+    DISCONNECTED: "There must be exactly one path between any two empty squares",
+    HAS_CYCLE: "There must be exactly one path between any two empty squares",
+}
+
+# Label squares of each grid in a stack, connecting them only within the grid
+_GRID_STACK_STRUCTURE = np.zeros((3, 3, 3), dtype=bool)
+_GRID_STACK_STRUCTURE[1] = [[0, 1, 0], [1, 1, 1], [0, 1, 0]]
+
+
+def _tree_codes(is_open: np.ndarray) -> np.ndarray:
+    """
+    DISCONNECTED, HAS_CYCLE or ON_DISTRIBUTION for each of the (N, H, W) masks
+    of open squares. The open squares form a tree iff they are connected and
+    there is one fewer edge than squares.
+    """
+    num_squares = is_open.sum(axis=(1, 2))
+    num_edges = (is_open[:, 1:, :] & is_open[:, :-1, :]).sum(axis=(1, 2)) + (
+        is_open[:, :, 1:] & is_open[:, :, :-1]
+    ).sum(axis=(1, 2))
+
+    # Labels are numbered in scan order, so each grid's are one contiguous range
+    labels, _ = ndimage.label(is_open, structure=_GRID_STACK_STRUCTURE)
+    max_labels = np.maximum.accumulate(labels.reshape(len(labels), -1).max(1))
+    num_components = np.diff(max_labels, prepend=0)
+
+    return np.select(
+        [num_components != 1, num_edges != num_squares - 1],
+        [DISCONNECTED, HAS_CYCLE],
+        ON_DISTRIBUTION,
+    ).astype(np.int8)
+
+
+def _rings(height: int, width: int) -> np.ndarray:
+    "(height, width) array of how many rings in from the edge each square is"
+    rows, cols = np.indices((height, width))
+    return np.minimum(
+        np.minimum(rows, height - 1 - rows), np.minimum(cols, width - 1 - cols)
+    )
+
+
+def _paddings(grids: np.ndarray) -> np.ndarray:
+    "The padding inner_grid strips from each of the (N, H, W) grids"
+    # The innermost ring with an open square
+    ring = _rings(*grids.shape[1:])
+    return np.where(grids != BLOCKED, ring, ring.max() + 1).min(axis=(1, 2))
+
+
+def _validate_chunk(grids: np.ndarray, full: bool) -> np.ndarray:
+    rows, cols = np.indices(grids.shape[1:])
+    g = np.where(np.isin(grids, (CHEESE, MOUSE)), EMPTY, grids)
+    padding = _paddings(g)[:, None, None]
+    inside = _rings(*grids.shape[1:]) >= padding
+    odd_row, odd_col = (rows - padding) % 2 == 1, (cols - padding) % 2 == 1
+
+    conditions = []
+    if full:
+        conditions += [
+            (grids == MOUSE).sum(axis=(1, 2)) != 1,
+            (grids == CHEESE).sum(axis=(1, 2)) != 1,
+        ]
+    conditions += [
+        (inside & odd_row & odd_col & (g != BLOCKED)).any(axis=(1, 2)),
+        (inside & ~odd_row & ~odd_col & (g != EMPTY)).any(axis=(1, 2)),
+    ]
+    reasons = [WRONG_MOUSE_COUNT, WRONG_CHEESE_COUNT] if full else []
+    reasons += [ODD_SQUARE_OPEN, EVEN_SQUARE_BLOCKED]
+    codes = np.select(conditions, reasons, ON_DISTRIBUTION).astype(np.int8)
+
+    valid = codes == ON_DISTRIBUTION
+    if valid.any():
+        codes[valid] = _tree_codes(g[valid] != BLOCKED)
+    return codes
+
+
+def validate_grids(
+    grids: np.ndarray, full: bool = False, chunk_size: int = 10_000
+) -> np.ndarray:
+    """
+    Batched on_distribution: the reason code each of the (N, H, W) inner or
+    outer grids is off distribution, ON_DISTRIBUTION (0) for those that aren't.
+    Grids may have different paddings; INVALID_REASONS describes the codes.
+    Filter a generated set with grids[validate_grids(grids) == 0].
+    """
+    grids = np.asarray(grids)
+    if grids.ndim == 2:
+        grids = grids[None]
+    codes = np.empty(len(grids), dtype=np.int8)
+    for start in range(0, len(grids), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        codes[chunk] = _validate_chunk(grids[chunk], full)
+    return codes
+
+
 def is_tree(grid: np.ndarray, debug=False) -> bool:
     """
     Is there exactly one path between any two empty squares in the maze?
     (Also known as, is the set of empty squares a spanning tree)
     """
-    grid = inner_grid(grid).copy()
-    grid[grid == CHEESE] = EMPTY
-
-    visited_edges = set()
-    visited_nodes = set()
-    stack = [(0, 0)]
-    while stack:
-        node = stack.pop()
-        if node in visited_nodes:
-            if debug:
-                print(f"{node} already visited, a cycle!")
-            return False
-        visited_nodes.add(node)
-        for neighbor in get_empty_neighbors(grid, *node):
-            edge = (node, neighbor)
-            if edge not in visited_edges and edge[::-1] not in visited_edges:
-                stack.append(neighbor)
-                visited_edges.add(edge)
-
-    # There were no cycles, if we visited all the nodes, then it's a tree
-    visited_all_nodes = len(visited_nodes) == (grid == EMPTY).sum()
-    if debug:
-        print(
-            f"visited {len(visited_nodes)} out of"
-            f" {(grid == EMPTY).sum()} nodes"
-        )
-    return visited_all_nodes
+    code = _tree_codes((np.asarray(grid) != BLOCKED)[None])[0]
+    if debug and code != ON_DISTRIBUTION:
+        print("not connected" if code == DISCONNECTED else "a cycle!")
+    return code == ON_DISTRIBUTION
 
 
 def on_distribution(
@@ -660,37 +1576,18 @@ def on_distribution(
     Is the given *maze* something that could have been generated during training?
     If full is passed the maze must include a single mouse and cheese.
     """
+    code = validate_grids(grid, full=full)[0]
+    if code != ON_DISTRIBUTION:
+        p(
+            INVALID_REASONS[code].format(
+                mice=(grid == MOUSE).sum(), cheeses=(grid == CHEESE).sum()
+            )
+        )
+    return code == ON_DISTRIBUTION
 
-    # Make a copy of the inner grid without the cheese and mouse
-    g = inner_grid(grid).copy()
-    if full:
-        if (g == MOUSE).sum() != 1:
-            p(f"grid has {(g == MOUSE).sum()} mice")
-            return False
-        if (g == CHEESE).sum() != 1:
-            p(f"grid has {(g == CHEESE).sum()} cheeses")
-            return False
-
-    # For the rest of the checks, we don't care about the mouse or cheese
-    g[g == CHEESE] = EMPTY
-    g[g == MOUSE] = EMPTY
-
-    # Assert invariants
-    if not (g[1::2, 1::2] == BLOCKED).all():
-        p("Squares where row,col are both odd must always be blocked")
-        return False
-    if not (g[0::2, 0::2] == EMPTY).all():
-        p("Squares where row,col are both even must always be empty")
-        return False
-    if not is_tree(g):
-        p("There must be exactly one path between any two empty squares")
-        return False
-
-    return True
-
-
-def venv_from_grid(grid: np.ndarray) -> ProcgenGym3Env:  #
-    "Get a venv with the given inner grid"
+
+def _place_mouse(grid: np.ndarray) -> np.ndarray:
+    "Copy of grid with the mouse on the first open square of the diagonal, if it has no mouse"
     grid_copy = grid.copy()
     n_mice = (grid_copy == MOUSE).sum()
     if n_mice == 0:
@@ -705,11 +1602,20 @@ def venv_from_grid(grid: np.ndarray) -> ProcgenGym3Env:  #
     assert (grid_copy == MOUSE).sum() == 1, "grid has {} mice".format(
         (grid_copy == MOUSE).sum()
     )
+    return grid_copy
+
+
+def _state_bytes_from_grid(grid: np.ndarray) -> bytes:
+    "Get the state bytes of a level with the given inner grid"
+    state = get_envstate_from_seed(0)
+    state.set_grid(_place_mouse(grid), pad=True)
+    return state.state_bytes
+
 
+def venv_from_grid(grid: np.ndarray) -> ProcgenGym3Env:
+    "Get a venv with the given inner grid"
     venv = create_venv(num=1, num_levels=1, start_level=0)
-    state = state_from_venv(venv, idx=0)
-    state.set_grid(grid_copy, pad=True)
-    venv.env.callmethod("set_state", [state.state_bytes])
+    venv.env.callmethod("set_state", [_state_bytes_from_grid(grid)])
     return venv
 
 
@@ -721,7 +1627,7 @@ def get_filled_venv(fill_type: int = EMPTY) -> ProcgenGym3Env:
     for block_type in (BLOCKED, CHEESE, EMPTY):
         grid[grid == block_type] = fill_type
     grid[mouse_pos] = MOUSE  # Don't overwrite the mouse
-    return venv_from_grid(grid_copy=grid)
+    return venv_from_grid(grid)
 
 
 def get_padding(grid: np.ndarray) -> int:
@@ -740,27 +1646,16 @@ def inside_inner_grid(grid: np.ndarray, row: int, col: int) -> bool:
 
 def render_inner_grid(grid: np.ndarray):
     """Extract the human-sensible view given grid, assumed to be an inner_grid. Return the human view."""
-    venv = venv_from_grid(grid)
-    human_view = venv.env.get_info()[0]["rgb"]
-
-    # Cut out the padding from the view. The padding is the walls around the maze.
-    padding = get_padding(grid)
-    rescale = human_view.shape[0] / WORLD_DIM
+    from procgen_tools import rendering  # rendering imports this module
 
-    return (
-        human_view[
-            int(padding * rescale) : int(-padding * rescale),
-            int(padding * rescale) : int(-padding * rescale),
-        ]
-        if padding > 0
-        else human_view
-    )
+    return rendering.render_human(_place_mouse(grid), crop_padding=True)
 
 
 def render_outer_grid(grid: np.ndarray):
     """Extract the human-sensible view given grid, assumed to be an outer_grid. Return the human view."""
-    venv = venv_from_grid(grid)
-    return venv.env.get_info()[0]["rgb"]
+    from procgen_tools import rendering
+
+    return rendering.render_human(_place_mouse(grid))
 
 
 def grid_editor(
@@ -928,21 +1823,130 @@ def maze_grid_to_graph(inner_grid):
     return graph
 
 
+class GridGraph:
+    """
+    Graph of the open squares of an inner grid in CSR form: the neighbors of
+    square i are indices[indptr[i]:indptr[i + 1]], with squares numbered
+    row * cols + col and blocked squares having no neighbors. Built with numpy
+    instead of networkx, and accepted by the graph functions below wherever a
+    maze_grid_to_graph graph is.
+    """
+
+    def __init__(self, inner_grid: np.ndarray):
+        self.shape = inner_grid.shape
+        rows, cols = self.shape
+        is_open = inner_grid != BLOCKED
+        idx = np.arange(inner_grid.size).reshape(self.shape)
+
+        # Neighbors up, left, right, down, so each row of indices is sorted
+        padded = np.pad(is_open, 1, constant_values=False)
+        neighbor_open = (
+            np.stack(
+                [
+                    padded[:-2, 1:-1],
+                    padded[1:-1, :-2],
+                    padded[1:-1, 2:],
+                    padded[2:, 1:-1],
+                ],
+                axis=-1,
+            )
+            & is_open[..., None]
+        )
+        neighbors = idx[..., None] + np.array([-cols, -1, 1, cols])
+        self.indices = neighbors[neighbor_open]
+        self.indptr = np.concatenate(
+            [[0], np.cumsum(neighbor_open.sum(axis=-1).ravel())]
+        )
+        self.num_edges = len(self.indices) // 2
+        self._neighbors = None
+        self._bfs_cache = {}
+
+    @property
+    def adjacency(self) -> scipy.sparse.csr_matrix:
+        "The adjacency matrix, e.g. for scipy.sparse.csgraph"
+        return scipy.sparse.csr_matrix(
+            (
+                np.ones(len(self.indices), dtype=np.int8),
+                self.indices,
+                self.indptr,
+            ),
+            shape=(len(self.indptr) - 1,) * 2,
+        )
+
+    def _index(self, sq: Square) -> int:
+        return int(sq[0]) * self.shape[1] + int(sq[1])
+
+    def __contains__(self, sq: Square) -> bool:
+        "Is sq a node of the graph, i.e. an open square with an open neighbor?"
+        idx = self._index(sq)
+        return bool(self.indptr[idx + 1] > self.indptr[idx])
+
+    def neighbors(self, idx: int) -> List[int]:
+        if self._neighbors is None:
+            indices, indptr = self.indices.tolist(), self.indptr.tolist()
+            self._neighbors = [
+                indices[indptr[i] : indptr[i + 1]]
+                for i in range(len(indptr) - 1)
+            ]
+        return self._neighbors[idx]
+
+    def bfs(self, start: Square) -> Tuple[List[int], List[int]]:
+        "Squares reachable from start in BFS order, and BFS predecessors (-1 if none)"
+        start_idx = self._index(start)
+        if start_idx not in self._bfs_cache:
+            predecessors = [-1] * (len(self.indptr) - 1)
+            predecessors[start_idx] = start_idx
+            order = [start_idx]
+            for node in order:
+                for neighbor in self.neighbors(node):
+                    if predecessors[neighbor] < 0:
+                        predecessors[neighbor] = node
+                        order.append(neighbor)
+            predecessors[start_idx] = -1
+            self._bfs_cache[start_idx] = (order, predecessors)
+        return self._bfs_cache[start_idx]
+
+    def shortest_path(self, start: Square, end: Square) -> List[Square]:
+        "Like nx.shortest_path(graph, start, end) on the networkx graph"
+        if start not in self or end not in self:
+            raise nx.NodeNotFound(f"{start} or {end} not in the maze graph")
+        _, predecessors = self.bfs(start)
+        start_idx, node = self._index(start), self._index(end)
+        path = [node]
+        while node != start_idx:
+            node = predecessors[node]
+            if node < 0:
+                raise nx.NetworkXNoPath(f"No path between {start} and {end}")
+            path.append(node)
+        return [divmod(node, self.shape[1]) for node in path[::-1]]
+
+
+def maze_grid_to_csr(inner_grid: np.ndarray) -> GridGraph:
+    """Convert a provided maze inner grid to a GridGraph, a faster stand-in for maze_grid_to_graph"""
+    return GridGraph(inner_grid)
+
+
+def _graph_shortest_path(graph, start: Square, end: Square) -> List[Square]:
+    if isinstance(graph, GridGraph):
+        return graph.shortest_path(start, end)
+    return nx.shortest_path(graph, start, end)
+
+
 def grid_graph_has_decision_square(inner_grid, graph):
     cheese_node = get_cheese_pos(inner_grid)
     corner_node = (inner_grid.shape[0] - 1, inner_grid.shape[1] - 1)
-    pth = nx.shortest_path(graph, (0, 0), corner_node)
+    pth = _graph_shortest_path(graph, (0, 0), corner_node)
     return not cheese_node in pth
 
 
 def get_path_to_cheese(inner_grid, graph, start_node=(0, 0)):
     cheese_node = get_cheese_pos(inner_grid)
-    return nx.shortest_path(graph, start_node, cheese_node)
+    return _graph_shortest_path(graph, start_node, cheese_node)
 
 
 def get_path_to_corner(inner_grid, graph, start_node=(0, 0)):
     corner_node = (inner_grid.shape[0] - 1, inner_grid.shape[1] - 1)
-    return nx.shortest_path(graph, start_node, corner_node)
+    return _graph_shortest_path(graph, start_node, corner_node)
 
 
 def distance_to_tr_path(
@@ -951,19 +1955,15 @@ def distance_to_tr_path(
     """Computes the distance between a target and the path from the
     origin to the top-right square. If no `tr_path`
     is provided, then computes the path."""
+    tree = get_maze_tree(grid)
     if tr_path is None:
-        tr_path = pathfind(
-            grid, (0, 0), (grid.shape[0] - 1, grid.shape[1] - 1)
-        )
-    target_path: List[Square] = pathfind(grid, (0, 0), target)
+        tr_path = tree.path((0, 0), (grid.shape[0] - 1, grid.shape[1] - 1))
+    target_path: List[Square] = tree.path((0, 0), target)
     return len(set(target_path) - set(tr_path))
 
 
 def pathfind(grid: np.ndarray, start, end):
-    _, came_from, extra = shortest_path(
-        grid, start, stop_condition=lambda _, sq: sq == end
-    )
-    return reconstruct_path(came_from, extra["last_square"])
+    return get_maze_tree(grid).path(start, end)
 
 
 def geometric_probability_path(
@@ -971,62 +1971,100 @@ def geometric_probability_path(
 ) -> float:
     """Returns the geometric mean of `vf`'s probability of the path from
     `start` to `end` in the maze. If the path contains the cheese, the
-    cheese is ignored in the mean."""
+    cheese is ignored in the mean. Only the probabilities on the path are
+    looked up, so a visualization.LazyVectorField only evaluates those."""
     for coord in (start, end):
         assert (coord[i] >= 0 and coord[i] < MAZE_SIZE for i in (0, 1))
     if start == end:
-        idx: int = vf["legal_mouse_positions"].index(start)
-        return vf["probs"][idx][4]  # The no-op probability
-
-    path = pathfind(vf["grid"], start, end)
-    cheese_loc: Tuple[int, int] = get_cheese_pos(vf["grid"])
-
-    zipped_list = zip(vf["legal_mouse_positions"], vf["probs"])
-    prob_dict: Dict[Tuple[int, int], float] = dict(zipped_list)
-
-    sum_log_prob: float = 0.0
-    for idx, coord in enumerate(path[:-1]):
-        if coord == cheese_loc:
-            continue
-        action: str = None
-
-        # Get the action by looking at the next coord
-        for key, delta in models.MAZE_ACTION_DELTAS.items():
-            if (
-                coord[0] + delta[0] == path[idx + 1][0]
-                and coord[1] + delta[1] == path[idx + 1][1]
-            ):
-                action = key
-                break
-
-        if action is None:
-            raise ValueError(
-                "Invalid path; cannot find action which leads to next"
-                " coordinate"
-            )
-
-        # Get the probability of the action
-        action_index: int = list(models.MAZE_ACTION_INDICES.keys()).index(
-            action
+        return vf_prob_grid(vf, squares=[start])[start][4]  # The no-op prob
+
+    path = get_maze_tree(vf["grid"]).path(start, end)
+    probs = vf_prob_grid(vf, squares=path)
+    return geometric_probability_map(vf["grid"], probs, start)[end]
+
+
+def vf_prob_grid(
+    vf: Dict, squares: Optional[typing.Iterable[Square]] = None
+) -> np.ndarray:
+    """The (rows, cols, 5) array of `vf`'s action probabilities at each
+    square, in the order of models.MAZE_ACTION_INDICES; NaN at squares
+    without a mouse position. If squares is given, only the mouse positions
+    among them are filled in (and evaluated, if vf has a probs_at method)."""
+    grid = vf["grid"]
+    probs = np.full((*grid.shape, len(models.MAZE_ACTION_INDICES)), np.nan)
+    positions = vf["legal_mouse_positions"]
+    if squares is not None:
+        legal = set(positions)
+        positions = [tuple(sq) for sq in squares if tuple(sq) in legal]
+    if len(positions) == 0:
+        return probs
+
+    if squares is None:
+        values = vf["probs"]
+    elif hasattr(vf, "probs_at"):
+        values = vf.probs_at(positions)
+    else:
+        rows = {pos: i for i, pos in enumerate(vf["legal_mouse_positions"])}
+        values = [vf["probs"][rows[pos]] for pos in positions]
+    rows, cols = np.array(positions).T
+    probs[rows, cols] = values
+    return probs
+
+
+def geometric_probability_map(
+    grid: np.ndarray, probs: np.ndarray, start: Tuple[int, int] = (0, 0)
+) -> np.ndarray:
+    """The geometric_probability_path from `start` to every square of the
+    inner grid, in one pass down the maze tree rooted at `start`. probs is a
+    (rows, cols, 5) array like vf_prob_grid returns. The action taken at the
+    cheese is ignored, as in geometric_probability_path; the value at `start`
+    is its no-op probability. Unreachable squares are NaN."""
+    tree = get_maze_tree(grid, root=start)
+    order, parent, cols = tree.order, tree.parent, tree.shape[1]
+
+    # Log-probability of the action from each square's parent to it
+    action_idx = np.zeros((3, 3), dtype=np.intp)  # indexed by delta + 1
+    for i, action in enumerate(models.MAZE_ACTION_INDICES):
+        row_delta, col_delta = models.MAZE_ACTION_DELTAS[action]
+        action_idx[row_delta + 1, col_delta + 1] = i
+    child, par = order[1:], parent[order[1:]]
+    child_row, child_col = np.divmod(child, cols)
+    par_row, par_col = np.divmod(par, cols)
+    actions = action_idx[child_row - par_row + 1, child_col - par_col + 1]
+    flat_probs = probs.reshape(-1, probs.shape[-1])
+    edge_log_prob = np.zeros(tree.grid.size)
+    with np.errstate(divide="ignore"):
+        edge_log_prob[child] = np.log(flat_probs[par, actions])
+    # Don't count the action taken at the cheese
+    edge_count = np.zeros(tree.grid.size, dtype=np.intp)
+    edge_count[child] = 1
+    at_cheese = tree.grid.ravel()[par] == CHEESE
+    edge_log_prob[child[at_cheese]] = 0.0
+    edge_count[child[at_cheese]] = 0
+
+    # Accumulate down the tree; parents come before children in BFS order
+    sum_log_prob = edge_log_prob.tolist()
+    num_actions = edge_count.tolist()
+    for node, node_parent in zip(child.tolist(), par.tolist()):
+        sum_log_prob[node] += sum_log_prob[node_parent]
+        num_actions[node] += num_actions[node_parent]
+
+    prob_map = np.full(tree.grid.size, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prob_map[child] = np.exp(
+            np.array(sum_log_prob)[child] / np.array(num_actions)[child]
         )
-        sum_log_prob += np.log(prob_dict[coord][action_index])
-
-    divisor: int = len(path) - (2 if cheese_loc in path[:-1] else 1)
-    geom_mean_prob: float = np.exp(sum_log_prob / divisor)
-    return geom_mean_prob
+    prob_map[order[0]] = probs[start][-1]  # The no-op probability
+    return prob_map.reshape(tree.shape)
 
 
 def deltas_from(grid: np.ndarray, sq):
     """Returns the deltas between the decision square and the cheese, and the decision square and the top-right corner."""
-    path_to_cheese = pathfind(grid, sq, get_cheese_pos(grid))
-    path_to_top_right = pathfind(
-        grid, sq, (grid.shape[0] - 1, grid.shape[1] - 1)
-    )
-    delta_cheese = (path_to_cheese[1][0] - sq[0], path_to_cheese[1][1] - sq[1])
-    delta_tr = (
-        path_to_top_right[1][0] - sq[0],
-        path_to_top_right[1][1] - sq[1],
-    )
+    tree = get_maze_tree(grid)
+    step_cheese = tree.next_step(sq, get_cheese_pos(grid))
+    step_tr = tree.next_step(sq, (grid.shape[0] - 1, grid.shape[1] - 1))
+    delta_cheese = (step_cheese[0] - sq[0], step_cheese[1] - sq[1])
+    delta_tr = (step_tr[0] - sq[0], step_tr[1] - sq[1])
     return delta_cheese, delta_tr
 
 
@@ -1043,13 +2081,13 @@ def get_decision_square_from_grid_graph(inner_grid, graph):
 def maze_has_decision_square(states_bytes):
     maze_env_state = EnvState(states_bytes)
     inner_grid = maze_env_state.inner_grid()
-    grid_graph = maze_grid_to_graph(inner_grid)
+    grid_graph = maze_grid_to_csr(inner_grid)
     return grid_graph_has_decision_square(inner_grid, grid_graph)
 
 
 def get_decision_square_from_maze_state(state):
     inner_grid = state.inner_grid()
-    grid_graph = maze_grid_to_graph(inner_grid)
+    grid_graph = maze_grid_to_csr(inner_grid)
     return get_decision_square_from_grid_graph(inner_grid, grid_graph)
 
 
@@ -1061,6 +2099,43 @@ def get_node_value_at_offset(outer_grid, node, offset):
 
 
 NODE_TYPES = ["wall", "unconn", "end", "path", "branch2", "branch3"]
+# Neighbour offsets in lrdu order, (row, col)
+LRDU_OFFSETS = [(0, -1), (0, 1), (-1, 0), (1, 0)]
+
+
+def node_type_maps(grids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The node type and open neighbours of every square of the (N, H, W) grids
+    (or one grid), as get_node_type_by_world_loc gives for one square.
+    Squares outside the grid count as blocked.
+
+    Returns (node_types, lrdu_codes), both (N, H, W): indices into NODE_TYPES,
+    and codes with bit i set if the neighbour at LRDU_OFFSETS[i] is open
+    (see lrdu_open).
+    """
+    grids = np.asarray(grids)
+    if grids.ndim == 2:
+        grids = grids[None]
+    is_open = grids != BLOCKED
+    padded = np.pad(is_open, ((0, 0), (1, 1), (1, 1))).view(np.uint8)
+    neighbors_open = [
+        padded[:, 1:-1, :-2],
+        padded[:, 1:-1, 2:],
+        padded[:, :-2, 1:-1],
+        padded[:, 2:, 1:-1],
+    ]
+    lrdu_codes = np.zeros(grids.shape, dtype=np.uint8)
+    num_open = np.zeros(grids.shape, dtype=np.int8)
+    for bit, neighbor_open in enumerate(neighbors_open):
+        lrdu_codes |= neighbor_open << bit
+        num_open += neighbor_open
+    node_types = np.where(is_open, 1 + num_open, 0)
+    return node_types.astype(np.int8), lrdu_codes
+
+
+def lrdu_open(lrdu_codes: np.ndarray) -> np.ndarray:
+    "(..., 4) bool array of which neighbours the codes from node_type_maps say are open"
+    return (np.asarray(lrdu_codes)[..., None] >> np.arange(4)) & 1 == 1
 
 
 def get_node_type_by_world_loc(states_bytes, world_node):
@@ -1073,25 +2148,152 @@ def get_node_type_by_world_loc(states_bytes, world_node):
     branch2 (3 open), branch3 (4 open).  Second return enumerates
     the possible (closed, open) states of all 4 neighbours, so
     16 possibilities.  Returned as a bool array, even for walls."""
-    maze_env_state = EnvState(states_bytes)
-    outer_grid = maze_env_state.full_grid()
-    node_value = outer_grid[world_node]
-    lrdu_open = (
-        np.array(
-            [
-                get_node_value_at_offset(outer_grid, world_node, (0, -1)),
-                get_node_value_at_offset(outer_grid, world_node, (0, 1)),
-                get_node_value_at_offset(outer_grid, world_node, (-1, 0)),
-                get_node_value_at_offset(outer_grid, world_node, (1, 0)),
-            ]
+    node_types, neighbors_open = get_node_types_by_world_loc(
+        [states_bytes], world_node
+    )
+    return str(node_types[0]), neighbors_open[0]
+
+
+def get_node_types_by_world_loc(
+    states_bytes_list, world_node
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Batched get_node_type_by_world_loc: the (N,) node type names and (N, 4)
+    lrdu open neighbours of the square world_node in each state.
+    """
+    grids = StateBatch(states_bytes_list).grids(with_mouse=True)
+    # Only the square and its neighbours matter, squares outside are blocked
+    row, col = world_node
+    padded = np.pad(grids, ((0, 0), (1, 1), (1, 1)), constant_values=BLOCKED)
+    node_types, lrdu_codes = node_type_maps(
+        padded[:, row : row + 3, col : col + 3]
+    )
+    return (
+        np.array(NODE_TYPES)[node_types[:, 1, 1]],
+        lrdu_open(lrdu_codes[:, 1, 1]),
+    )
+
+
+def _stack_bfs(is_open: np.ndarray, sources: np.ndarray):
+    """
+    BFS over the open squares of the (N, H, W) masks at once, starting from
+    all the open squares in the sources mask. Squares are numbered by their
+    index in the flattened stack.
+
+    Returns (order, levels, parent): the reached squares in BFS order, the
+    start of each BFS level in order (and its end), and each square's BFS
+    parent, which is is_open.size for sources and negative for squares that
+    weren't reached.
+    """
+    size = is_open.size
+    idx = np.arange(size).reshape(is_open.shape)
+    down = is_open[:, 1:, :] & is_open[:, :-1, :]
+    right = is_open[:, :, 1:] & is_open[:, :, :-1]
+    a = np.concatenate([idx[:, :-1, :][down], idx[:, :, :-1][right]])
+    b = np.concatenate([idx[:, 1:, :][down], idx[:, :, 1:][right]])
+    source_idx = np.flatnonzero(sources & is_open)
+
+    # Add a root square, numbered size, with an edge to each source
+    edges_from = np.concatenate([a, b, np.full(len(source_idx), size)])
+    edges_to = np.concatenate([b, a, source_idx])
+    graph = scipy.sparse.csr_matrix(
+        (np.ones(len(edges_from), dtype=np.int8), (edges_from, edges_to)),
+        shape=(size + 1, size + 1),
+    )
+    order, parent = csgraph.breadth_first_order(graph, size, directed=True)
+
+    # Parents are in BFS order too, so each level starts at the first square
+    # whose parent is in the level before
+    position = np.empty(size + 1, dtype=np.intp)
+    position[order] = np.arange(len(order))
+    parent_position = position[parent[order[1:]]]
+    levels = [0, 1]
+    while levels[-1] < len(order):
+        levels.append(
+            1 + np.searchsorted(parent_position, levels[-1], side="left")
         )
-        != BLOCKED
+    return order[1:], np.array(levels[1:]) - 1, parent[:size]
+
+
+def path_masks(
+    grids: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> np.ndarray:
+    """
+    (N, H, W) masks of the shortest path between the (N, 2) (row, col) starts
+    and ends in each of the (N, H, W) grids, ends included. Masks are empty
+    where there is no path or the start or end is (-1, -1).
+    """
+    grids = np.asarray(grids)
+    num, height, width = grids.shape
+    starts, ends = np.asarray(starts), np.asarray(ends)
+    valid = (starts >= 0).all(axis=1) & (ends >= 0).all(axis=1)
+    rows = np.nonzero(valid)[0]
+    is_open = grids != BLOCKED
+    sources = np.zeros_like(is_open)
+    sources[rows, starts[rows, 0], starts[rows, 1]] = True
+    _, _, parent = _stack_bfs(is_open, sources)
+
+    # Climb from each reachable end to its start
+    on_path = np.zeros(is_open.size, dtype=bool)
+    node = np.ravel_multi_index(
+        (rows, ends[rows, 0], ends[rows, 1]), grids.shape
+    )
+    node = node[parent[node] >= 0]
+    while len(node):
+        on_path[node] = True
+        node = parent[node]
+        node = node[node < is_open.size]
+    return on_path.reshape(grids.shape)
+
+
+def cheese_path_maps(
+    grids: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Features of every square of the (N, H, W) inner or outer grids (or one
+    grid) relative to the path from the maze's origin, the bottom left of the
+    inner grid, to the cheese:
+
+    - on_path: whether the square is on the cheese path
+    - branch_distance: steps from the square to the nearest square of the path
+    - dead_end_depth: how many steps the maze goes on away from the path
+      past the square; for squares on the path, the depth of the deepest dead
+      end branching off there
+
+    Distances are -1 for blocked or unreachable squares. Grids without a
+    cheese have no path.
+    """
+    grids = np.asarray(grids)
+    if grids.ndim == 2:
+        grids = grids[None]
+    num, height, width = grids.shape
+    is_open = grids != BLOCKED
+
+    padding = _paddings(grids)
+    origins = np.stack([padding, padding], axis=1)
+    origins[padding >= min(height, width)] = -1
+    flat = (grids == CHEESE).reshape(num, -1)
+    cheese = np.stack(
+        np.unravel_index(flat.argmax(axis=1), (height, width)), 1
+    )
+    cheese[~flat.any(axis=1)] = -1
+    on_path = path_masks(grids, origins, cheese)
+
+    order, levels, parent = _stack_bfs(is_open, on_path)
+    branch_distance = np.full(is_open.size, -1)
+    dead_end_depth = np.full(is_open.size, -1)
+    dead_end_depth[order] = 0
+    for level, (start, stop) in enumerate(zip(levels[:-1], levels[1:])):
+        branch_distance[order[start:stop]] = level
+    # Leaves up, one level at a time; the sources' parent is the root
+    for start, stop in zip(levels[-2:0:-1], levels[-1:1:-1]):
+        nodes = order[start:stop]
+        np.maximum.at(dead_end_depth, parent[nodes], dead_end_depth[nodes] + 1)
+    return (
+        on_path,
+        branch_distance.reshape(grids.shape),
+        dead_end_depth.reshape(grids.shape),
     )
-    if node_value == BLOCKED:
-        node_type = "wall"
-    else:
-        node_type = NODE_TYPES[1:][lrdu_open.sum()]
-    return node_type, lrdu_open
 
 
 def get_object_pos_in_grid(grid, obj_value):
@@ -1113,12 +2315,7 @@ def get_object_pos_from_seq_of_states(state_bytes_seq, obj_value):
     as a numpy array of shape (len(sequance), 2).  Note that the first
     column is y-position to stay consistent with row/col matrix ordering
     conventions."""
-    mouse_pos = np.zeros((len(state_bytes_seq), 2), dtype=int)
-    for ii, state_bytes in enumerate(state_bytes_seq):
-        env_state = EnvState(state_bytes)
-        y, x = np.argwhere(env_state.full_grid() == obj_value)[0]
-        mouse_pos[ii, :] = np.array([y, x])
-    return mouse_pos
+    return StateBatch(state_bytes_seq).object_positions(obj_value)
 
 
 def get_mouse_pos_from_seq_of_states(state_bytes_seq):
@@ -1126,7 +2323,7 @@ def get_mouse_pos_from_seq_of_states(state_bytes_seq):
     as a numpy array of shape (len(sequance), 2).  Note that the first
     column is y-position to stay consistent with row/col matrix ordering
     conventions."""
-    get_object_pos_from_seq_of_states(state_bytes_seq, MOUSE)
+    return get_object_pos_from_seq_of_states(state_bytes_seq, MOUSE)
 
 
 def get_cheese_pos_from_seq_of_states(state_bytes_seq):
@@ -1134,12 +2331,31 @@ def get_cheese_pos_from_seq_of_states(state_bytes_seq):
     as a numpy array of shape (len(sequance), 2).  Note that the first
     column is y-position to stay consistent with row/col matrix ordering
     conventions."""
-    get_object_pos_from_seq_of_states(state_bytes_seq, CHEESE)
+    return get_object_pos_from_seq_of_states(state_bytes_seq, CHEESE)
 
 
-def get_envstate_from_seed(seed: int):
+def _level_state_bytes(seed: int) -> bytes:
+    # A level can only be generated by a venv starting at its seed, so this
+    # one can't come from the pool
     seed_env = create_venv(num=1, start_level=seed, num_levels=1)
-    return state_from_venv(venv=seed_env, idx=0)
+    state_bytes = seed_env.env.callmethod("get_state")[0]
+    close_venv(seed_env)
+    return state_bytes
+
+
+@functools.lru_cache(maxsize=4096)
+def _state_bytes_from_seed(seed: int) -> bytes:
+    return _level_state_bytes(seed)
+
+
+def get_envstate_from_seed(seed: int, cache: bool = True):
+    """
+    The initial state of level seed. Pass cache=False when visiting each seed
+    once, so the states don't fill the cache of recently used levels.
+    """
+    if not cache:
+        return EnvState(_level_state_bytes(seed))
+    return EnvState(_state_bytes_from_seed(seed))
 
 
 def get_full_grid_from_seed(seed: int):
@@ -1152,21 +2368,27 @@ def get_inner_grid_from_seed(seed: int):
     return state.inner_grid()
 
 
-def rand_seed_with_size(min_size: int = 3, max_size: int = WORLD_DIM) -> int:
+def rand_seed_with_size(
+    min_size: int = 3, max_size: int = WORLD_DIM, catalog=None
+) -> int:
     """Generate a random seed with a maze of size between min_size and
     max_size. Rejection sampling is used to ensure that the maze size is
-    in the desired range."""
+    in the desired range, unless a seed_catalog.SeedCatalog is given to
+    sample from."""
     assert (
         3 <= min_size <= max_size <= WORLD_DIM
     ), f"Invalid size range. Must be 3 <= min_size <= max_size <= {WORLD_DIM}."
 
     max_seed = 100000
+    if catalog is not None:
+        seeds = catalog.seeds_where(min_dim=min_size, max_dim=max_size)
+        assert len(seeds) > 0, "No seeds in the catalog have a matching size."
+        return int(np.random.choice(seeds))
+
     while True:
         seed = np.random.randint(0, max_seed)
-        if (
-            get_inner_grid_from_seed(seed=seed).shape[0] <= max_size
-            and get_inner_grid_from_seed(seed=seed).shape[0] >= min_size
-        ):
+        size = get_inner_grid_from_seed(seed=seed).shape[0]
+        if min_size <= size <= max_size:
             return seed
 
 
@@ -1182,10 +2404,40 @@ def get_mouse_pos_from_seed(seed: int, flip_y: bool = False):
     return get_mouse_pos(grid, flip_y=flip_y)
 
 
+def _candidate_seeds(catalog, start: int = 0, **conditions):
+    """Seeds from start to scan, in seed order: the matching seeds of ranges
+    the catalog covers, and every seed outside them (in the gaps between
+    its chunks and past it). Without a catalog, every seed from start."""
+    if catalog is None:
+        yield from itertools.count(start)
+        return
+    seeds = np.unique(catalog.seeds_where(**conditions))
+    pos = start  # Seeds before pos have been yielded or skipped
+    for range_start, range_stop in catalog.ranges:
+        if range_stop <= pos:
+            continue
+        yield from range(pos, range_start)
+        lo, hi = np.searchsorted(seeds, [max(pos, range_start), range_stop])
+        yield from (int(seed) for seed in seeds[lo:hi])
+        pos = range_stop
+    yield from itertools.count(pos)
+
+
+def _full_grid_from_seed_or_catalog(seed: int, catalog=None) -> np.ndarray:
+    if catalog is not None and seed in catalog:
+        return catalog.full_grid(seed)
+    return get_full_grid_from_seed(seed)
+
+
 def get_mazes_with_mouse_at_location(
-    cheese_location: Tuple[int, int], num_mazes: int = 5, skip_seed: int = -1
+    cheese_location: Tuple[int, int],
+    num_mazes: int = 5,
+    skip_seed: int = -1,
+    catalog=None,
 ):
-    """Generate a list of maze seeds with cheese at the specified location."""
+    """Generate a list of maze seeds with cheese at the specified location.
+    Pass a seed_catalog.SeedCatalog to look seeds up instead of scanning them.
+    """
     assert (
         len(cheese_location) == 2
     ), "Cheese location must be a tuple of length 2."
@@ -1194,20 +2446,24 @@ def get_mazes_with_mouse_at_location(
     ), "Cheese location must be within the maze."
 
     seeds = []
-    seed = 0
+    candidates = _candidate_seeds(catalog, cheese_pos=cheese_location)
     while len(seeds) < num_mazes:
+        seed = next(candidates)
         if seed != skip_seed and (
-            get_cheese_pos_from_seed(seed) == cheese_location
+            get_cheese_pos(_full_grid_from_seed_or_catalog(seed, catalog))
+            == cheese_location
         ):
             seeds.append(seed)
-        seed += 1
     return seeds
 
 
 def generate_mazes_with_cheese_at_location(
-    cheese_location: Tuple[int, int], num_mazes: int = 50, skip_seed: int = -1
+    cheese_location: Tuple[int, int],
+    num_mazes: int = 50,
+    skip_seed: int = -1,
+    catalog=None,
 ):
-    """Generate the first num_mazes seeds which have an empty/cheese square at cheese_location, except the mazes are modified to instead have cheese at cheese_location. Returns a list of full grids."""
+    """Generate the first num_mazes seeds which have an empty/cheese square at cheese_location, except the mazes are modified to instead have cheese at cheese_location. Returns a list of full grids. Pass a seed_catalog.SeedCatalog to look seeds up instead of scanning them."""
     assert (
         len(cheese_location) == 2
     ), "Cheese location must be a tuple of length 2."
@@ -1216,10 +2472,11 @@ def generate_mazes_with_cheese_at_location(
     ), "Cheese location must be within the maze."
 
     seeds, grids = [], []
-    seed = 0
+    candidates = _candidate_seeds(catalog, open_at=cheese_location)
     while len(grids) < num_mazes:
+        seed = next(candidates)
         if seed != skip_seed:
-            grid = get_full_grid_from_seed(seed)
+            grid = _full_grid_from_seed_or_catalog(seed, catalog)
             if (
                 grid[cheese_location] == EMPTY
                 or grid[cheese_location] == CHEESE
@@ -1231,7 +2488,6 @@ def generate_mazes_with_cheese_at_location(
                     inner_grid(grid)
                 )  # venv_from_grid expects inner grid
                 seeds.append(seed)
-        seed += 1
     return seeds, grids
 
 
@@ -1286,6 +2542,89 @@ def create_venv(
     return venv
 
 
+def close_venv(venv):
+    "Release the procgen env behind a wrapped venv; the wrappers don't close it."
+    venv.env.close()
+
+
+class VenvPool:
+    """
+    Process-local pool of warm venvs, so callers which only need to read or write
+    a state don't construct a ProcgenGym3Env each time. Venvs are reused via
+    set_state, so a borrower must set the state of every env before using it.
+
+    max_live caps the venvs the pool keeps, not the venvs checked out: checkout
+    creates a venv past the cap when none is free rather than block (a borrower
+    may hold one venv while taking another), closing the least recently
+    returned free venv to make room, and venvs returned while over the cap are
+    closed. So more than max_live venvs are alive only while checked out.
+    """
+
+    def __init__(self, max_live: int = 8):
+        self.max_live = max_live
+        self._free = []  # least recently returned first
+        self._num_live = 0
+        self._lock = threading.Lock()
+
+    def checkout(
+        self, num: int = 1, at_least: bool = False
+    ) -> ToBaselinesVecEnv:
+        """
+        Take a venv with num envs out of the pool, creating one if none is free.
+        With at_least, the venv may have more envs (the borrower fills them with
+        padding states): the smallest free one with at least num is taken, and
+        new ones have a power of two envs, so they serve later checkouts of
+        other sizes.
+        """
+        with self._lock:
+            fits = [
+                i
+                for i, venv in enumerate(self._free)
+                if venv.num_envs == num or (at_least and venv.num_envs > num)
+            ]
+            if fits:
+                i = min(fits, key=lambda i: self._free[i].num_envs)
+                return self._free.pop(i)
+            if self._num_live >= self.max_live and self._free:
+                close_venv(self._free.pop(0))
+                self._num_live -= 1
+            self._num_live += 1
+        if at_least:
+            num = 1 << (num - 1).bit_length()
+        return create_venv(num=num, start_level=0, num_levels=1)
+
+    def checkin(self, venv: ToBaselinesVecEnv):
+        "Return a venv taken with checkout. Don't use it afterwards."
+        with self._lock:
+            if self._num_live > self.max_live:
+                close_venv(venv)
+                self._num_live -= 1
+            else:
+                self._free.append(venv)
+
+    @contextlib.contextmanager
+    def borrow(self, state_bytes_list: typing.Sequence[bytes]):
+        "Check out a venv with the given states for the duration of a with block."
+        venv = self.checkout(num=len(state_bytes_list))
+        try:
+            venv.env.callmethod("set_state", list(state_bytes_list))
+            yield venv
+        finally:
+            self.checkin(venv)
+
+    def close(self):
+        "Close the free venvs. Checked out venvs are closed when returned."
+        with self._lock:
+            for venv in self._free:
+                close_venv(venv)
+            self._num_live -= len(self._free)
+            self._free = []
+            self.max_live = 0
+
+
+VENV_POOL = VenvPool()
+
+
 def copy_venv(venv, idx: int):
     "Return a copy of venv number idx. WARNING: After level is finished, the copy will be reset."
     sb = venv.env.callmethod("get_state")[idx]
@@ -1321,16 +2660,11 @@ def save_venv(venv: ProcgenGym3Env, filename: str):
 
 
 def remove_cheese_from_state(state):
-    grid = state.full_grid()
-    grid[grid == CHEESE] = EMPTY
-    state.set_grid(grid)
+    state.remove_cheese()
 
 
 def move_cheese_in_state(state, new_cheese_pos):
-    grid = state.full_grid()
-    grid[grid == CHEESE] = EMPTY
-    grid[new_cheese_pos] = CHEESE
-    state.set_grid(grid)
+    state.set_cheese_pos(*new_cheese_pos)
 
 
 def get_custom_venv_pair(seed: int, num_envs=2):
@@ -1406,6 +2740,129 @@ def get_top_right_venv_pair(seed: int) -> ProcgenGym3Env:
     return venv
 
 
+def _sample_levels(
+    seeds: List[int],
+    spawn_cheese: bool,
+    maze_dim: Optional[int],
+    mouse_pos_inner: Optional[Square],
+    cheese_pos_inner: Optional[Square],
+    mouse_pos_outer: Optional[Square],
+    cheese_pos_outer: Optional[Square],
+    must_be_dec_square: bool,
+    return_metadata: bool,
+    random_seed: int,
+) -> List[Tuple[bytes, Optional[dict]]]:
+    """
+    Apply the get_random_obs_opts constraints to the levels seeds, returning
+    (state_bytes, metadata) for the accepted levels in seed order. Cheap grid
+    checks run on the whole batch; paths are only found for the levels left.
+    """
+    if len(seeds) == 0:
+        return []
+    batch = StateBatch([_state_bytes_from_seed(seed) for seed in seeds])
+    grids = batch.grids(with_mouse=False)
+    rows = np.arange(len(batch))
+
+    # Mazes are padded with rows and columns of walls
+    maze_dims = (grids != BLOCKED).any(axis=2).sum(axis=1)
+    paddings = (WORLD_DIM - maze_dims) // 2
+    keep = np.ones(len(batch), dtype=bool)
+    if maze_dim is not None:
+        keep &= maze_dims == maze_dim
+
+    def positions_outer(pos_inner, pos_outer):
+        "(N, 2) outer positions, and whether they are in the grid."
+        if pos_inner is not None:
+            positions = np.array(pos_inner) + paddings[:, None]
+        else:
+            positions = np.tile(pos_outer, (len(batch), 1))
+        in_grid = ((positions >= 0) & (positions < WORLD_DIM)).all(axis=1)
+        positions = np.clip(positions, 0, WORLD_DIM - 1)
+        return positions, in_grid
+
+    mouse_forced = mouse_pos_inner is not None or mouse_pos_outer is not None
+    if mouse_forced:
+        mouse, in_grid = positions_outer(mouse_pos_inner, mouse_pos_outer)
+        keep &= in_grid & (grids[rows, mouse[:, 0], mouse[:, 1]] == EMPTY)
+    else:
+        mouse = np.zeros((len(batch), 2), dtype=int)
+
+    cheese_forced = spawn_cheese and (
+        cheese_pos_inner is not None or cheese_pos_outer is not None
+    )
+    if cheese_forced:
+        cheese, in_grid = positions_outer(cheese_pos_inner, cheese_pos_outer)
+        cheese_square = grids[rows, cheese[:, 0], cheese[:, 1]]
+        keep &= in_grid & (
+            (cheese_square == EMPTY) | (cheese_square == CHEESE)
+        )
+
+    # Random mouse positions, drawn per level so they don't depend on batching
+    if not mouse_forced:
+        for i in np.nonzero(keep)[0]:
+            legal_mouse_positions = np.argwhere(grids[i] == EMPTY)
+            rng = np.random.default_rng([random_seed, seeds[i]])
+            mouse[i] = legal_mouse_positions[
+                rng.integers(len(legal_mouse_positions))
+            ]
+
+    kept = np.nonzero(keep)[0]
+    batch = batch.select(kept)
+    batch.set_mouse_positions(mouse[kept])
+    if not spawn_cheese:
+        batch.remove_cheese()
+    elif cheese_forced:
+        batch.move_cheese(cheese[kept])
+
+    samples = []
+    for state_bytes, i in zip(batch.to_state_bytes(), kept):
+        mr, mc = int(mouse[i, 0]), int(mouse[i, 1])
+        padding = int(paddings[i])
+        grid = grids[i].copy()
+        if cheese_forced:
+            grid[grid == CHEESE] = EMPTY
+            grid[tuple(cheese[i])] = CHEESE
+        cheese_pos_outer_this = get_cheese_pos(grid) if spawn_cheese else None
+
+        metadata = None
+        if must_be_dec_square or return_metadata:
+            inner_grid_this = inner_grid(grid)
+            graph = maze_grid_to_csr(inner_grid_this)
+            mr_inner, mc_inner = mr - padding, mc - padding
+            path_to_cheese = get_path_to_cheese(
+                inner_grid_this, graph, (mr_inner, mc_inner)
+            )
+            path_to_corner = get_path_to_corner(
+                inner_grid_this, graph, (mr_inner, mc_inner)
+            )
+
+            def path_step_inner_to_outer(path):
+                return (
+                    (path[1][0] + padding, path[1][1] + padding)
+                    if len(path) > 1
+                    else (mr, mc)
+                )
+
+            next_pos_cheese_outer = path_step_inner_to_outer(path_to_cheese)
+            next_pos_corner_outer = path_step_inner_to_outer(path_to_corner)
+            if must_be_dec_square and (
+                next_pos_cheese_outer == next_pos_corner_outer
+            ):
+                continue
+            metadata = dict(
+                level_seed=seeds[i],
+                mouse_pos_outer=(mr, mc),
+                cheese_pos_outer=cheese_pos_outer_this,
+                next_pos_cheese_outer=next_pos_cheese_outer,
+                next_pos_corner_outer=next_pos_corner_outer,
+                path_to_cheese=path_to_cheese,
+                path_to_corner=path_to_corner,
+                maze_dim=int(maze_dims[i]),
+            )
+        samples.append((state_bytes, metadata))
+    return samples
+
+
 def get_random_obs_opts(
     num_obs: int = 1,
     on_training: bool = True,
@@ -1417,11 +2874,14 @@ def get_random_obs_opts(
     mouse_pos_outer: Optional[Tuple[int, int]] = None,
     cheese_pos_outer: Optional[Tuple[int, int]] = None,
     must_be_dec_square: bool = False,
-    start_level: int = 0,
+    start_level: Optional[int] = None,
     return_metadata: bool = False,
     random_seed: Optional[int] = None,
     deterministic_levels: bool = False,
     show_pbar: bool = False,
+    catalog=None,
+    batch_size: int = 64,
+    num_workers: Optional[int] = None,
 ):
     """Get num_obs observations from the maze environment. If on_training is True, then the observation is
     from a training level where the cheese is in the top-right rand_region corner.
@@ -1431,6 +2891,13 @@ def get_random_obs_opts(
     - cheese_pos_inner forces the cheese to a specific inner_grid location (skipping levels that aren't open on this location)
     - cheese/mouse_pos_outer as above, only one of inner or outer should be provided
     - must_be_dec_square ensures that the next step to cheese and top-right-corner are different at the mouse location
+
+    Levels are sampled in batches of at most batch_size (and no more than are still needed),
+    spread over num_workers processes if given.
+    Levels are start_level (default 0), start_level + 1, ... if deterministic_levels, else random
+    seeds, and start_level may only be given with deterministic_levels.
+    A seed_catalog.SeedCatalog skips levels of the wrong maze_dim without creating them.
+    The results only depend on random_seed (and the levels), not on batch_size or num_workers.
     """
     assert (
         rand_region <= WORLD_DIM
@@ -1447,148 +2914,79 @@ def get_random_obs_opts(
     assert (
         cheese_pos_inner is None or cheese_pos_outer is None
     ), "only specify one of cheese_pos_inner, cheese_pos_outer"
+    assert (
+        start_level is None or deterministic_levels
+    ), "start_level is only used with deterministic_levels=True"
 
-    # venvs = create_venv(num_obs, start_level=0, num_levels=0)
     # TODO ensure that if on_training is True, then the cheese is in the top-right rand_region corner
+    for pos_inner, pos_outer in (
+        (mouse_pos_inner, cheese_pos_inner),
+        (mouse_pos_outer, cheese_pos_outer),
+    ):
+        if pos_inner is not None and pos_inner == pos_outer:
+            warn("mouse and cheese positions must be different")
+
+    if random_seed is None:
+        random_seed = np.random.SeedSequence().entropy
+    sample_levels = functools.partial(
+        _sample_levels,
+        spawn_cheese=spawn_cheese,
+        maze_dim=maze_dim,
+        mouse_pos_inner=mouse_pos_inner,
+        cheese_pos_inner=cheese_pos_inner,
+        mouse_pos_outer=mouse_pos_outer,
+        cheese_pos_outer=cheese_pos_outer,
+        must_be_dec_square=must_be_dec_square,
+        return_metadata=return_metadata,
+        random_seed=random_seed,
+    )
 
-    def venv_gen_func():
-        last_start_level = start_level
-        while True:
-            yield (
-                create_venv(
-                    1,
-                    start_level=last_start_level,
-                    num_levels=1 if deterministic_levels else 0,
-                ),
-                last_start_level,
-            )
-            last_start_level += 1
-
-    venv_gen = venv_gen_func()
+    # Candidate levels, in the order their samples are used
+    if deterministic_levels:
+        seed_it = _candidate_seeds(
+            catalog, start_level or 0, maze_dim=maze_dim
+        )
+    elif catalog is not None:
+        level_rng = np.random.default_rng(random_seed)
+        candidates = catalog.seeds_where(maze_dim=maze_dim)
+        seed_it = (
+            int(level_rng.choice(candidates)) for _ in itertools.count()
+        )
+    else:
+        level_rng = np.random.default_rng(random_seed)
+        seed_it = (
+            int(level_rng.integers(2**31 - 1)) for _ in itertools.count()
+        )
 
-    # Create N random observations, customizing and skipping as needed based on constraints
+    # Sample levels in batches, one per worker, until there are enough
     state_bytes_list = []
     metadata_list = []
-    rng = np.random.default_rng(random_seed)
-    with tqdm(total=num_obs, disable=not show_pbar) as pbar:
-        while len(state_bytes_list) < num_obs:
-            venv, this_level = next(venv_gen)
-            env_state = state_from_venv(venv, idx=0)
-            full_grid = env_state.full_grid(with_mouse=False)
-            inner_grid = env_state.inner_grid(with_mouse=False)
-
-            # Skip this level if it isn't the right size
-            maze_dim_this = inner_grid.shape[0]
-            if maze_dim is not None and maze_dim_this != maze_dim:
-                continue
-
-            # Calculate mouse/cheese outer positions, if either inner or out is
-            # specified.
-            padding = (env_state.world_dim - maze_dim_this) // 2
-            if mouse_pos_inner is not None:
-                mouse_pos_outer = (
-                    mouse_pos_inner[0] + padding,
-                    mouse_pos_inner[1] + padding,
-                )
-            if cheese_pos_inner is not None:
-                cheese_pos_outer = (
-                    cheese_pos_inner[0] + padding,
-                    cheese_pos_inner[1] + padding,
-                )
-
-            if (
-                mouse_pos_outer is not None
-                and mouse_pos_outer == cheese_pos_outer
-            ):
-                warn("mouse and cheese positions must be different")
-
-            # Get legal mouse positions
-            legal_mouse_positions = get_legal_mouse_positions(full_grid)
-
-            # If mouse position is specified, set it if legal, otherwise skip
-            # If not specified, randomize
-            if mouse_pos_outer is not None:
-                if mouse_pos_outer in legal_mouse_positions:
-                    mr, mc = mouse_pos_outer
-                else:
-                    continue
-            else:
-                mr, mc = legal_mouse_positions[
-                    rng.integers(len(legal_mouse_positions))
+    pool = multiprocessing.Pool(num_workers) if num_workers else None
+    try:
+        with tqdm(total=num_obs, disable=not show_pbar) as pbar:
+            while len(state_bytes_list) < num_obs:
+                # Each level is a venv to create, so don't take (many) more
+                # levels than there are observations still needed
+                needed = num_obs - len(state_bytes_list)
+                num_batches = min(num_workers or 1, needed)
+                size = min(batch_size, -(-needed // num_batches))
+                seed_batches = [
+                    list(itertools.islice(seed_it, size))
+                    for _ in range(num_batches)
                 ]
-
-            # Set the mouse position
-            env_state.set_mouse_pos(mr, mc)
-
-            # Remove the cheese if required
-            if not spawn_cheese:
-                remove_cheese_from_state(env_state)
-                cheese_pos_outer_this = None
-            # Otherwise, force the cheese to a speciic location if provided,
-            # skipping if not valid
-            elif cheese_pos_outer is not None:
-                cheese_pos_outer_this = cheese_pos_outer
-                if (
-                    cheese_pos_outer in legal_mouse_positions
-                    or full_grid[cheese_pos_outer] == CHEESE
-                ):
-                    move_cheese_in_state(env_state, cheese_pos_outer)
-                else:
-                    continue
-            else:
-                # Store the cheese location for metadata later
-                cheese_pos_outer_this = get_cheese_pos(full_grid)
-
-            # Skip if the resulting mouse/cheese locations don't match the
-            # decision square requirement, if any
-            # print(mr, mc)
-            # print(legal_mouse_positions)
-            if must_be_dec_square or return_metadata:
-                graph = maze_grid_to_graph(inner_grid)
-                mr_inner, mc_inner = mr - padding, mc - padding
-                path_to_cheese = get_path_to_cheese(
-                    inner_grid, graph, (mr_inner, mc_inner)
-                )
-                path_to_corner = get_path_to_corner(
-                    inner_grid, graph, (mr_inner, mc_inner)
-                )
-
-                def path_step_inner_to_outer(path):
-                    return (
-                        (path[1][0] + padding, path[1][1] + padding)
-                        if len(path) > 1
-                        else (mr, mc)
-                    )
-
-                next_pos_cheese_outer = path_step_inner_to_outer(
-                    path_to_cheese
-                )
-                next_pos_corner_outer = path_step_inner_to_outer(
-                    path_to_corner
-                )
-                # print(path_to_cheese[1], path_to_corner[1])
-                if must_be_dec_square and (
-                    next_pos_cheese_outer == next_pos_corner_outer
-                ):
-                    continue
-
-            # If we get here, we're ready to use this state
-            state_bytes_list.append(env_state.state_bytes)
-            if return_metadata:
-                metadata_list.append(
-                    dict(
-                        level_seed=this_level,
-                        mouse_pos_outer=(mr, mc),
-                        cheese_pos_outer=cheese_pos_outer_this,
-                        next_pos_cheese_outer=next_pos_cheese_outer,
-                        next_pos_corner_outer=next_pos_corner_outer,
-                        path_to_cheese=path_to_cheese,
-                        path_to_corner=path_to_corner,
-                        maze_dim=maze_dim_this,
-                    )
+                results = (pool.map if pool else map)(
+                    sample_levels, seed_batches
                 )
-
-            pbar.update(1)
+                for samples in results:
+                    for state_bytes, metadata in samples:
+                        if len(state_bytes_list) == num_obs:
+                            break
+                        state_bytes_list.append(state_bytes)
+                        metadata_list.append(metadata)
+                        pbar.update(1)
+    finally:
+        if pool:
+            pool.close()
 
     venvs = create_venv(num_obs, start_level=0, num_levels=0)
     venvs.env.callmethod("set_state", state_bytes_list)
@@ -1665,14 +3063,9 @@ def venv_with_all_mouse_positions(venv):
     padding = get_padding(grid)
 
     # create a venv for each legal mouse position
-    state_bytes_list = []
-    for mx, my in legal_mouse_positions:
-        # we keep a backup of the state bytes for efficiency, as calling set_mouse_pos
-        # implicitly calls _parse_state_bytes, which is slow. this is a hack.
-        # NOTE: Object orientation hurts us here. It would be better to have functions.
-        env_state.set_mouse_pos(mx + padding, my + padding)
-        state_bytes_list.append(env_state.state_bytes)
-        env_state.state_bytes = sb_back
+    batch = StateBatch.from_template(sb_back, len(legal_mouse_positions))
+    batch.set_mouse_positions(np.array(legal_mouse_positions) + padding)
+    state_bytes_list = batch.to_state_bytes()
 
     threads = 1 if len(legal_mouse_positions) < 100 else os.cpu_count()
     venv_all = create_venv(
@@ -1683,3 +3076,34 @@ def venv_with_all_mouse_positions(venv):
     )
     venv_all.env.callmethod("set_state", state_bytes_list)
     return venv_all, (legal_mouse_positions, grid)
+
+
+def mouse_position_states(
+    levels: typing.Iterable,
+) -> Tuple[List[np.ndarray], List[List[Square]], typing.Iterator[bytes]]:
+    """
+    Like venv_with_all_mouse_positions for many levels (seeds, EnvStates
+    and/or state bytes), without making any venvs: the states with the mouse
+    at each legal position are generated lazily, one level at a time.
+
+    Returns grids, legal_mouse_positions, states: the inner grids without the
+    mouse, the legal mouse positions of each and an iterator over the states,
+    level by level in the order of legal_mouse_positions.
+    """
+    batch = StateBatch.from_levels(levels)
+    if len(batch) == 0:
+        return [], [], iter(())
+    grids = [inner_grid(g) for g in batch.grids(with_mouse=False)]
+    positions = [get_legal_mouse_positions(grid) for grid in grids]
+
+    def states():
+        for state_bytes, grid, pos in zip(
+            batch.to_state_bytes(), grids, positions
+        ):
+            variants = StateBatch.from_template(state_bytes, len(pos))
+            variants.set_mouse_positions(
+                np.array(pos).reshape(-1, 2) + get_padding(grid)
+            )
+            yield from variants.to_state_bytes()
+
+    return grids, positions, states()
@@ -0,0 +1,633 @@
+"""
+Generate maze levels from seeds without the procgen environment, vectorized over
+seeds with numpy, following procgen's "maze" game in hard distribution mode:
+
+1. the level's RandGen is a std::mt19937 seeded with the level seed, and
+   randn(n) is the next 32-bit output modulo n;
+2. BasicAbstractGame::game_reset makes 2 draws, then the maze game draws the
+   maze size, maze_dim = randn(12) * 2 + 3;
+3. MazeGen carves a spanning tree with randomized Kruskal, drawing
+   randn(walls.size()) once per wall and erasing that wall from the list;
+4. the cheese is placed on randn(free_cells.size()) of the free squares.
+
+The parts of procgen's C++ which can't be read off the state bytes (the draws
+before the maze size, wall and free-cell order, x/y orientation) are the
+constants and small functions at the top of this file. They were fitted to the
+rand_gen states saved after level 0 and 1 were generated (88 and 8 draws), and
+reproduce the grids and cheese of levels 0, 5 and 7 exactly, as rendered in
+README.ipynb, experiments/cheese_vector.ipynb and figures/rollout-results.ipynb.
+Where the start cell sits in the free-cell list isn't pinned down by these
+levels, and the generator hasn't been verified on a large sample of seeds, so
+it isn't known to be bit-exact: some seeds may get a different grid or cheese
+than procgen gives them, and generate warns about this. Check the levels you
+use with verify where procgen is installed, e.g. with
+python -m procgen_tools.maze_generator:
+
+    grids, mouse_positions, cheese_positions = generate(range(100_000))
+    report = verify(range(1000))
+
+sample_mazes uses the same vectorized Kruskal with random draws instead of
+seeds, for as many on-distribution mazes as needed, with the constraints of
+maze.get_random_obs_opts:
+
+    grids, mouse_positions, _ = sample_mazes(1_000_000, maze_dim=15)
+    batch = to_state_batch(grids, mouse_positions)
+
+Positions are (row, col) in the outer grid, like maze.get_mouse_pos on a full
+grid.
+"""
+
+import functools
+import multiprocessing
+import os
+from typing import Callable, List, Optional, Sequence, Tuple
+from warnings import warn
+
+import numpy as np
+import pandas as pd
+from tqdm.auto import tqdm
+
+from procgen_tools import maze
+from procgen_tools.maze import Square
+
+# Draws made by BasicAbstractGame::game_reset before the maze game's own
+_PRE_MAZE_DRAWS = 2
+_MAX_MAZE_DIM = maze.WORLD_DIM
+
+# ============== Vectorized std::mt19937 ==============
+
+_MT_N, _MT_M = 624, 397
+_MT_MATRIX_A = np.uint32(0x9908B0DF)
+_MT_UPPER_MASK = np.uint32(0x80000000)
+_MT_LOWER_MASK = np.uint32(0x7FFFFFFF)
+
+
+def _mt_seed(seeds: np.ndarray) -> np.ndarray:
+    "The (N, 624) states of std::mt19937 seeded with each seed (init_genrand)."
+    state = np.empty((len(seeds), _MT_N), dtype=np.uint32)
+    state[:, 0] = np.asarray(seeds, dtype=np.int64).astype(np.uint32)
+    with np.errstate(over="ignore"):
+        for i in range(1, _MT_N):
+            prev = state[:, i - 1]
+            state[:, i] = np.uint32(1812433253) * (
+                prev ^ (prev >> np.uint32(30))
+            ) + np.uint32(i)
+    return state
+
+
+def _mt_twist(state: np.ndarray) -> np.ndarray:
+    "Regenerate all 624 words of each state, as std::mt19937 does every 624 draws."
+    state = state.copy()
+    for i in range(_MT_N):
+        y = (state[:, i] & _MT_UPPER_MASK) | (
+            state[:, (i + 1) % _MT_N] & _MT_LOWER_MASK
+        )
+        mag = np.where(y & np.uint32(1), _MT_MATRIX_A, np.uint32(0))
+        state[:, i] = state[:, (i + _MT_M) % _MT_N] ^ (y >> np.uint32(1)) ^ mag
+    return state
+
+
+def _mt_temper(y: np.ndarray) -> np.ndarray:
+    y = y ^ (y >> np.uint32(11))
+    y = y ^ ((y << np.uint32(7)) & np.uint32(0x9D2C5680))
+    y = y ^ ((y << np.uint32(15)) & np.uint32(0xEFC60000))
+    return y ^ (y >> np.uint32(18))
+
+
+def mt19937_outputs(seeds: Sequence[int], num: int) -> np.ndarray:
+    "The first num 32-bit outputs of std::mt19937 for each seed, as an (N, num) array."
+    state = _mt_seed(np.asarray(seeds))
+    blocks = []
+    for _ in range(-(-num // _MT_N)):
+        state = _mt_twist(state)
+        blocks.append(_mt_temper(state))
+    return np.concatenate(blocks, axis=1)[:, :num]
+
+
+def draws_consumed(rand_gen_str: str) -> int:
+    """
+    Number of draws made from a serialized std::mt19937, modulo 624, from the
+    'rand_gen.str' state value. libstdc++ writes the 624 state words, then the
+    index of the next word.
+    """
+    return int(rand_gen_str.split()[-1]) % _MT_N
+
+
+# ============== Maze layout ==============
+
+
+def _maze_walls(maze_dim: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The walls of a maze_dim maze in MazeGen's list order, as (W, 2) (x, y)
+    positions, plus the flat indices x * maze_dim + y of the two cells each wall
+    separates. Cells are at even (x, y); walls have exactly one odd coordinate.
+    MazeGen lists the walls between cells side by side (odd x), then those
+    between cells above one another (odd y), each by x then y.
+    """
+    positions, cell_a, cell_b = [], [], []
+    for dx, dy in ((1, 0), (0, 1)):
+        for x in range(dx, maze_dim, 2):
+            for y in range(dy, maze_dim, 2):
+                positions.append((x, y))
+                cell_a.append((x - dx) * maze_dim + (y - dy))
+                cell_b.append((x + dx) * maze_dim + (y + dy))
+    return np.array(positions), np.array(cell_a), np.array(cell_b)
+
+
+def _to_outer(xy: np.ndarray, maze_dim: int) -> np.ndarray:
+    "Map maze (x, y) positions to outer grid (row, col); procgen's y is the row."
+    margin = (maze.WORLD_DIM - maze_dim) // 2
+    return xy[..., ::-1] + margin
+
+
+# ============== Vectorized generation ==============
+
+
+def _remove_kth(tree: np.ndarray, k: np.ndarray) -> np.ndarray:
+    """
+    Find and remove the k-th (0-based) remaining item of each row of a Fenwick
+    tree counting the remaining items, returning the items' indices. This is
+    walls.erase(walls.begin() + k) for a batch of lists in O(log W).
+    """
+    rows = np.arange(len(tree))
+    size = tree.shape[1] - 1
+    pos = np.zeros(len(tree), dtype=int)
+    remaining = k + 1
+    step = 1 << size.bit_length()
+    while step:
+        nxt = pos + step
+        ok = nxt <= size
+        go = ok & (tree[rows, np.minimum(nxt, size)] < remaining)
+        remaining = remaining - np.where(
+            go, tree[rows, np.minimum(nxt, size)], 0
+        )
+        pos = np.where(go, nxt, pos)
+        step >>= 1
+
+    i = pos + 1
+    active = i <= size
+    while active.any():
+        tree[rows[active], i[active]] -= 1
+        i = np.where(active, i + (i & -i), i)
+        active = i <= size
+    return pos
+
+
+def _find(parent: np.ndarray, x: np.ndarray) -> np.ndarray:
+    "Vectorized union-find root lookup, with path halving."
+    rows = np.arange(len(parent))
+    while True:
+        p = parent[rows, x]
+        if (p == x).all():
+            return x
+        grandparent = parent[rows, p]
+        parent[rows, x] = grandparent
+        x = grandparent
+
+
+def _generate_same_dim(
+    draws: np.ndarray, maze_dim: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Carve the mazes of seeds which all drew maze_dim, given their MazeGen draws.
+    Returns the (N, maze_dim, maze_dim) open-square masks indexed [x, y], and
+    the (N, 2) (x, y) cheese positions.
+    """
+    num = len(draws)
+    rows = np.arange(num)
+    walls, cell_a, cell_b = _maze_walls(maze_dim)
+    num_walls = len(walls)
+
+    # Fenwick tree over the wall list; with every wall present, node i counts
+    # the lowbit(i) walls ending at i
+    idx = np.arange(num_walls + 1)
+    tree = np.tile(idx & -idx, (num, 1))
+    parent = np.tile(np.arange(maze_dim * maze_dim), (num, 1))
+    opened = np.zeros((num, num_walls), dtype=bool)  # in draw order
+    opened_walls = np.zeros((num, num_walls), dtype=int)
+    for t in range(num_walls):
+        wall = _remove_kth(tree, draws[:, t] % np.uint32(num_walls - t))
+        root_a = _find(parent, cell_a[wall])
+        root_b = _find(parent, cell_b[wall])
+        merge = root_a != root_b
+        parent[rows[merge], root_a[merge]] = root_b[merge]
+        opened[:, t] = merge
+        opened_walls[:, t] = wall
+
+    is_open = np.zeros((num, maze_dim, maze_dim), dtype=bool)
+    is_open[:, ::2, ::2] = True
+    open_rows, open_steps = np.nonzero(opened)
+    wall_xy = walls[opened_walls[open_rows, open_steps]]
+    is_open[open_rows, wall_xy[:, 0], wall_xy[:, 1]] = True
+
+    # Free squares are listed as they are opened: for each opened wall, in
+    # draw order, the cell below or left of it, the wall and the other cell,
+    # skipping squares already listed. A tree of C cells has C - 1 edges.
+    num_free = 2 * ((maze_dim + 1) // 2) ** 2 - 1
+    wall_squares = walls[:, 0] * maze_dim + walls[:, 1]
+    listed = np.stack(
+        [
+            cell_a[opened_walls],
+            wall_squares[opened_walls],
+            cell_b[opened_walls],
+        ],
+        axis=2,
+    ).reshape(num, -1)
+    valid = np.repeat(opened, 3, axis=1)
+    listed = np.where(valid, listed, -1)
+    order = np.argsort(listed, axis=1, kind="stable")
+    ranked = np.take_along_axis(listed, order, axis=1)
+    first = np.ones_like(valid)
+    first[:, 1:] = ranked[:, 1:] != ranked[:, :-1]
+    is_new = np.zeros_like(valid)
+    np.put_along_axis(is_new, order, first, axis=1)
+    is_new &= valid
+
+    n = (draws[:, num_walls] % np.uint32(num_free)).astype(int)
+    at = np.argmax(np.cumsum(is_new, axis=1) == (n + 1)[:, None], axis=1)
+    square = listed[rows, at]
+    cheese = np.stack([square // maze_dim, square % maze_dim], axis=1)
+    return is_open, cheese
+
+
+def _carve(
+    draws: np.ndarray, maze_dims: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Full grids and outer mouse and cheese positions of the levels with the given
+    maze_dims, given each level's MazeGen draws.
+    """
+    grids = np.full((len(draws), maze.WORLD_DIM, maze.WORLD_DIM), maze.BLOCKED)
+    mouse_positions = np.empty((len(draws), 2), dtype=int)
+    cheese_positions = np.empty((len(draws), 2), dtype=int)
+    for maze_dim in np.unique(maze_dims):
+        maze_dim = int(maze_dim)
+        group = np.nonzero(maze_dims == maze_dim)[0]
+        is_open, cheese = _generate_same_dim(draws[group], maze_dim)
+        margin = (maze.WORLD_DIM - maze_dim) // 2
+        inner = np.where(is_open, maze.EMPTY, maze.BLOCKED).transpose(0, 2, 1)
+        grids[
+            group, margin : margin + maze_dim, margin : margin + maze_dim
+        ] = inner
+        cheese_positions[group] = _to_outer(cheese, maze_dim)
+        mouse_positions[group] = _to_outer(np.zeros(2, dtype=int), maze_dim)
+    grids[
+        np.arange(len(draws)), cheese_positions[:, 0], cheese_positions[:, 1]
+    ] = maze.CHEESE
+    return grids, mouse_positions, cheese_positions
+
+
+def _generate_chunk(
+    seeds: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    max_walls = len(_maze_walls(_MAX_MAZE_DIM)[0])
+    # Fewer than 624 draws, so each seed needs one twist of its state
+    draws = mt19937_outputs(seeds, _PRE_MAZE_DRAWS + 1 + max_walls + 1)
+    draws = draws[:, _PRE_MAZE_DRAWS:]
+    maze_dims = (draws[:, 0] % np.uint32((_MAX_MAZE_DIM - 1) // 2)) * 2 + 3
+    return _carve(draws[:, 1:], maze_dims)
+
+
+def generate(
+    seeds: Sequence[int],
+    num_workers: Optional[int] = None,
+    chunk_size: int = 10_000,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Generate levels for seeds following procgen's maze generation. Only levels
+    0, 5 and 7 are known to match procgen's (see the module docstring), so the
+    levels of other seeds may differ from the env's; check them with verify.
+    Returns the (N, WORLD_DIM, WORLD_DIM) full grids without the mouse, and the
+    (N, 2) outer mouse and cheese positions. Seeds are split into chunks of
+    chunk_size, generated in num_workers processes if given.
+    """
+    warn(
+        "maze_generator.generate hasn't been verified against procgen on a "
+        "large sample of seeds; some levels may differ from the env's. Check "
+        "them with maze_generator.verify.",
+        stacklevel=2,
+    )
+    seeds = np.asarray(seeds, dtype=np.int64)
+    chunks = [
+        seeds[i : i + chunk_size] for i in range(0, len(seeds), chunk_size)
+    ]
+    if num_workers is not None and len(chunks) > 1:
+        with multiprocessing.Pool(num_workers) as pool:
+            results = pool.map(_generate_chunk, chunks)
+    else:
+        results = [_generate_chunk(chunk) for chunk in chunks]
+    if not results:
+        return _generate_chunk(seeds)
+    return tuple(np.concatenate(arrays) for arrays in zip(*results))
+
+
+def _draws_made(maze_dims: np.ndarray) -> np.ndarray:
+    "Number of draws generating each level makes, by its maze_dim."
+    num_walls = {d: len(_maze_walls(d)[0]) for d in np.unique(maze_dims)}
+    return np.array(
+        [_PRE_MAZE_DRAWS + 1 + num_walls[d] + 1 for d in maze_dims]
+    )
+
+
+def verify(
+    seeds: Sequence[int],
+    state_from_seed: Optional[Callable[[int], maze.EnvState]] = None,
+) -> pd.DataFrame:
+    """
+    Compare generated levels against the environment's, one row per seed. The
+    draw counts (modulo 624) help locate a mismatch: if they differ, the
+    generator draws a different number of times than procgen does.
+    """
+    state_from_seed = state_from_seed or maze.get_envstate_from_seed
+    grids, mouse_positions, cheese_positions = _generate_chunk(
+        np.asarray(seeds, dtype=np.int64)
+    )
+    maze_dims = np.array(
+        [(grid != maze.BLOCKED).any(axis=0).sum() for grid in grids]
+    )
+    draws = _draws_made(maze_dims) % 624
+
+    rows = []
+    for i, seed in enumerate(tqdm(seeds, desc="Verifying")):
+        state = state_from_seed(int(seed))
+        grid = state.full_grid(with_mouse=False)
+        rows.append(
+            {
+                "seed": int(seed),
+                "maze_dim": state.inner_grid().shape[0],
+                "maze_dim_ok": state.inner_grid().shape[0] == maze_dims[i],
+                "grid_ok": (
+                    (grid != maze.BLOCKED) == (grids[i] != maze.BLOCKED)
+                ).all(),
+                "mouse_ok": tuple(mouse_positions[i]) == state.mouse_pos,
+                "cheese_ok": maze.get_cheese_pos(grid)
+                == tuple(cheese_positions[i]),
+                "draws_env": draws_consumed(
+                    state.state_vals["rand_gen.str"].val
+                ),
+                "draws_generated": draws[i],
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+# ============== Synthetic mazes ==============
+
+
+def _outer_positions(
+    pos_inner: Optional[Square], pos_outer: Optional[Square], paddings
+) -> Tuple[np.ndarray, np.ndarray]:
+    "(N, 2) outer positions, and whether they are in the grid."
+    if pos_inner is not None:
+        positions = np.array(pos_inner) + paddings[:, None]
+    else:
+        positions = np.tile(pos_outer, (len(paddings), 1))
+    in_grid = ((positions >= 0) & (positions < maze.WORLD_DIM)).all(axis=1)
+    return np.clip(positions, 0, maze.WORLD_DIM - 1), in_grid
+
+
+def _inner_position(
+    pos_inner: Optional[Square], pos_outer: Optional[Square], maze_dim: int
+) -> Optional[Square]:
+    if pos_inner is not None:
+        return tuple(pos_inner)
+    if pos_outer is not None:
+        padding = (maze.WORLD_DIM - maze_dim) // 2
+        return (pos_outer[0] - padding, pos_outer[1] - padding)
+    return None
+
+
+def _possible_dims(
+    maze_dims: Sequence[int],
+    spawn_cheese: bool,
+    mouse_pos_inner: Optional[Square],
+    cheese_pos_inner: Optional[Square],
+    mouse_pos_outer: Optional[Square],
+    cheese_pos_outer: Optional[Square],
+) -> List[int]:
+    """
+    The maze sizes that can meet the forced positions: they must be in the
+    maze and not on an odd row and column, which are blocked in every maze, and
+    the mouse can't be on the cheese.
+    """
+    possible = []
+    for dim in maze_dims:
+        mouse = _inner_position(mouse_pos_inner, mouse_pos_outer, dim)
+        cheese = _inner_position(cheese_pos_inner, cheese_pos_outer, dim)
+        if not spawn_cheese:
+            cheese = None
+        if mouse is not None and mouse == cheese:
+            continue
+        if all(
+            0 <= pos[0] < dim
+            and 0 <= pos[1] < dim
+            and not (pos[0] % 2 and pos[1] % 2)
+            for pos in (mouse, cheese)
+            if pos is not None
+        ):
+            possible.append(dim)
+    return possible
+
+
+def _sample_chunk(
+    chunk: int,
+    chunk_size: int,
+    random_seed: int,
+    spawn_cheese: bool,
+    maze_dim: Optional[int],
+    mouse_pos_inner: Optional[Square],
+    cheese_pos_inner: Optional[Square],
+    mouse_pos_outer: Optional[Square],
+    cheese_pos_outer: Optional[Square],
+    must_be_dec_square: bool,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Carve chunk_size random mazes from the chunk-th random stream of random_seed,
+    returning the grids and positions of those meeting the constraints.
+    """
+    rng = np.random.default_rng([random_seed, chunk])
+    if maze_dim is None:
+        maze_dims = rng.integers((_MAX_MAZE_DIM - 1) // 2, size=chunk_size)
+        maze_dims = maze_dims * 2 + 3
+    else:
+        maze_dims = np.full(chunk_size, maze_dim)
+    # Uniform draws make randomized Kruskal a uniformly random wall order
+    max_walls = len(_maze_walls(_MAX_MAZE_DIM)[0])
+    draws = rng.integers(
+        2**32, size=(chunk_size, max_walls + 1), dtype=np.uint32
+    )
+    grids, _, cheese = _carve(draws, maze_dims)
+    rows = np.arange(chunk_size)
+    paddings = (maze.WORLD_DIM - maze_dims) // 2
+    keep = np.ones(chunk_size, dtype=bool)
+
+    if not spawn_cheese:
+        grids[grids == maze.CHEESE] = maze.EMPTY
+        cheese[:] = -1
+    elif cheese_pos_inner is not None or cheese_pos_outer is not None:
+        forced, in_grid = _outer_positions(
+            cheese_pos_inner, cheese_pos_outer, paddings
+        )
+        keep &= in_grid & (
+            grids[rows, forced[:, 0], forced[:, 1]] != maze.BLOCKED
+        )
+        grids[grids == maze.CHEESE] = maze.EMPTY
+        grids[rows, forced[:, 0], forced[:, 1]] = maze.CHEESE
+        cheese = forced
+
+    if mouse_pos_inner is not None or mouse_pos_outer is not None:
+        mouse, in_grid = _outer_positions(
+            mouse_pos_inner, mouse_pos_outer, paddings
+        )
+        keep &= in_grid & (grids[rows, mouse[:, 0], mouse[:, 1]] == maze.EMPTY)
+    else:
+        # A uniformly random empty square of each grid
+        empty = (grids == maze.EMPTY).reshape(chunk_size, -1)
+        pick = (rng.random(chunk_size) * empty.sum(axis=1)).astype(int)
+        mouse_idx = (np.cumsum(empty, axis=1) > pick[:, None]).argmax(axis=1)
+        mouse = np.stack(np.unravel_index(mouse_idx, grids.shape[1:]), axis=1)
+
+    if must_be_dec_square:
+        # The next steps to the cheese and the top right corner differ iff the
+        # mouse is on the path between them
+        corners = (maze.WORLD_DIM - 1 - paddings)[:, None].repeat(2, axis=1)
+        on_path = maze.path_masks(grids, cheese, corners)
+        keep &= on_path[rows, mouse[:, 0], mouse[:, 1]]
+
+    return grids[keep], mouse[keep], cheese[keep]
+
+
+def sample_mazes(
+    num: int,
+    spawn_cheese: bool = True,
+    maze_dim: Optional[int] = None,
+    mouse_pos_inner: Optional[Square] = None,
+    cheese_pos_inner: Optional[Square] = None,
+    mouse_pos_outer: Optional[Square] = None,
+    cheese_pos_outer: Optional[Square] = None,
+    must_be_dec_square: bool = False,
+    random_seed: Optional[int] = None,
+    num_workers: Optional[int] = None,
+    chunk_size: int = 10_000,
+    max_empty_rounds: int = 10,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sample num random on-distribution mazes, not tied to procgen seeds, with the
+    constraints of maze.get_random_obs_opts. Maze sizes are uniform over the
+    procgen sizes unless maze_dim is given, and the mouse is on a random empty
+    square unless forced. Returns the (N, WORLD_DIM, WORLD_DIM) full grids
+    without the mouse, and the (N, 2) outer mouse and cheese positions (the
+    cheese at (-1, -1) without spawn_cheese); to_state_batch makes states of
+    them.
+
+    Mazes are carved chunk_size at a time, in num_workers processes (default:
+    one per cpu). The results only depend on random_seed, not on num_workers.
+    Forced positions no maze size can have raise a ValueError up front, and so
+    do constraints no maze met in max_empty_rounds rounds of chunks in a row.
+    """
+    assert maze_dim is None or (
+        3 <= maze_dim <= _MAX_MAZE_DIM and maze_dim % 2 == 1
+    ), f"maze_dim must be odd and between 3 and {_MAX_MAZE_DIM}"
+    assert (
+        mouse_pos_inner is None or mouse_pos_outer is None
+    ), "only specify one of mouse_pos_inner, mouse_pos_outer"
+    assert (
+        cheese_pos_inner is None or cheese_pos_outer is None
+    ), "only specify one of cheese_pos_inner, cheese_pos_outer"
+    assert (
+        spawn_cheese or not must_be_dec_square
+    ), "decision squares need a cheese"
+    maze_dims = (
+        range(3, _MAX_MAZE_DIM + 1, 2) if maze_dim is None else [maze_dim]
+    )
+    if not _possible_dims(
+        maze_dims,
+        spawn_cheese,
+        mouse_pos_inner,
+        cheese_pos_inner,
+        mouse_pos_outer,
+        cheese_pos_outer,
+    ):
+        raise ValueError(
+            "No maze can have the forced mouse and cheese positions"
+            + (f" with maze_dim={maze_dim}" if maze_dim is not None else "")
+        )
+    if random_seed is None:
+        random_seed = np.random.SeedSequence().entropy
+    sample_chunk = functools.partial(
+        _sample_chunk,
+        chunk_size=chunk_size,
+        random_seed=random_seed,
+        spawn_cheese=spawn_cheese,
+        maze_dim=maze_dim,
+        mouse_pos_inner=mouse_pos_inner,
+        cheese_pos_inner=cheese_pos_inner,
+        mouse_pos_outer=mouse_pos_outer,
+        cheese_pos_outer=cheese_pos_outer,
+        must_be_dec_square=must_be_dec_square,
+    )
+
+    # Sample chunks in rounds, one per worker, until there are enough
+    num_workers = num_workers or os.cpu_count()
+    results = []
+    num_sampled = 0
+    empty_rounds = 0
+    pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+    try:
+        with tqdm(total=num, desc="Sampling mazes") as pbar:
+            while num_sampled < num:
+                if empty_rounds == max_empty_rounds:
+                    raise ValueError(
+                        f"No maze met the constraints in {empty_rounds} rounds"
+                        f" of {num_workers} chunks of {chunk_size} mazes"
+                    )
+                chunks = range(len(results), len(results) + num_workers)
+                num_before = num_sampled
+                for result in (pool.map if pool else map)(
+                    sample_chunk, chunks
+                ):
+                    results.append(result)
+                    num_sampled += len(result[0])
+                    pbar.update(min(len(result[0]), num - pbar.n))
+                empty_rounds = (
+                    0 if num_sampled > num_before else empty_rounds + 1
+                )
+    finally:
+        if pool:
+            pool.close()
+    return tuple(np.concatenate(arrays)[:num] for arrays in zip(*results))
+
+
+def to_state_batch(
+    grids: np.ndarray,
+    mouse_positions: np.ndarray,
+    template: Optional[bytes] = None,
+) -> maze.StateBatch:
+    """
+    States of generated levels, made by editing copies of the template state
+    (default: level 0's). Load them with
+    venv.env.callmethod("set_state", batch.to_state_bytes()).
+    """
+    if template is None:
+        template = maze.get_envstate_from_seed(0).state_bytes
+    batch = maze.StateBatch.from_template(template, len(grids))
+    batch.set_grids(grids)
+    batch.set_mouse_positions(mouse_positions)
+    return batch
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compare generated levels against procgen's"
+    )
+    parser.add_argument("--num_seeds", type=int, default=2000)
+    args = parser.parse_args()
+    report = verify(range(args.num_seeds))
+    checks = ["maze_dim_ok", "grid_ok", "mouse_ok", "cheese_ok"]
+    print(report[checks].mean())
+    failed = report[~report[checks].all(axis=1)]
+    if len(failed):
+        print(failed.head(20))
+        raise SystemExit(f"{len(failed)} of {len(report)} levels differ")
@@ -1,24 +1,18 @@
+import multiprocessing
+from dataclasses import dataclass
+from functools import partial
 import numpy as np
-from typing import Optional, Tuple, Dict, Callable
+import pandas as pd
+from typing import Optional, Tuple, Dict, Callable, List, Sequence
 from procgen_tools import maze
 
 # Helpers
 
 def decision_square(mgrid: np.ndarray) -> Optional[Tuple[int, int]]:
     "Get the decision square (square where agent can choose to go to cheese or top right) if it exists"
-
-    _, came_from, _ = maze.shortest_path(mgrid, (0, 0))
-    path_to_cheese = maze.reconstruct_path(came_from, maze.get_cheese_pos(mgrid))
-
-    tr = (mgrid.shape[0]-1, mgrid.shape[1]-1)
-    _, came_from, _ = maze.shortest_path(mgrid, (0, 0), stop_condition=lambda _, c: c == tr)
-    path_to_top_right = maze.reconstruct_path(came_from, tr)
-    # if the paths diverge they can never connect again, since mazes have no cycles
-    for i, (n1, n2) in enumerate(zip(path_to_cheese, path_to_top_right)):
-        # print(f'step {i}/{min(len(path_to_cheese), len(path_to_top_right))}: {n1} {n2}')
-        if n1 != n2:
-            return path_to_cheese[i - 1]
-    return None
+    # the paths to the cheese and the top right diverge at their lowest common
+    # ancestor; they can never connect again, since mazes have no cycles
+    return maze.get_maze_tree(mgrid).decision_square()
 
 
 def shortest_path_to_nxn(grid: np.ndarray, start: Tuple[int, int], n: int):
@@ -27,6 +21,17 @@ def shortest_path_to_nxn(grid: np.ndarray, start: Tuple[int, int], n: int):
     return maze.shortest_path(grid, start, stop_condition=lambda _,c: c in top_right_5x5, heuristic=lambda *_: 1)
 
 
+def steps_to_nxn(grid: np.ndarray, start: Tuple[int, int], n: int) -> int:
+    "Smallest number of steps from start to a square in the top right NxN region"
+    dist = maze.get_maze_tree(grid).distances(start)[-n:, -n:]
+    return int(dist[dist >= 0].min())
+
+
+def steps_between(grid: np.ndarray, s1: Tuple[int, int], s2: Tuple[int, int]) -> int:
+    "Number of steps between two squares of the maze"
+    return maze.get_maze_tree(grid).distance(s1, s2)
+
+
 def get_dsq(grid: np.ndarray) -> Tuple[int, int]:
     "Get the decision square and assert it exists"
     d_sq = decision_square(grid)
@@ -90,13 +95,13 @@ def taxi_dist_cheese_decision_square(grid: np.ndarray) -> float:
 @metric
 def steps_between_cheese_decision_square(grid: np.ndarray) -> int:
     "Number of steps between cheese and decision-square"
-    return path_len(*maze.shortest_path(grid, get_dsq(grid)))
+    return steps_between(grid, get_dsq(grid), maze.get_cheese_pos(grid))
 
 
 @metric
 def steps_between_cheese_top_right(grid: np.ndarray) -> int:
     "Number of steps between cheese and top-right"
-    return path_len(*maze.shortest_path(grid, start=(grid.shape[0]-1, grid.shape[1]-1)))
+    return steps_between(grid, (grid.shape[0]-1, grid.shape[1]-1), maze.get_cheese_pos(grid))
 
 
 @metric
@@ -128,19 +133,19 @@ def steps_between_decision_square_top_right(grid: np.ndarray) -> int:
     "Number of steps between decision-square and top-right"
     dsq = get_dsq(grid)
     tr = (grid.shape[0]-1, grid.shape[1]-1)
-    return path_len(*maze.shortest_path(grid, start=tr, stop_condition=lambda _,c: c == dsq))
+    return steps_between(grid, tr, dsq)
 
 
 @metric
 def steps_between_cheese_5x5(grid: np.ndarray) -> int:
     "Smallest number of steps between cheese and a square in the top-right 5*5 region"
-    return path_len(*shortest_path_to_nxn(grid, maze.get_cheese_pos(grid), n=5))
+    return steps_to_nxn(grid, maze.get_cheese_pos(grid), n=5)
 
 
 @metric
 def steps_between_decision_square_5x5(grid: np.ndarray) -> int:
     "Smallest number of steps between decision-square and a square in the top-right 5*5 region"
-    return path_len(*shortest_path_to_nxn(grid, get_dsq(grid), n=5))
+    return steps_to_nxn(grid, get_dsq(grid), n=5)
 
 
 @metric
@@ -171,3 +176,224 @@ def cheese_coord_norm(grid: np.ndarray, **kwargs) -> float:
     "Norm of the outer grid coordinates of cheese."
     outer_grid = maze.outer_grid(grid)
     return np.linalg.norm( maze.get_cheese_pos(outer_grid))
+
+
+# Batched evaluation: compute the intermediates the metrics share (cheese, decision square,
+# tree distances, nearest top right NxN square) once per grid, then every metric with numpy.
+
+@dataclass
+class GridFeatures:
+    """
+    Intermediates shared by the metrics of N inner grids. Squares are (N, 2) arrays; grids
+    without a decision square have it at (-1, -1), and -1 for the steps involving it.
+    """
+    size: np.ndarray  # (N,) inner grid sizes
+    cheese: np.ndarray
+    decision_square: np.ndarray
+    steps_cheese_decision_square: np.ndarray
+    steps_cheese_top_right: np.ndarray
+    steps_decision_square_top_right: np.ndarray
+    steps_cheese_nxn: np.ndarray
+    steps_decision_square_nxn: np.ndarray
+    nxn_open: np.ndarray  # (N, n, n) open squares of the top right NxN region
+    n: int = 5
+
+    @property
+    def top_right(self) -> np.ndarray:
+        return np.stack([self.size - 1, self.size - 1], axis=1)
+
+    @property
+    def has_decision_square(self) -> np.ndarray:
+        return self.decision_square[:, 0] >= 0
+
+    @property
+    def nxn_coords(self) -> np.ndarray:
+        "(N, n) rows (and columns) of the top right NxN region, as dist_cheese_nxn iterates them"
+        return self.size[:, None] - self.n + np.arange(self.n)
+
+    @classmethod
+    def from_grids(cls, grids: Sequence[np.ndarray], n: int = 5) -> "GridFeatures":
+        columns = {name: [] for name in cls.__dataclass_fields__ if name != "n"}
+        for grid in grids:
+            grid = maze.inner_grid(grid)
+            tree = maze.get_maze_tree(grid)
+            tr = (grid.shape[0]-1, grid.shape[1]-1)
+            cheese = maze.get_cheese_pos(grid)
+            dsq = tree.decision_square()
+            dist_cheese = tree.distances(cheese)
+            dist_dsq = tree.distances(dsq) if dsq is not None else None
+
+            def steps_nxn(dist):
+                if dist is None:
+                    return -1
+                region = dist[-n:, -n:]
+                return region[region >= 0].min()
+
+            coords = grid.shape[0] - n + np.arange(n)
+            values = {
+                "size": grid.shape[0],
+                "cheese": cheese,
+                "decision_square": (-1, -1) if dsq is None else dsq,
+                "steps_cheese_decision_square": -1 if dsq is None else dist_cheese[dsq],
+                "steps_cheese_top_right": dist_cheese[tr],
+                "steps_decision_square_top_right": -1 if dsq is None else dist_dsq[tr],
+                "steps_cheese_nxn": steps_nxn(dist_cheese),
+                "steps_decision_square_nxn": steps_nxn(dist_dsq),
+                "nxn_open": grid[np.ix_(coords, coords)] != maze.BLOCKED,
+            }
+            for name, value in values.items():
+                columns[name].append(value)
+        shapes = {"cheese": (2,), "decision_square": (2,), "nxn_open": (n, n)}
+        return cls(n=n, **{
+            name: np.array(column, dtype=bool if name == "nxn_open" else int).reshape(len(column), *shapes.get(name, ()))
+            for name, column in columns.items()
+        })
+
+
+BatchMetricFn = Callable[[GridFeatures], np.ndarray]
+batch_metrics: Dict[str, BatchMetricFn] = {}
+
+def batch_metric(fn: BatchMetricFn):
+    "Register fn, named batch_<name>, as the batched version of the metric <name>"
+    name = fn.__name__[len("batch_"):]
+    assert fn.__name__.startswith("batch_") and name in metrics, f"{fn.__name__} doesn't name a registered metric"
+    batch_metrics[name] = fn
+    return fn
+
+
+def _root(x: np.ndarray, p) -> np.ndarray:
+    "x**(1/p); np.sqrt is correctly rounded for p=2, numpy's power can be off by an ulp"
+    return np.sqrt(x) if p == 2 else x**(1/p)
+
+
+def batch_distance(s1: np.ndarray, s2: np.ndarray, p=2) -> np.ndarray:
+    "distance between the rows of s1 and s2"
+    return _root(np.abs(s1[..., 0]-s2[..., 0])**p + np.abs(s1[..., 1]-s2[..., 1])**p, p)
+
+
+def _where_dsq(f: GridFeatures, values: np.ndarray) -> np.ndarray:
+    "values where there is a decision square, NaN elsewhere"
+    return np.where(f.has_decision_square, values, np.nan)
+
+
+def batch_dist_nxn(f: GridFeatures, start: np.ndarray, p=2) -> np.ndarray:
+    "dist_cheese_nxn from each start to the open squares of its grid's top right NxN region"
+    coords = f.nxn_coords
+    rows, cols = coords[:, :, None], coords[:, None, :]
+    x, y = start[:, 0, None, None], start[:, 1, None, None]
+    dist = _root(np.abs(x-rows)**p + np.abs(y-cols)**p, p)
+    return np.where(f.nxn_open, dist, np.inf).min(axis=(1, 2))
+
+
+@batch_metric
+def batch_euc_dist_cheese_decision_square(f: GridFeatures) -> np.ndarray:
+    return _where_dsq(f, batch_distance(f.cheese, f.decision_square))
+
+
+@batch_metric
+def batch_taxi_dist_cheese_decision_square(f: GridFeatures) -> np.ndarray:
+    return _where_dsq(f, batch_distance(f.cheese, f.decision_square, p=1))
+
+
+@batch_metric
+def batch_steps_between_cheese_decision_square(f: GridFeatures) -> np.ndarray:
+    return _where_dsq(f, f.steps_cheese_decision_square)
+
+
+@batch_metric
+def batch_steps_between_cheese_top_right(f: GridFeatures) -> np.ndarray:
+    return f.steps_cheese_top_right
+
+
+@batch_metric
+def batch_euc_dist_cheese_top_right(f: GridFeatures) -> np.ndarray:
+    return batch_distance(f.cheese, f.top_right)
+
+
+@batch_metric
+def batch_taxi_dist_cheese_top_right(f: GridFeatures) -> np.ndarray:
+    return batch_distance(f.cheese, f.top_right, p=1)
+
+
+@batch_metric
+def batch_euc_dist_decision_square_top_right(f: GridFeatures) -> np.ndarray:
+    return _where_dsq(f, batch_distance(f.decision_square, f.top_right))
+
+
+@batch_metric
+def batch_taxi_dist_decision_square_top_right(f: GridFeatures) -> np.ndarray:
+    return _where_dsq(f, batch_distance(f.decision_square, f.top_right, p=1))
+
+
+@batch_metric
+def batch_steps_between_decision_square_top_right(f: GridFeatures) -> np.ndarray:
+    return _where_dsq(f, f.steps_decision_square_top_right)
+
+
+@batch_metric
+def batch_steps_between_cheese_5x5(f: GridFeatures) -> np.ndarray:
+    assert f.n == 5
+    return f.steps_cheese_nxn
+
+
+@batch_metric
+def batch_steps_between_decision_square_5x5(f: GridFeatures) -> np.ndarray:
+    assert f.n == 5
+    return _where_dsq(f, f.steps_decision_square_nxn)
+
+
+@batch_metric
+def batch_euc_dist_cheese_5x5(f: GridFeatures) -> np.ndarray:
+    assert f.n == 5
+    return batch_dist_nxn(f, f.cheese)
+
+
+@batch_metric
+def batch_taxi_dist_cheese_5x5(f: GridFeatures) -> np.ndarray:
+    assert f.n == 5
+    return batch_dist_nxn(f, f.cheese, p=1)
+
+
+@batch_metric
+def batch_euc_dist_decision_square_5x5(f: GridFeatures) -> np.ndarray:
+    assert f.n == 5
+    return _where_dsq(f, batch_dist_nxn(f, f.decision_square))
+
+
+@batch_metric
+def batch_taxi_dist_decision_square_5x5(f: GridFeatures) -> np.ndarray:
+    assert f.n == 5
+    return _where_dsq(f, batch_dist_nxn(f, f.decision_square, p=1))
+
+
+@batch_metric
+def batch_cheese_coord_norm(f: GridFeatures) -> np.ndarray:
+    padding = (maze.WORLD_DIM - f.size) // 2
+    return np.sqrt(((f.cheese + padding[:, None])**2).sum(axis=1))
+
+
+def _metrics_table(grids: List[np.ndarray], names: List[str]) -> pd.DataFrame:
+    features = GridFeatures.from_grids(grids)
+    return pd.DataFrame({
+        name: batch_metrics[name](features) if name in batch_metrics
+        else np.array([metrics[name](grid) for grid in grids])
+        for name in names
+    })
+
+
+def metrics_table(grids, names: Optional[List[str]] = None, num_workers: Optional[int] = None, chunk_size: int = 1000) -> pd.DataFrame:
+    """
+    Evaluate the registered metrics (or just names) on a stack or list of inner grids, or a list
+    of data_utils.Episodes, returning a DataFrame with one row per grid and one column per metric.
+    Metrics that need a decision square are NaN for grids without one. Inputs longer than
+    chunk_size are split over num_workers processes if given.
+    """
+    grids = [g if isinstance(g, np.ndarray) else g.grid() for g in grids]
+    names = list(metrics) if names is None else names
+    chunks = [grids[i:i+chunk_size] for i in range(0, len(grids), chunk_size)]
+    if num_workers and len(chunks) > 1:
+        with multiprocessing.Pool(num_workers) as pool:
+            tables = pool.map(partial(_metrics_table, names=names), chunks)
+    else:
+        tables = [_metrics_table(chunk, names) for chunk in chunks]
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=names)
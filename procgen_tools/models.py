@@ -155,6 +155,148 @@ class InterpretableImpalaModel(nn.Module):
         x = self.relufc(x)
         return x
 
+def _conv_window(rows, size, span):
+    """
+    Move windows of the given span, with top rows (or left columns) rows, to
+    cover what a 3x3 conv with padding 1 reaches from them, staying inside
+    size. Returns the new rows and span.
+    """
+    span = min(span + 2, size)
+    return (rows - 1).clamp(0, size - span), span
+
+
+def _pool_window(rows, size, span):
+    """ Same for a 3x3 maxpool with stride 2 and padding 1; size is its output size. """
+    span = min((span + 1) // 2 + 1, size)
+    return (rows // 2).clamp(0, size - span), span
+
+
+def _window_index(x, rows, cols, height, width):
+    """ Index of the (height, width) window at rows, cols (N,) of each of x's N images. """
+    arange = lambda n: torch.arange(n, device=x.device)
+    return (arange(len(x))[:, None, None],
+            (rows[:, None] + arange(height))[:, :, None],
+            (cols[:, None] + arange(width))[:, None, :])
+
+
+def _gather_windows(x, rows, cols, height, width):
+    """ The (N, C, height, width) windows at rows, cols of x (N, C, H, W). """
+    n, r, c = _window_index(x, rows, cols, height, width)
+    return x[n, :, r, c].permute(0, 3, 1, 2)
+
+
+def _changed_span(changed):
+    """ Top rows (or left columns) and span of windows around the True entries of each row of changed (N, size). """
+    size = changed.shape[1]
+    idx = torch.arange(size, device=changed.device)
+    first = torch.where(changed, idx, size).min(dim=1).values
+    last = torch.where(changed, idx, -1).max(dim=1).values
+    span = max(int((last - first + 1).max()), 1)
+    return first.clamp(0, size - span), span
+
+
+class IncrementalImpalaForward:
+    """
+    Inference for an InterpretableImpalaModel on many observations which each
+    differ from one base observation in a small region, like the mouse at
+    each square of a maze. The activations of the base are computed once.
+    For each observation, each conv, maxpool and residual layer through
+    block3 only recomputes the window of its output that the changed pixels
+    can reach, copying the rest from the base; relu3 and fc run on the full
+    block3 output at the end.
+
+    The base needn't be a real observation: e.g. the per-pixel median of the
+    mouse position observations of a maze is the maze without a mouse.
+
+    Submodules through block3 aren't called, so their forward hooks (e.g.
+    patches) would be skipped; constructing this with hooks on them raises
+    a ValueError.
+    """
+    def __init__(self, model: InterpretableImpalaModel, base_obs):
+        hooked = [name or 'model' for name, module in model.named_modules()
+                  if (name == '' or name.startswith('block'))
+                  and (module._forward_hooks or module._forward_pre_hooks)]
+        if hooked:
+            raise ValueError(f"Can't run incrementally with forward hooks on {hooked}")
+
+        self.model = model
+        self.steps = []
+        for block in (model.block1, model.block2, model.block3):
+            self.steps += [('conv', block.conv), ('pool', block.maxpool)]
+            for res in (block.res1, block.res2):
+                self.steps += [('res_conv1', res.conv1), ('res_conv2', res.conv2)]
+
+        param = next(model.parameters())
+        self.base_obs = torch.as_tensor(base_obs, dtype=param.dtype, device=param.device)
+        size = self.base_obs.shape[-1]
+        full = torch.zeros(1, dtype=torch.long, device=param.device)
+        with torch.no_grad():
+            self.base = self._forward(self.base_obs[None], full, full, size, size, keep=True)
+
+    def _forward(self, x, rows, cols, height, width, keep=False):
+        """
+        Run the steps on x, whose images differ from the base only in the
+        windows at rows, cols. Returns the block3 output, or the output of
+        every step if keep.
+        """
+        outs = []
+        for i, (kind, module) in enumerate(self.steps):
+            base = self.base[i] if not keep else None
+            size = x.shape[-1]
+            if kind == 'pool':
+                rows, height = _pool_window(rows, size // 2, height)
+                cols, width = _pool_window(cols, size // 2, width)
+                # The window's input rows are 2 * rows - 1 ... 2 * (rows + height) - 1
+                padded = F.pad(x, (1, 1, 1, 1), value=-float('inf'))
+                windows = F.max_pool2d(_gather_windows(padded, 2 * rows, 2 * cols, 2 * height + 1, 2 * width + 1),
+                                       kernel_size=3, stride=2)
+            else:
+                rows, height = _conv_window(rows, size, height)
+                cols, width = _conv_window(cols, size, width)
+                if kind == 'res_conv1':
+                    res_input = x
+                padded = _gather_windows(F.pad(x, (1, 1, 1, 1)), rows, cols, height + 2, width + 2)
+                if kind != 'conv':
+                    padded = F.relu(padded)
+                windows = F.conv2d(padded, module.weight, module.bias)
+                if kind == 'res_conv2':
+                    windows = windows + _gather_windows(res_input, rows, cols, height, width)
+
+            if base is None:  # The windows are the whole output
+                x = windows
+            else:
+                x = base.expand(len(windows), -1, -1, -1).clone()
+                n, r, c = _window_index(x, rows, cols, height, width)
+                x[n, :, r, c] = windows.permute(0, 2, 3, 1)
+            if keep:
+                outs.append(x)
+        return outs if keep else x
+
+    def __call__(self, obs) -> torch.Tensor:
+        """ The model's (N, 256) output on obs (N, 3, 64, 64). """
+        obs = torch.as_tensor(obs, dtype=self.base_obs.dtype, device=self.base_obs.device)
+        changed = (obs != self.base_obs).any(dim=1)
+        rows, height = _changed_span(changed.any(dim=2))
+        cols, width = _changed_span(changed.any(dim=1))
+        x = self._forward(obs, rows, cols, height, width)
+        x = self.model.relu3(x)
+        x = self.model.flatten(x)
+        x = self.model.fc(x)
+        return self.model.relufc(x)
+
+    def verify(self, obs, atol: float = 1e-4) -> float:
+        """
+        Check the incremental output on obs against the model's full forward,
+        returning the max absolute difference.
+        """
+        with torch.no_grad():
+            incremental = self(obs)
+            full = self.model(torch.as_tensor(obs, dtype=self.base_obs.dtype, device=self.base_obs.device))
+        error = (incremental - full).abs().max().item()
+        assert error <= atol, f"Incremental forward is off by {error}"
+        return error
+
+
 class CategoricalPolicy(nn.Module):
     """
     Copied from train-procgen-pytorch, removed recurrent option as we're not using it.
@@ -0,0 +1,601 @@
+"""
+Render mazes from grids with numpy, instead of set_state and a C++ render per
+maze. Procgen draws the whole 25x25 world into the image, so each pixel belongs
+to one grid square; an atlas stores, for each square type, the full frame
+procgen renders when every square has that type. Composing an image is then one
+gather per pixel. There are two atlases: the 64x64 agent observation and the
+512x512 human view.
+
+    atlas = SpriteAtlas.load_or_extract("data/sprite_atlas.npz")
+    obs = render_obs(grids, mouse_positions, atlas)  # (N, 3, 64, 64) float32
+    img = render_human(inner_grid, crop_padding=True)  # (H, W, 3) uint8
+
+Pixels on the border between two squares are blended by procgen's renderer,
+so renders are close to but not always exactly the env's. load_or_extract
+measures the difference against procgen on many levels with calibrate, and
+atlases which weren't measured or are off by more than MAX_ATLAS_ERROR are
+refused; if the default human view atlas is, human views are rendered by
+procgen instead. python -m procgen_tools.rendering reports the error.
+"""
+
+import itertools
+import os
+import queue
+import threading
+from dataclasses import dataclass
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from warnings import warn
+
+import numpy as np
+from tqdm.auto import tqdm
+
+from procgen_tools import maze
+
+OBS_SIZE = 64
+HUMAN_SIZE = 512
+# Order of the atlas frames
+SQUARE_TYPES = (maze.EMPTY, maze.BLOCKED, maze.CHEESE, maze.MOUSE)
+# Largest mean absolute pixel error (in [0, 1], like observations) on any level
+# calibrate measured for an atlas to be used
+MAX_ATLAS_ERROR = 0.01
+# Where the default human view atlas is extracted to
+ATLAS_DIR = os.environ.get(
+    "PROCGEN_TOOLS_ATLAS_DIR", os.path.expanduser("~/.cache/procgen_tools")
+)
+
+
+def owner_map(size: int = OBS_SIZE, world_dim: int = maze.WORLD_DIM):
+    """
+    (size,) arrays mapping image rows and columns to the grid row and column
+    they show. The numpy grid is flipped along the y-axis relative to images.
+    """
+    tiles = np.floor((np.arange(size) + 0.5) * world_dim / size).astype(int)
+    return world_dim - 1 - tiles, tiles
+
+
+@dataclass
+class SpriteAtlas:
+    frames: np.ndarray  # (len(SQUARE_TYPES), size, size, 3), channels last
+    # Error against procgen's renders, as measured by calibrate
+    fidelity: Optional[Dict[str, float]] = None
+
+    @property
+    def size(self) -> int:
+        return self.frames.shape[1]
+
+    def save(self, path: str):
+        fidelity = {
+            f"fidelity.{k}": v for k, v in (self.fidelity or {}).items()
+        }
+        np.savez_compressed(path, frames=self.frames, **fidelity)
+
+    @classmethod
+    def load(cls, path: str) -> "SpriteAtlas":
+        with np.load(path) as f:
+            fidelity = {
+                k.split(".", 1)[1]: float(f[k])
+                for k in f.files
+                if k.startswith("fidelity.")
+            }
+            return cls(frames=f["frames"], fidelity=fidelity or None)
+
+    @classmethod
+    def load_or_extract(
+        cls, path: str, human=False, num_check_seeds: int = 1000
+    ) -> "SpriteAtlas":
+        """
+        Load the atlas at path, extracting it from procgen and saving it first
+        if needed. New atlases, and saved ones which weren't measured, are
+        calibrated on num_check_seeds levels.
+        """
+        if os.path.exists(path):
+            atlas = cls.load(path)
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            atlas = extract_human_atlas() if human else extract_atlas()
+        if atlas.fidelity is None:
+            atlas = calibrate(
+                atlas, range(num_check_seeds), chunk_size=16 if human else 256
+            )
+            atlas.save(path)
+        return atlas
+
+
+def _env_obs(state_bytes_list: Sequence[bytes]) -> np.ndarray:
+    "The (N, 64, 64, 3) float32 observations procgen renders for the states."
+    with maze.VENV_POOL.borrow(state_bytes_list) as venv:
+        return venv.reset().transpose(0, 2, 3, 1).astype(np.float32)
+
+
+def _env_human_views(state_bytes_list: Sequence[bytes]) -> np.ndarray:
+    "The (N, 512, 512, 3) uint8 human views procgen renders for the states."
+    with maze.VENV_POOL.borrow(state_bytes_list) as venv:
+        return np.stack([info["rgb"] for info in venv.env.get_info()])
+
+
+def _env_human_view(grid: np.ndarray) -> np.ndarray:
+    """
+    procgen's human view of an outer grid. Without a mouse in the grid, the
+    view is rendered with the mouse on two empty squares, taking the pixels
+    under each from the other render.
+    """
+    mouse = np.argwhere(grid == maze.MOUSE)
+    background = np.where(grid == maze.MOUSE, maze.EMPTY, grid)
+    if len(mouse) == 0:
+        mouse = np.argwhere(background == maze.EMPTY)[[0, -1]]
+    template = maze.get_envstate_from_seed(0).state_bytes
+    batch = maze.StateBatch.from_template(template, len(mouse))
+    batch.set_grids(background)
+    batch.set_mouse_positions(mouse)
+    views = _env_human_views(batch.to_state_bytes())
+    if len(views) == 1:
+        return views[0]
+    rows, cols = owner_map(HUMAN_SIZE)
+    under_a = (rows[:, None] == mouse[0, 0]) & (cols[None, :] == mouse[0, 1])
+    return np.where(under_a[..., None], views[1], views[0])
+
+
+def _extract_frames(
+    render: Callable[[Sequence[bytes]], np.ndarray],
+    size: int,
+    template_seed: int,
+    chunk_size: int = maze.WORLD_DIM,
+) -> SpriteAtlas:
+    """
+    Extract an atlas by rendering filled grids with render. Each filled frame
+    is rendered twice with the mouse in different places, to fill in the
+    squares under the mouse; the mouse frame comes from one render per square,
+    chunk_size squares at a time.
+    """
+    template = maze.get_envstate_from_seed(template_seed).state_bytes
+    rows, cols = owner_map(size)
+    world_dim = maze.WORLD_DIM
+    mouse_a, mouse_b = (0, 0), (world_dim - 1, world_dim - 1)
+
+    frames = []
+    for square_type in SQUARE_TYPES[:-1]:
+        grids = np.full((2, world_dim, world_dim), square_type)
+        # The mouse stands on an empty square
+        grids[0][mouse_a] = grids[1][mouse_b] = maze.EMPTY
+        batch = maze.StateBatch.from_template(template, 2)
+        batch.set_grids(grids)
+        batch.set_mouse_positions(np.array([mouse_a, mouse_b]))
+        img = render(batch.to_state_bytes())
+        under_a = (rows[:, None] == mouse_a[0]) & (cols[None, :] == mouse_a[1])
+        frames.append(np.where(under_a[..., None], img[1], img[0]))
+
+    # Mouse at every square of an empty grid; keep the pixels of its square
+    mouse_frame = np.empty_like(frames[0])
+    owner = np.ravel_multi_index(
+        (rows[:, None], cols[None, :]), (world_dim,) * 2
+    )
+    positions = np.argwhere(np.ones((world_dim, world_dim), dtype=bool))
+    for start in range(0, len(positions), chunk_size):
+        chunk = positions[start : start + chunk_size]
+        batch = maze.StateBatch.from_template(template, len(chunk))
+        batch.set_grids(np.full((world_dim, world_dim), maze.EMPTY))
+        batch.set_mouse_positions(chunk)
+        img = render(batch.to_state_bytes())
+        pixel_rows, pixel_cols = np.nonzero(
+            (owner >= start) & (owner < start + len(chunk))
+        )
+        mouse_frame[pixel_rows, pixel_cols] = img[
+            owner[pixel_rows, pixel_cols] - start, pixel_rows, pixel_cols
+        ]
+    frames.append(mouse_frame)
+    return SpriteAtlas(frames=np.stack(frames))
+
+
+def extract_atlas(template_seed: int = 0) -> SpriteAtlas:
+    "Extract the agent observation atlas from procgen renders."
+    return _extract_frames(_env_obs, OBS_SIZE, template_seed)
+
+
+def extract_human_atlas(template_seed: int = 0) -> SpriteAtlas:
+    "Extract the human view atlas from procgen renders."
+    return _extract_frames(_env_human_views, HUMAN_SIZE, template_seed)
+
+
+def _compose(grids: np.ndarray, atlas: SpriteAtlas) -> np.ndarray:
+    "Compose (N, size, size, 3) images of (N, world_dim, world_dim) grids."
+    lookup = np.zeros(max(SQUARE_TYPES) + 1, dtype=np.intp)
+    lookup[list(SQUARE_TYPES)] = np.arange(len(SQUARE_TYPES))
+    rows, cols = owner_map(atlas.size, world_dim=grids.shape[1])
+    # Frame index of each square, then of each pixel
+    frame_idx = lookup[grids][:, rows[:, None], cols[None, :]]
+    pixels = np.arange(atlas.size)
+    return atlas.frames[frame_idx, pixels[:, None], pixels[None, :]]
+
+
+def render_obs(
+    grids: np.ndarray,
+    mouse_positions: Optional[np.ndarray] = None,
+    atlas: SpriteAtlas = None,
+) -> np.ndarray:
+    """
+    Render (N, 3, 64, 64) float32 observations, as venv.reset() returns them,
+    from (N, WORLD_DIM, WORLD_DIM) outer grids or one grid. If mouse_positions,
+    (N, 2) outer (row, col) positions, aren't given, the grids must contain the
+    mouse; one grid with N positions renders the mouse at each of them.
+    """
+    grids = np.asarray(grids)
+    if grids.ndim == 2:
+        grids = grids[None]
+    if mouse_positions is not None:
+        mouse_positions = np.asarray(mouse_positions).reshape(-1, 2)
+        num = max(len(grids), len(mouse_positions))
+        grids = np.broadcast_to(grids, (num, *grids.shape[1:]))
+        mouse_positions = np.broadcast_to(mouse_positions, (num, 2))
+    grids = grids.copy()
+    if mouse_positions is not None:
+        grids[grids == maze.MOUSE] = maze.EMPTY
+        grids[
+            np.arange(len(grids)), mouse_positions[:, 0], mouse_positions[:, 1]
+        ] = maze.MOUSE
+    assert (
+        (grids == maze.MOUSE).sum(axis=(1, 2)) == 1
+    ).all(), "each grid needs exactly one mouse"
+
+    obs = _compose(grids, atlas).astype(np.float32, copy=False)
+    return np.ascontiguousarray(obs.transpose(0, 3, 1, 2))
+
+
+def render_obs_from_states(
+    state_bytes_list: Sequence[bytes], atlas: SpriteAtlas
+) -> np.ndarray:
+    "Render observations of maze states, like venv.reset() after set_state."
+    batch = maze.StateBatch(state_bytes_list)
+    return render_obs(batch.grids(with_mouse=True), atlas=atlas)
+
+
+def fidelity(
+    state_bytes_list: Sequence[bytes], atlas: SpriteAtlas
+) -> Dict[str, float]:
+    """
+    Compare numpy renders of the states against procgen's, agent observations
+    or human views depending on the atlas' size, returning the mean and max
+    absolute pixel error (in [0, 1]), the largest mean absolute error of any
+    one state and the fraction of pixels that differ.
+    """
+    if atlas.size == HUMAN_SIZE:
+        grids = maze.StateBatch(state_bytes_list).grids(with_mouse=True)
+        rendered = _compose(grids, atlas).astype(np.float32) / 255
+        env = _env_human_views(state_bytes_list).astype(np.float32) / 255
+    else:
+        rendered = render_obs_from_states(state_bytes_list, atlas)
+        rendered = rendered.transpose(0, 2, 3, 1)
+        env = _env_obs(state_bytes_list)
+    error = np.abs(rendered - env)
+    return {
+        "mean_abs_error": float(error.mean()),
+        "max_abs_error": float(error.max()),
+        "max_state_mean_abs_error": float(error.mean(axis=(1, 2, 3)).max()),
+        "frac_pixels_differ": float((error.max(axis=3) > 1e-6).mean()),
+    }
+
+
+def calibrate(
+    atlas: SpriteAtlas,
+    seeds: Iterable[int],
+    chunk_size: int = 256,
+    random_seed: int = 0,
+) -> SpriteAtlas:
+    """
+    Measure the fidelity of an atlas on the levels of seeds, with the mouse
+    moved to a random legal square of each, and return the atlas with the
+    result attached. Errors are combined over chunks of chunk_size levels.
+    """
+    rng = np.random.default_rng(random_seed)
+    seeds = list(seeds)
+    results = []
+    for start in tqdm(range(0, len(seeds), chunk_size), desc="Calibrating"):
+        batch = maze.StateBatch.from_levels(seeds[start : start + chunk_size])
+        legal = [
+            maze.get_legal_mouse_positions(grid)
+            for grid in batch.grids(with_mouse=False)
+        ]
+        batch.set_mouse_positions(
+            np.array([pos[rng.integers(len(pos))] for pos in legal])
+        )
+        states = batch.to_state_bytes()
+        results.append((len(states), fidelity(states, atlas)))
+
+    num = sum(n for n, _ in results)
+    measured = {
+        "mean_abs_error": sum(n * r["mean_abs_error"] for n, r in results)
+        / num,
+        "frac_pixels_differ": sum(
+            n * r["frac_pixels_differ"] for n, r in results
+        )
+        / num,
+        "max_abs_error": max(r["max_abs_error"] for _, r in results),
+        "max_state_mean_abs_error": max(
+            r["max_state_mean_abs_error"] for _, r in results
+        ),
+        "num_states": float(num),
+    }
+    return SpriteAtlas(frames=atlas.frames, fidelity=measured)
+
+
+def _check_atlas(atlas: SpriteAtlas):
+    "Refuse atlases whose renders aren't known to be close to procgen's."
+    if atlas.fidelity is None:
+        raise ValueError(
+            "The atlas' fidelity wasn't measured; use calibrate or "
+            "SpriteAtlas.load_or_extract"
+        )
+    error = atlas.fidelity["max_state_mean_abs_error"]
+    if error > MAX_ATLAS_ERROR:
+        raise ValueError(
+            f"The atlas' renders are off by up to {error:.4f} per pixel on "
+            f"average, more than MAX_ATLAS_ERROR = {MAX_ATLAS_ERROR}"
+        )
+
+
+def obs_from_states(
+    state_bytes_list: Sequence[bytes], atlas: Optional[SpriteAtlas] = None
+) -> np.ndarray:
+    """
+    The (N, 3, 64, 64) float32 observations of the states, rendered with numpy
+    if an atlas is given, else by procgen with a pooled venv.
+    """
+    if atlas is not None:
+        _check_atlas(atlas)
+        return render_obs_from_states(state_bytes_list, atlas)
+    if len(state_bytes_list) == 0:
+        return np.zeros((0, 3, OBS_SIZE, OBS_SIZE), dtype=np.float32)
+    return np.ascontiguousarray(
+        _env_obs(state_bytes_list).transpose(0, 3, 1, 2)
+    )
+
+
+# Marks the end of a stream_obs_from_states queue
+_DONE = object()
+
+
+def stream_obs_from_states(
+    states: Iterable[bytes],
+    chunk_size: int = 64,
+    prefetch: int = 2,
+    atlas: Optional[SpriteAtlas] = None,
+) -> Iterator[np.ndarray]:
+    """
+    obs_from_states for a stream of states, in (n, 3, 64, 64) chunks of
+    chunk_size (only the last chunk is smaller). Procgen renders with one pooled
+    venv of at least chunk_size envs, refilled with set_state for each chunk,
+    so memory is bounded by the chunk size rather than the number of states. Chunks are
+    rendered in a background thread up to prefetch chunks ahead of the
+    consumer, so e.g. the policy forward on one chunk overlaps with rendering
+    the next; prefetch=0 renders each chunk when it is asked for.
+    """
+
+    def chunks():
+        it = iter(states)
+        while True:
+            chunk = list(itertools.islice(it, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def render(venv, chunk):
+        if venv is None:
+            return render_obs_from_states(chunk, atlas)
+        # Fill the envs past the end of the chunk with its last state
+        padding = [chunk[-1]] * (venv.num_envs - len(chunk))
+        venv.env.callmethod("set_state", chunk + padding)
+        return venv.reset()[: len(chunk)].astype(np.float32)
+
+    if atlas is not None:
+        _check_atlas(atlas)
+    venv = (
+        maze.VENV_POOL.checkout(chunk_size, at_least=True)
+        if atlas is None
+        else None
+    )
+    if prefetch == 0:
+        try:
+            for chunk in chunks():
+                yield render(venv, chunk)
+        finally:
+            if venv is not None:
+                maze.VENV_POOL.checkin(venv)
+        return
+
+    rendered = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up once the consumer has stopped, rather than block forever
+        while not stop.is_set():
+            try:
+                rendered.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for chunk in chunks():
+                if not put(render(venv, chunk)):
+                    return
+            put(_DONE)
+        except BaseException as e:  # Raised again in the consumer
+            put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = rendered.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+        if venv is not None:
+            maze.VENV_POOL.checkin(venv)
+
+
+def stream_mouse_position_obs(
+    levels: Iterable,
+    chunk_size: int = 64,
+    prefetch: int = 2,
+    atlas: Optional[SpriteAtlas] = None,
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    The observations with the mouse at each legal position of each of the
+    levels (seeds, EnvStates and/or state bytes), streamed chunk_size at a
+    time with stream_obs_from_states; chunks can span levels.
+
+    Yields level_indices, positions, obs: for each observation in the chunk,
+    the index of its level in levels and its inner grid mouse position.
+    """
+    _, positions, states = maze.mouse_position_states(levels)
+    level_indices = np.repeat(
+        np.arange(len(positions)), [len(pos) for pos in positions]
+    )
+    positions = np.array(
+        [p for pos in positions for p in pos], dtype=int
+    ).reshape(-1, 2)
+    start = 0
+    for obs in stream_obs_from_states(states, chunk_size, prefetch, atlas):
+        stop = start + len(obs)
+        yield level_indices[start:stop], positions[start:stop], obs
+        start = stop
+
+
+def obs_with_all_mouse_positions(state_bytes: bytes, atlas: SpriteAtlas):
+    """
+    Numpy version of maze.venv_with_all_mouse_positions: the observations with
+    the mouse at each legal position of the maze.
+
+    Returns obs, (legal_mouse_positions, inner_grid_without_mouse)
+    """
+    _check_atlas(atlas)
+    env_state = maze.EnvState(state_bytes)
+    grid = env_state.inner_grid(with_mouse=False)
+    legal_mouse_positions = maze.get_legal_mouse_positions(grid)
+    padding = maze.get_padding(grid)
+    obs = render_obs(
+        env_state.full_grid(with_mouse=False),
+        np.array(legal_mouse_positions) + padding,
+        atlas,
+    )
+    return obs, (legal_mouse_positions, grid)
+
+
+# ============== Human view ==============
+
+# (atlas,) once loaded, with None for an atlas _check_atlas refused
+_HUMAN_ATLAS: Optional[Tuple[Optional[SpriteAtlas]]] = None
+
+
+def human_atlas() -> Optional[SpriteAtlas]:
+    """
+    The default human view atlas, extracted and calibrated to ATLAS_DIR on
+    first use, or None if its renders are too far from procgen's.
+    """
+    global _HUMAN_ATLAS
+    if _HUMAN_ATLAS is None:
+        atlas = SpriteAtlas.load_or_extract(
+            os.path.join(ATLAS_DIR, "human_atlas.npz"), human=True
+        )
+        try:
+            _check_atlas(atlas)
+        except ValueError as e:
+            warn(f"{e}; rendering human views with procgen instead")
+            atlas = None
+        _HUMAN_ATLAS = (atlas,)
+    return _HUMAN_ATLAS[0]
+
+
+def _render_human(
+    grid: np.ndarray, crop_padding: bool, atlas: Optional[SpriteAtlas]
+) -> np.ndarray:
+    if grid.shape[0] == maze.WORLD_DIM:
+        padding = maze.get_padding(maze.inner_grid(grid, assert_=False))
+    else:
+        padding = maze.get_padding(grid)
+    outer = maze.outer_grid(grid, assert_=False)
+    if atlas is None:
+        img = _env_human_view(outer)
+    else:
+        img = _compose(outer[None], atlas)[0]
+
+    # Cut out the padding from the view. The padding is the walls around the maze.
+    if crop_padding and padding > 0:
+        rescale = img.shape[0] / maze.WORLD_DIM
+        img = img[
+            int(padding * rescale) : int(-padding * rescale),
+            int(padding * rescale) : int(-padding * rescale),
+        ]
+    return np.ascontiguousarray(img)
+
+
+@maze.lru_cache(maxbytes=256 * 2**20, sizeof=lambda img: img.nbytes)
+def _render_human_cached(
+    grid_bytes: bytes, shape: tuple, crop_padding: bool
+) -> np.ndarray:
+    grid = np.frombuffer(grid_bytes, dtype=np.int64).reshape(shape)
+    img = _render_human(grid, crop_padding, human_atlas())
+    img.flags.writeable = False
+    return img
+
+
+def render_human(
+    grid: np.ndarray,
+    crop_padding: bool = False,
+    atlas: Optional[SpriteAtlas] = None,
+) -> np.ndarray:
+    """
+    Render the 512x512 human view of grid, an inner or outer grid. The mouse is
+    only drawn if grid contains it. If crop_padding, cut out the walls around
+    the maze, like maze.render_inner_grid. Renders with the default atlas (or
+    procgen, if the atlas is refused) are cached by grid, so redrawing the
+    same background is free; the returned image is a copy the caller may
+    modify. A given atlas must pass calibrate like the agent atlas.
+    """
+    if atlas is not None:
+        _check_atlas(atlas)
+        return _render_human(np.asarray(grid), crop_padding, atlas)
+    grid = np.ascontiguousarray(grid, dtype=np.int64)
+    return _render_human_cached(
+        grid.tobytes(), grid.shape, crop_padding
+    ).copy()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Measure how close numpy renders are to procgen's"
+    )
+    parser.add_argument("--num_seeds", type=int, default=2000)
+    parser.add_argument("--template_seed", type=int, default=0)
+    parser.add_argument("--human", action="store_true")
+    args = parser.parse_args()
+    if args.human:
+        atlas = calibrate(
+            extract_human_atlas(args.template_seed),
+            range(args.num_seeds),
+            chunk_size=16,
+        )
+    else:
+        atlas = calibrate(
+            extract_atlas(args.template_seed), range(args.num_seeds)
+        )
+    for name, value in atlas.fidelity.items():
+        print(f"{name}: {value:.6g}")
+    _check_atlas(atlas)
@@ -0,0 +1,277 @@
+"""
+A memory-mapped catalog of maze levels, so seeds can be looked up by maze size,
+cheese position, decision square etc. without creating a venv per seed.
+
+The catalog is a directory of .npy chunk files, one structured record per seed.
+Build or extend it with build_catalog, then query it with SeedCatalog:
+
+    build_catalog("data/seed_catalog", stop=1_000_000, num_workers=16)
+    catalog = SeedCatalog("data/seed_catalog")
+    seeds = catalog.seeds_where(maze_dim=15, has_decision_square=True)
+
+All positions are (row, col) in the *outer* grid, like maze.get_cheese_pos on a
+full grid. Missing positions (e.g. no decision square) are stored as (-1, -1).
+"""
+
+import glob
+import multiprocessing
+import os
+import re
+from typing import List, Optional, Tuple
+
+import numpy as np
+from numpy.lib import recfunctions
+from tqdm.auto import tqdm
+
+from procgen_tools import maze
+
+_PACKED_GRID_SIZE = (maze.WORLD_DIM**2 + 7) // 8
+
+CATALOG_DTYPE = np.dtype(
+    [
+        ("seed", np.int64),
+        ("maze_dim", np.uint8),
+        ("cheese_pos", np.int8, (2,)),
+        ("mouse_pos", np.int8, (2,)),
+        ("decision_square", np.int8, (2,)),
+        ("cheese_path_len", np.int16),  # steps from the mouse to the cheese
+        ("corner_path_len", np.int16),  # steps from the mouse to the top right
+        ("grid", np.uint8, (_PACKED_GRID_SIZE,)),  # packbits of open squares
+    ]
+)
+# Fields kept in memory for queries; grids stay memory-mapped
+INDEX_FIELDS = [name for name in CATALOG_DTYPE.names if name != "grid"]
+
+_CHUNK_PATTERN = re.compile(r"seeds_(\d+)-(\d+)\.npy$")
+
+
+def _chunk_filename(start: int, stop: int) -> str:
+    return f"seeds_{start:09d}-{stop:09d}.npy"
+
+
+def catalog_record(seed: int, state: maze.EnvState) -> np.ndarray:
+    "Compute the catalog record of the level seed, whose initial state is state."
+    record = np.zeros((), dtype=CATALOG_DTYPE)
+    record["seed"] = seed
+
+    full_grid = state.full_grid(with_mouse=False)
+    inner_grid = maze.inner_grid(full_grid)
+    padding = maze.get_padding(inner_grid)
+    record["maze_dim"] = inner_grid.shape[0]
+    record["mouse_pos"] = state.mouse_pos
+    record["grid"] = np.packbits((full_grid != maze.BLOCKED).ravel())
+
+    cheese_pos = maze.get_cheese_pos(full_grid)
+    record["cheese_pos"] = (-1, -1) if cheese_pos is None else cheese_pos
+    record["decision_square"] = (-1, -1)
+    if cheese_pos is None:
+        record["cheese_path_len"] = record["corner_path_len"] = -1
+        return record
+
+    graph = maze.maze_grid_to_csr(inner_grid)
+    path_to_cheese = maze.get_path_to_cheese(inner_grid, graph)
+    path_to_corner = maze.get_path_to_corner(inner_grid, graph)
+    record["cheese_path_len"] = len(path_to_cheese) - 1
+    record["corner_path_len"] = len(path_to_corner) - 1
+    if maze.get_cheese_pos(inner_grid) not in path_to_corner:
+        row, col = maze.get_decision_square_from_grid_graph(inner_grid, graph)
+        record["decision_square"] = (row + padding, col + padding)
+    return record
+
+
+def _build_chunk(path: str, start: int, stop: int) -> str:
+    "Write the catalog chunk for seeds [start, stop) to path, returning the filename."
+    records = np.zeros(stop - start, dtype=CATALOG_DTYPE)
+    for i, seed in enumerate(range(start, stop)):
+        # Each seed is visited once, so don't fill the cache of levels
+        state = maze.get_envstate_from_seed(seed, cache=False)
+        records[i] = catalog_record(seed, state)
+
+    filename = os.path.join(path, _chunk_filename(start, stop))
+    # Write then rename, so readers never see a partial chunk
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "wb") as f:
+        np.save(f, records)
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+def _build_chunk_star(args) -> str:
+    return _build_chunk(*args)
+
+
+def covered_ranges(path: str) -> List[Tuple[int, int]]:
+    "The sorted [start, stop) seed ranges of the chunks in the catalog at path."
+    ranges = []
+    for filename in glob.glob(os.path.join(path, "seeds_*.npy")):
+        match = _CHUNK_PATTERN.search(filename)
+        if match:
+            ranges.append((int(match.group(1)), int(match.group(2))))
+    return sorted(ranges)
+
+
+def _missing_ranges(
+    path: str, start: int, stop: int, chunk_size: int
+) -> List[Tuple[int, int]]:
+    "Split the seeds in [start, stop) not yet in the catalog into chunks."
+    missing = []
+    seed = start
+    for covered_start, covered_stop in covered_ranges(path) + [(stop, stop)]:
+        gap_stop = min(covered_start, stop)
+        for chunk_start in range(seed, gap_stop, chunk_size):
+            missing.append(
+                (chunk_start, min(chunk_start + chunk_size, gap_stop))
+            )
+        seed = max(seed, covered_stop)
+    return missing
+
+
+def build_catalog(
+    path: str,
+    stop: int,
+    start: int = 0,
+    chunk_size: int = 10_000,
+    num_workers: Optional[int] = None,
+) -> "SeedCatalog":
+    """
+    Build the catalog at path for seeds [start, stop), skipping seeds it already
+    has, so an existing catalog can be extended. Chunks are built in num_workers
+    processes (default: one per cpu).
+    """
+    os.makedirs(path, exist_ok=True)
+    missing = _missing_ranges(path, start, stop, chunk_size)
+    if missing:
+        with multiprocessing.Pool(num_workers) as pool:
+            jobs = pool.imap_unordered(
+                _build_chunk_star, [(path, *r) for r in missing]
+            )
+            for _ in tqdm(jobs, total=len(missing), desc="Building catalog"):
+                pass
+    return SeedCatalog(path)
+
+
+class SeedCatalog:
+    """
+    Read-only view of a catalog built by build_catalog. Queryable fields are kept
+    in memory (about 20 bytes per seed); grids are read from the memory-mapped
+    chunks on demand.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.reload()
+
+    def reload(self):
+        "Pick up chunks added since the catalog was opened."
+        self.ranges = covered_ranges(self.path)
+        self._chunks = [
+            np.load(
+                os.path.join(self.path, _chunk_filename(*r)), mmap_mode="r"
+            )
+            for r in self.ranges
+        ]
+        self._chunk_starts = np.cumsum([0] + [len(c) for c in self._chunks])
+        self.index = np.concatenate(
+            [recfunctions.repack_fields(c[INDEX_FIELDS]) for c in self._chunks]
+            or [np.zeros(0, dtype=CATALOG_DTYPE)[INDEX_FIELDS]]
+        )
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, seed: int) -> bool:
+        return self._position(seed) is not None
+
+    @property
+    def seeds(self) -> np.ndarray:
+        return self.index["seed"]
+
+    def _position(self, seed: int) -> Optional[int]:
+        pos = np.searchsorted(self.seeds, seed)
+        if pos < len(self) and self.seeds[pos] == seed:
+            return int(pos)
+        return None
+
+    def record(self, seed: int) -> np.void:
+        "The full catalog record of seed, including the packed grid."
+        pos = self._position(seed)
+        if pos is None:
+            raise KeyError(f"Seed {seed} is not in the catalog at {self.path}")
+        chunk = np.searchsorted(self._chunk_starts, pos, side="right") - 1
+        return self._chunks[chunk][pos - self._chunk_starts[chunk]]
+
+    def full_grid(self, seed: int, with_mouse=True) -> np.ndarray:
+        "The (WORLD_DIM, WORLD_DIM) grid of seed, as EnvState.full_grid would give."
+        record = self.record(seed)
+        is_open = np.unpackbits(record["grid"])[: maze.WORLD_DIM**2]
+        grid = np.where(is_open, maze.EMPTY, maze.BLOCKED).reshape(
+            maze.WORLD_DIM, maze.WORLD_DIM
+        )
+        if record["cheese_pos"][0] >= 0:
+            grid[tuple(record["cheese_pos"])] = maze.CHEESE
+        if with_mouse:
+            grid[tuple(record["mouse_pos"])] = maze.MOUSE
+        return grid
+
+    def inner_grid(self, seed: int, with_mouse=True) -> np.ndarray:
+        return maze.inner_grid(self.full_grid(seed, with_mouse=with_mouse))
+
+    def seeds_where(
+        self,
+        maze_dim: Optional[int] = None,
+        min_dim: Optional[int] = None,
+        max_dim: Optional[int] = None,
+        cheese_pos: Optional[Tuple[int, int]] = None,
+        mouse_pos: Optional[Tuple[int, int]] = None,
+        decision_square: Optional[Tuple[int, int]] = None,
+        has_decision_square: Optional[bool] = None,
+        open_at: Optional[Tuple[int, int]] = None,
+        min_cheese_path_len: Optional[int] = None,
+        max_cheese_path_len: Optional[int] = None,
+        exclude=(),
+    ) -> np.ndarray:
+        """
+        Seeds matching all the given conditions, in increasing order. open_at
+        matches seeds whose full grid (without the mouse) is open at that square;
+        exclude is an iterable of seeds to leave out.
+        """
+        index = self.index
+        mask = np.ones(len(index), dtype=bool)
+
+        def where_pos(field, pos):
+            return (index[field] == np.asarray(pos)).all(axis=1)
+
+        if maze_dim is not None:
+            mask &= index["maze_dim"] == maze_dim
+        if min_dim is not None:
+            mask &= index["maze_dim"] >= min_dim
+        if max_dim is not None:
+            mask &= index["maze_dim"] <= max_dim
+        if cheese_pos is not None:
+            mask &= where_pos("cheese_pos", cheese_pos)
+        if mouse_pos is not None:
+            mask &= where_pos("mouse_pos", mouse_pos)
+        if decision_square is not None:
+            mask &= where_pos("decision_square", decision_square)
+        if has_decision_square is not None:
+            mask &= (
+                index["decision_square"][:, 0] >= 0
+            ) == has_decision_square
+        if min_cheese_path_len is not None:
+            mask &= index["cheese_path_len"] >= min_cheese_path_len
+        if max_cheese_path_len is not None:
+            mask &= index["cheese_path_len"] <= max_cheese_path_len
+        mask &= ~np.isin(index["seed"], np.fromiter(exclude, dtype=np.int64))
+
+        if open_at is not None:
+            mask &= self._open_at(open_at)
+        return index["seed"][mask]
+
+    def _open_at(self, pos: Tuple[int, int]) -> np.ndarray:
+        "Mask over the index of seeds whose grid is open at pos."
+        bit = pos[0] * maze.WORLD_DIM + pos[1]
+        byte, shift = divmod(bit, 8)
+        return np.concatenate(
+            [(c["grid"][:, byte] >> (7 - shift)) & 1 for c in self._chunks]
+            or [np.zeros(0, dtype=np.uint8)]
+        ).astype(bool)
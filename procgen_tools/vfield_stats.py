@@ -1,41 +1,28 @@
-from procgen_tools import maze, models, metrics, vfield
+from procgen_tools import maze, models, metrics, rendering, vfield
+import contextlib
+from typing import Optional
 import numpy as np
+import torch
+import circrl.module_hook as cmh
 import matplotlib.pyplot as plt
 
 
-def _decision_square_index(vf):
-    return vf["legal_mouse_positions"].index(
-        metrics.decision_square(vf["grid"])
-    )
-
-
-def _pathfind(grid: np.ndarray, start, end):
-    cost, came_from, extra = maze.shortest_path(
-        grid, start, stop_condition=lambda _, sq: sq == end
-    )
-    return maze.reconstruct_path(came_from, extra["last_square"])
-
-
 def deltas_from(grid: np.ndarray, sq):
-    path_to_cheese = _pathfind(grid, sq, maze.get_cheese_pos(grid))
-    path_to_top_right = _pathfind(
-        grid, sq, (grid.shape[0] - 1, grid.shape[1] - 1)
-    )
-    delta_cheese = (path_to_cheese[1][0] - sq[0], path_to_cheese[1][1] - sq[1])
-    delta_tr = (
-        path_to_top_right[1][0] - sq[0],
-        path_to_top_right[1][1] - sq[1],
-    )
-    return delta_cheese, delta_tr
+    return maze.deltas_from(grid, sq)
 
 
 def get_decision_probs(vf, return_dict: bool = False):
     "From the decision square, return probabilities of going to the cheese or top right."
 
     grid = vf["grid"]
-    i = _decision_square_index(vf)
+    dsq = metrics.decision_square(grid)
+    if dsq not in vf["legal_mouse_positions"]:
+        raise ValueError(f"Decision square {dsq} is not a mouse position")
+    # Only looks up (or for a LazyVectorField, evaluates) the decision square
+    dsq_probs = maze.vf_prob_grid(vf, squares=[dsq])[dsq]
     probs_dict = {
-        k: v for k, v in zip(models.MAZE_ACTION_INDICES.keys(), vf["probs"][i])
+        k: v.item()
+        for k, v in zip(models.MAZE_ACTION_INDICES.keys(), dsq_probs)
     }
     if return_dict:
         return probs_dict
@@ -43,7 +30,6 @@ def get_decision_probs(vf, return_dict: bool = False):
         max(probs_dict, key=probs_dict.get)
     ]
 
-    dsq = metrics.decision_square(grid)
     csq = maze.get_cheese_pos(grid)
 
     delta_cheese, delta_tr = deltas_from(grid, dsq)
@@ -76,6 +62,103 @@ def get_decision_probs_original_and_patched(vfields, coeff: float):
     return np.array(decision_probs_original), np.array(decision_probs_patched)
 
 
+def _decision_square_states(levels):
+    """
+    The levels with the mouse moved to their decision square, for the mazes
+    which have one. Returns (num_levels, rows, batch, dirs): the number of
+    levels, the indices of those with a decision square, their states, and
+    the (N, 2) indices into MAZE_ACTION_INDICES of the directions to the
+    cheese and the top right.
+    """
+    batch = maze.StateBatch.from_levels(levels)
+    action_names = list(models.MAZE_ACTION_INDICES)
+    rows, mouse_positions, dirs = [], [], []
+    for i, grid in enumerate(batch.grids(with_mouse=False)):
+        grid = maze.inner_grid(grid)
+        dsq = metrics.decision_square(grid)
+        if dsq is None:
+            continue
+        padding = maze.get_padding(grid)
+        rows.append(i)
+        mouse_positions.append((dsq[0] + padding, dsq[1] + padding))
+        dirs.append(
+            [
+                action_names.index(models.MAZE_ACTION_DELTAS.inverse[delta])
+                for delta in deltas_from(grid, dsq)
+            ]
+        )
+    num_levels = len(batch)
+    batch = batch.select(np.array(rows, dtype=int))
+    batch.set_mouse_positions(np.array(mouse_positions).reshape(-1, 2))
+    return (
+        num_levels,
+        np.array(rows, dtype=int),
+        batch,
+        np.array(dirs).reshape(-1, 2),
+    )
+
+
+def decision_probs(
+    levels,
+    policy: torch.nn.Module,
+    patches: Optional[dict] = None,
+    hook: Optional[cmh.ModuleHook] = None,
+    batch_size: int = 1024,
+    atlas: Optional[rendering.SpriteAtlas] = None,
+) -> np.ndarray:
+    """
+    Probabilities of going to the cheese and to the top right from the decision
+    square of each level, as an (N, 2) array; NaN for mazes without a decision
+    square. Levels are seeds, EnvStates and/or state bytes.
+
+    Unlike get_decision_probs, only the decision square observations are
+    rendered (by procgen, or with numpy given an atlas) and run through the
+    policy, batch_size at a time. patches are applied with hook, by default a
+    new ModuleHook of policy.
+    """
+    num_levels, rows, batch, dirs = _decision_square_states(levels)
+    state_bytes_list = batch.to_state_bytes()
+    if patches and hook is None:
+        hook = cmh.ModuleHook(policy)
+    device = next(policy.parameters()).device
+
+    action_probs = []
+    with hook.use_patches(patches) if patches else contextlib.nullcontext():
+        for start in range(0, len(state_bytes_list), batch_size):
+            obs = rendering.obs_from_states(
+                state_bytes_list[start : start + batch_size], atlas
+            )
+            with torch.no_grad():
+                categorical, _ = policy(torch.from_numpy(obs).to(device))
+            action_probs.append(categorical.probs.cpu().numpy())
+    action_probs = np.concatenate(action_probs or [np.zeros((0, 15))])
+
+    # (N, 5) probabilities of each direction, then the two wanted ones
+    dir_probs = np.stack(
+        [
+            action_probs[:, indices].sum(axis=1)
+            for indices in models.MAZE_ACTION_INDICES.values()
+        ],
+        axis=1,
+    )
+    probs = np.full((num_levels, 2), np.nan)
+    probs[rows] = np.take_along_axis(dir_probs, dirs, axis=1)
+    return probs
+
+
+def decision_probs_original_and_patched(levels, policy, patches, **kwargs):
+    """
+    Like get_decision_probs_original_and_patched, but from levels instead of
+    vfields: the (N, 2) cheese and top right decision square probabilities
+    without and with patches, for the levels which have a decision square.
+    """
+    levels = maze.StateBatch.from_levels(levels).to_state_bytes()
+    original = decision_probs(levels, policy, **kwargs)
+    patched = decision_probs(levels, policy, patches=patches, **kwargs)
+    has_decision_square = ~np.isnan(original).any(axis=1)
+    return original[has_decision_square], patched[has_decision_square]
+
+
 def plot_decision_probs(
     decision_probs_original, decision_probs_patched, ax_size: int = 4
 ):
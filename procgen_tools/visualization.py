@@ -1,6 +1,9 @@
 from procgen_tools.imports import *
-from procgen_tools import maze
-from typing import Dict
+from procgen_tools import maze, rendering
+from typing import Dict, Iterable
+import collections.abc
+import contextlib
+from dataclasses import dataclass
 from matplotlib.colors import LinearSegmentedColormap
 import PIL
 from warnings import warn
@@ -478,10 +481,11 @@ def vf_heatmap(
     state: maze.EnvState = maze.state_from_venv(venv)
     grid: np.ndarray = state.inner_grid()
     heatmap: np.ndarray = np.zeros_like(grid, dtype=np.float32)
-    for coord in maze.get_legal_mouse_positions(grid) + [
-        maze.get_cheese_pos(grid)
-    ]:
-        heatmap[coord] = maze.geometric_probability_path((0, 0), coord, vf)
+    prob_map: np.ndarray = maze.geometric_probability_map(
+        vf["grid"], maze.vf_prob_grid(vf)
+    )
+    on_map = (grid == maze.EMPTY) | (grid == maze.CHEESE)
+    heatmap[on_map] = prob_map[on_map]
     return heatmap
 
 
@@ -498,8 +502,12 @@ def retarget_heatmap(
     if retargeting_fn is None:
         with hook.use_patches({}):  # Remove all patches
             vf: Dict = vector_field(venv, hook.network)
+        prob_map: np.ndarray = maze.geometric_probability_map(
+            vf["grid"], maze.vf_prob_grid(vf)
+        )
 
     inner_grid: np.ndarray = maze.state_from_venv(venv).inner_grid()
+    distances: np.ndarray = maze.get_maze_tree(inner_grid).distances((0, 0))
     padding: int = maze.get_padding(inner_grid)
     reachable: List[Tuple[int, int]] = maze.get_legal_mouse_positions(
         inner_grid
@@ -524,12 +532,10 @@ def retarget_heatmap(
             "col": coord[1],
             "filter_coord": filter_coord,
             "maze_size": inner_grid.shape[0],
-            "d_to_coord": len(
-                maze.pathfind(grid=inner_grid, start=(0, 0), end=coord)
-            ),
+            "d_to_coord": int(distances[coord]) + 1,  # Squares on the path
         }
         if retargeting_fn is None:  # NOTE this is for the normal probability
-            channel_val = maze.geometric_probability_path((0, 0), coord, vf)
+            channel_val = prob_map[coord]
         elif filter_coord in retargeting_cache:
             channel_val = retargeting_cache[filter_coord]
         else:
@@ -1089,29 +1095,32 @@ def render_arrows(
             )
 
     else:
-        arrows = [
-            _tadd(*arr_list) for arr_list in arrows
-        ]  # Add the arrows together to get a total vector for each mouse position
+        # Add the arrows together to get a total vector for each mouse position
+        positions = np.asarray(legal_mouse_positions, dtype=float).reshape(
+            -1, 2
+        )
+        totals = (
+            np.asarray(arrows, dtype=float)
+            .reshape(len(positions), -1, 2)
+            .sum(axis=1)
+        )
         ax.quiver(
-            [pos[1] for pos in legal_mouse_positions],
-            [pos[0] for pos in legal_mouse_positions],
-            [arr[1] for arr in arrows],
-            [arr[0] for arr in arrows],
+            positions[:, 1],
+            positions[:, 0],
+            totals[:, 1],
+            totals[:, 0],
             color=color,
             scale=1,
             scale_units="xy",
             width=width,
         )
 
-    venv = maze.venv_from_grid(grid)
-    visualize_venv(
-        venv,
-        ax=ax,
-        mode="human" if human_render else "numpy",
-        render_padding=render_padding,
-        render_mouse=False,
-        show_plot=False,
-    )
+    # Draw the maze without the mouse; human renders are cached by grid
+    if human_render:
+        img = rendering.render_human(grid, crop_padding=not render_padding)
+    else:
+        img = (maze.outer_grid(grid) if render_padding else grid)[::-1, :]
+    ax.imshow(img)
 
     ax.set_xticks([])
     ax.set_yticks([])
@@ -1127,17 +1136,6 @@ def forward_func_policy(network: nn.Module, inp: torch.Tensor):
 # Get vector field
 
 
-# FIXME really stupid way to do this tbh, should use numpy somehow
-def _tmul(tup: tuple, scalar: float):
-    """Multiply a tuple by a scalar."""
-    return tuple(scalar * x for x in tup)
-
-
-def _tadd(*tups: List[Tuple[int, int]]):
-    """Add a list of tuples elementwise."""
-    return tuple(sum(axis) for axis in zip(*tups))
-
-
 def _device(policy: nn.Module):
     return next(policy.parameters()).device
 
@@ -1146,12 +1144,417 @@ def vector_field(venv: ProcgenGym3Env, policy: nn.Module, idx: int = 0):
     """
     Get the vector field induced by the policy on the maze in the idx-th environment.
     """
-    venv_idx = maze.copy_venv(venv, idx)
-    venv_all, (
-        legal_mouse_positions,
-        grid,
-    ) = maze.venv_with_all_mouse_positions(venv_idx)
-    return vector_field_tup(venv_all, legal_mouse_positions, grid, policy)
+    state_bytes = venv.env.callmethod("get_state")[idx]
+    return vector_fields([state_bytes], policy, max_batch=256)[0]
+
+
+def _direction_probs(
+    policy: nn.Module, obs: np.ndarray, incremental: bool = False
+) -> np.ndarray:
+    """
+    The (N, 5) probabilities of each direction in MAZE_ACTION_INDICES. If
+    incremental, obs should be of one maze: the embedder then runs with
+    models.IncrementalImpalaForward, based on the per-pixel median of obs.
+    """
+    obs = torch.as_tensor(obs, dtype=torch.float32, device=_device(policy))
+    with torch.no_grad():
+        if incremental:
+            embedder = models.IncrementalImpalaForward(
+                policy.embedder, obs.median(dim=0).values
+            )
+            probs = torch.softmax(policy.fc_policy(embedder(obs)), dim=1)
+        else:
+            probs = policy(obs)[0].probs
+    probs = models.human_readable_actions(probs)
+    return torch.stack(list(probs.values()), dim=-1).cpu().numpy()
+
+
+# (5, 2) arrow of each direction, in the order of MAZE_ACTION_INDICES
+_ACTION_DELTAS = np.array(
+    [models.MAZE_ACTION_DELTAS[act] for act in models.MAZE_ACTION_INDICES]
+)
+
+
+@dataclass(eq=False)
+class VectorField(collections.abc.Mapping):
+    """
+    A vector field as arrays: the (N, 2) inner grid (row, col) mouse positions,
+    their (N, 5) action probabilities in the order of
+    models.MAZE_ACTION_INDICES, and the (N, 5, 2) probability-weighted arrows
+    of each action. Differences of vector fields have arrows but no probs.
+
+    It reads like the vfield dict it replaces (vf["arrows"] is a list of
+    lists of tuples etc.), and to_dict() gives that dict. Pickles and save()
+    only keep the grid as bytes, the positions and the probs (or the arrows of
+    a difference), see to_arrays.
+    """
+
+    grid: np.ndarray
+    positions: np.ndarray
+    arrows: np.ndarray
+    probs: Optional[np.ndarray] = None
+
+    def __post_init__(self):
+        self.grid = np.asarray(self.grid, dtype=int)
+        self.positions = np.asarray(self.positions, dtype=np.int16).reshape(
+            -1, 2
+        )
+        self.arrows = np.asarray(self.arrows, dtype=np.float32).reshape(
+            len(self.positions), len(_ACTION_DELTAS), 2
+        )
+        if self.probs is not None:
+            self.probs = np.asarray(self.probs, dtype=np.float32).reshape(
+                len(self.positions), len(_ACTION_DELTAS)
+            )
+        # Row of the mouse position at each square, -1 at the others
+        self.row_grid = np.full(self.grid.shape, -1, dtype=np.intp)
+        self.row_grid[tuple(self.positions.T)] = np.arange(len(self.positions))
+
+    @classmethod
+    def from_probs(
+        cls, grid: np.ndarray, positions, probs: np.ndarray
+    ) -> "VectorField":
+        probs = np.asarray(probs, dtype=np.float32).reshape(
+            -1, len(_ACTION_DELTAS)
+        )
+        return cls(grid, positions, probs[:, :, None] * _ACTION_DELTAS, probs)
+
+    @classmethod
+    def from_dict(cls, vf: dict) -> "VectorField":
+        "The VectorField of a vfield dict, e.g. one pickled before this class."
+        return cls(
+            vf["grid"],
+            vf["legal_mouse_positions"],
+            vf["arrows"],
+            vf.get("probs"),
+        )
+
+    @property
+    def legal_mouse_positions(self) -> List[Tuple[int, int]]:
+        return list(map(tuple, self.positions.tolist()))
+
+    def rows(self, positions) -> np.ndarray:
+        "The rows of the (row, col) positions, which must be mouse positions."
+        positions = np.asarray(positions, dtype=int).reshape(-1, 2)
+        rows = self.row_grid[tuple(positions.T)]
+        if (rows < 0).any():
+            bad = positions[rows < 0][0]
+            raise KeyError(f"{tuple(bad)} is not a mouse position")
+        return rows
+
+    def probs_at(self, positions) -> np.ndarray:
+        "The (len(positions), 5) action probabilities at the positions."
+        return self.probs[self.rows(positions)]
+
+    def to_dict(self) -> dict:
+        return dict(self)
+
+    def __getitem__(self, key: str):
+        if key == "grid":
+            return self.grid
+        if key == "legal_mouse_positions":
+            return self.legal_mouse_positions
+        if key == "arrows":
+            return [list(map(tuple, arrs)) for arrs in self.arrows.tolist()]
+        if key == "probs" and self.probs is not None:
+            return list(map(tuple, self.probs.tolist()))
+        raise KeyError(key)
+
+    def __iter__(self):
+        keys = ["arrows", "legal_mouse_positions", "grid", "probs"]
+        return iter(keys if self.probs is not None else keys[:-1])
+
+    def __len__(self) -> int:
+        return 3 if self.probs is None else 4
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        The arrays VectorField.from_arrays needs: a uint8 grid, the positions
+        and the probs, or the arrows if there are no probs to make them from.
+        """
+        arrays = {
+            "grid": self.grid.astype(np.uint8),
+            "positions": self.positions,
+        }
+        if self.probs is None:
+            arrays["arrows"] = self.arrows
+        else:
+            arrays["probs"] = self.probs
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "VectorField":
+        if "probs" in arrays:
+            return cls.from_probs(
+                arrays["grid"], arrays["positions"], arrays["probs"]
+            )
+        return cls(arrays["grid"], arrays["positions"], arrays["arrows"])
+
+    def __getstate__(self) -> dict:
+        return self.to_arrays()
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(VectorField.from_arrays(state).__dict__)
+
+    def save(self, file):
+        "Save to an .npz file (a path or file object), for VectorField.load."
+        np.savez(file, **self.to_arrays())
+
+    @classmethod
+    def load(cls, file) -> "VectorField":
+        with np.load(file) as arrays:
+            return cls.from_arrays(dict(arrays))
+
+
+def _as_vector_field(vf) -> VectorField:
+    "vf, a VectorField, LazyVectorField or vfield dict, as a VectorField."
+    if isinstance(vf, VectorField):
+        return vf
+    if isinstance(vf, LazyVectorField):
+        return vf.vector_field()
+    return VectorField.from_dict(vf)
+
+
+class LazyVectorField(collections.abc.Mapping):
+    """
+    A vector field which only runs the policy at the mouse positions that are
+    asked for, batch_size positions at a time, and remembers the results. It
+    reads like the vfield dict (vf["probs"], vf["arrows"] etc. evaluate every
+    position), so it can be passed to plot_vf, get_vf_diff,
+    maze.geometric_probability_path and friends. probs_at only evaluates the
+    given positions, which is all geometric_probability_path and
+    get_decision_probs need.
+
+    state is an EnvState or state bytes. patches are applied with hook, by
+    default a new ModuleHook of policy. Observations are rendered by procgen,
+    or with numpy given an atlas.
+    """
+
+    _KEYS = ("arrows", "legal_mouse_positions", "grid", "probs")
+
+    def __init__(
+        self,
+        state: Union[maze.EnvState, bytes],
+        policy: nn.Module,
+        patches: Optional[dict] = None,
+        hook: Optional[cmh.ModuleHook] = None,
+        batch_size: int = 64,
+        atlas: Optional[rendering.SpriteAtlas] = None,
+    ):
+        if isinstance(state, maze.EnvState):
+            state = state.state_bytes
+        self.state_bytes = state
+        self.policy, self.patches, self.batch_size, self.atlas = (
+            policy,
+            patches,
+            batch_size,
+            atlas,
+        )
+        self.hook = (
+            cmh.ModuleHook(policy) if patches and hook is None else hook
+        )
+
+        self.grid = maze.EnvState(state).inner_grid(with_mouse=False)
+        self.legal_mouse_positions = maze.get_legal_mouse_positions(self.grid)
+        self._rows = {
+            pos: i for i, pos in enumerate(self.legal_mouse_positions)
+        }
+        num_actions = len(models.MAZE_ACTION_INDICES)
+        self._probs = np.full(
+            (len(self.legal_mouse_positions), num_actions), np.nan
+        )
+        self._evaluated = np.zeros(len(self.legal_mouse_positions), dtype=bool)
+        self._items = {}  # Keys set like on a vfield dict, e.g. by get_vf_diff
+        self._full = None  # to_dict() once every position is evaluated
+
+    @classmethod
+    def from_venv(
+        cls, venv: ProcgenGym3Env, policy: nn.Module, idx: int = 0, **kwargs
+    ) -> "LazyVectorField":
+        return cls(venv.env.callmethod("get_state")[idx], policy, **kwargs)
+
+    def evaluate(self, positions: Optional[Iterable[Tuple[int, int]]] = None):
+        "Run the policy at the positions (default: all) not evaluated yet."
+        if positions is None:
+            rows = np.flatnonzero(~self._evaluated)
+        else:
+            rows = np.array(
+                [self._rows[tuple(pos)] for pos in positions], dtype=int
+            )
+            rows = np.unique(rows[~self._evaluated[rows]])
+        if len(rows) == 0:
+            return
+
+        padding = maze.get_padding(self.grid)
+        batch = maze.StateBatch.from_template(self.state_bytes, len(rows))
+        batch.set_mouse_positions(
+            np.array(self.legal_mouse_positions)[rows] + padding
+        )
+        state_bytes_list = batch.to_state_bytes()
+        with (
+            self.hook.use_patches(self.patches)
+            if self.patches
+            else contextlib.nullcontext()
+        ):
+            for start in range(0, len(rows), self.batch_size):
+                obs = rendering.obs_from_states(
+                    state_bytes_list[start : start + self.batch_size],
+                    self.atlas,
+                )
+                self._probs[rows[start : start + self.batch_size]] = (
+                    _direction_probs(self.policy, obs)
+                )
+        self._evaluated[rows] = True
+
+    def probs_at(self, positions: Iterable[Tuple[int, int]]) -> np.ndarray:
+        """
+        The (len(positions), 5) action probabilities at the legal mouse
+        positions, in the order of models.MAZE_ACTION_INDICES.
+        """
+        positions = [tuple(pos) for pos in positions]
+        self.evaluate(positions)
+        rows = np.array([self._rows[pos] for pos in positions], dtype=int)
+        return self._probs[rows]
+
+    @property
+    def num_evaluated(self) -> int:
+        return int(self._evaluated.sum())
+
+    def vector_field(self, evaluate: bool = True) -> VectorField:
+        """
+        The VectorField. If evaluate is False, the positions not evaluated so
+        far are left out of the computation and get NaN arrows and probs.
+        """
+        if evaluate:
+            self.evaluate()
+        return VectorField.from_probs(
+            self.grid, self.legal_mouse_positions, self._probs
+        )
+
+    def to_dict(self, evaluate: bool = True) -> dict:
+        "The vfield dict; see vector_field."
+        vf = self.vector_field(evaluate=evaluate).to_dict()
+        vf.update(self._items)
+        return vf
+
+    def __getitem__(self, key: str):
+        if key in self._items:
+            return self._items[key]
+        if key == "grid":
+            return self.grid
+        if key == "legal_mouse_positions":
+            return self.legal_mouse_positions
+        if key in ("arrows", "probs"):
+            if self._full is None:
+                self._full = self.to_dict()
+            return self._full[key]
+        raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        return key in self._KEYS or key in self._items
+
+    def __setitem__(self, key: str, value):
+        if key in ("arrows", "probs"):
+            self.evaluate()
+        self._items[key] = value
+
+    def __iter__(self):
+        return iter(dict.fromkeys([*self._KEYS, *self._items]))
+
+    def __len__(self) -> int:
+        return len(set(self._KEYS) | set(self._items))
+
+
+def vector_field_at(
+    venv: ProcgenGym3Env,
+    policy: nn.Module,
+    squares: Optional[Iterable[Tuple[int, int]]] = None,
+    targets: Optional[Iterable[Tuple[int, int]]] = None,
+    source: Tuple[int, int] = (0, 0),
+    idx: int = 0,
+    atlas: Optional[rendering.SpriteAtlas] = None,
+) -> VectorField:
+    """
+    Like vector_field, but only evaluate the policy with the mouse at squares,
+    and at the squares on the paths from source to each of targets (so
+    targets=[end] covers geometric_probability_path(source, end, vf)). All
+    positions are inner grid coordinates.
+
+    The vector field has every legal mouse position; the arrows and probs of
+    positions that weren't evaluated are NaN, which vf_prob_grid and
+    geometric_probability_map pass through.
+    """
+    vf = LazyVectorField.from_venv(venv, policy, idx=idx, atlas=atlas)
+    wanted = set(map(tuple, squares)) if squares is not None else set()
+    if targets is not None:
+        tree = maze.get_maze_tree(vf.grid)
+        for target in targets:
+            wanted.update(tree.path(source, target))
+    vf.evaluate(pos for pos in vf.legal_mouse_positions if pos in wanted)
+    return vf.vector_field(evaluate=False)
+
+
+def vector_fields(
+    seeds_or_states,
+    policy: nn.Module,
+    patches: Optional[dict] = None,
+    hook: Optional[cmh.ModuleHook] = None,
+    max_batch: int = 1024,
+    atlas: Optional[rendering.SpriteAtlas] = None,
+    prefetch: int = 2,
+    incremental: bool = False,
+) -> List[VectorField]:
+    """
+    The vector fields of many mazes, given as seeds, EnvStates and/or state
+    bytes. The observations with the mouse at each legal position of every
+    maze are streamed through the policy max_batch at a time (about 50kB per
+    observation) with rendering.stream_obs_from_states, so a batch can span
+    several mazes and the next batch renders while the policy runs; the
+    results are then split back per maze. patches are applied with hook, by
+    default a new ModuleHook of policy. incremental runs each maze's part of
+    a batch with models.IncrementalImpalaForward, which doesn't support
+    patches.
+    """
+    grids, positions, states = maze.mouse_position_states(seeds_or_states)
+    if not grids:
+        return []
+    counts = [len(pos) for pos in positions]
+    maze_ends = np.cumsum(counts)
+
+    if patches and hook is None:
+        hook = cmh.ModuleHook(policy)
+    probs = np.zeros((sum(counts), len(models.MAZE_ACTION_INDICES)))
+    # Pooled venvs of at least the chunk size are reused, so a small chunk
+    # for a single maze doesn't make a venv of max_batch envs
+    chunks = rendering.stream_obs_from_states(
+        states,
+        chunk_size=min(max_batch, sum(counts)),
+        prefetch=prefetch,
+        atlas=atlas,
+    )
+    with hook.use_patches(patches) if patches else contextlib.nullcontext():
+        start = 0
+        for obs in chunks:
+            stop = start + len(obs)
+            if incremental:
+                # Split the batch where it goes from one maze to the next
+                splits = maze_ends[(maze_ends > start) & (maze_ends < stop)]
+                for maze_obs, maze_start in zip(
+                    np.split(obs, splits - start), [start, *splits]
+                ):
+                    probs[maze_start : maze_start + len(maze_obs)] = (
+                        _direction_probs(policy, maze_obs, incremental=True)
+                    )
+            else:
+                probs[start:stop] = _direction_probs(policy, obs)
+            start = stop
+
+    return [
+        VectorField.from_probs(grid, pos, maze_probs)
+        for grid, pos, maze_probs in zip(
+            grids, positions, np.split(probs, maze_ends[:-1])
+        )
+    ]
 
 
 def get_arrows_and_probs(
@@ -1167,25 +1570,14 @@ def get_arrows_and_probs(
         action_arrows: A list of lists of probability-weighted basis vectors -- an (x, y) tuple, one for each mouse position
         probs: A list of dicts of action -> probability, one for each mouse position
     """
-    # FIXME: Vectorize this loop. It isn't as critical as the model though
-    action_arrows, probs = [], []
-    for i in range(len(legal_mouse_positions)):
-        # Dict of action -> probability for this mouse position
-        probs_dict = models.human_readable_actions(c_probs[i])
-        # Convert to floats
-        probs_dict = {k: v.item() for k, v in probs_dict.items()}
-
-        # Multiply each basis vector by the probability of that action, and append this list of action component arrows
-        action_arrows.append(
-            [
-                _tmul(models.MAZE_ACTION_DELTAS[act], p)
-                for act, p in probs_dict.items()
-            ]
-        )
-        # Append the {(action : str): (probability : float)} dict
-        probs.append(tuple(probs_dict.values()))
-
-    return action_arrows, probs
+    probs = models.human_readable_actions(c_probs[: len(legal_mouse_positions)])
+    probs = torch.stack(list(probs.values()), dim=-1).cpu().numpy()
+    # Multiply each basis vector by the probability of that action
+    action_arrows = probs[:, :, None] * _ACTION_DELTAS
+    return (
+        [list(map(tuple, arrs)) for arrs in action_arrows.tolist()],
+        list(map(tuple, probs.tolist())),
+    )
 
 
 def vector_field_tup(
@@ -1203,27 +1595,13 @@ def vector_field_tup(
         grid: The outer grid to use to compute the vector field.
         policy: The policy to use to compute the vector field.
     """
-    # TODO: Hypothetically, this step could run in parallel to the others (cpu vs. gpu)
-    batched_obs = torch.tensor(
-        venv_all.reset(), dtype=torch.float32, device=_device(policy)
-    )
+    # vector_field streams the observations instead, overlapping rendering
+    # with the forward pass
+    batched_obs = venv_all.reset()
     del venv_all
 
-    # use stacked obs list as a tensor
-    with torch.no_grad():
-        categorical, _ = policy(batched_obs)
-
-    action_arrows, probs = get_arrows_and_probs(
-        legal_mouse_positions, categorical.probs
-    )
-
-    # make vfield object for returning
-    return {
-        "arrows": action_arrows,
-        "legal_mouse_positions": legal_mouse_positions,
-        "grid": grid,
-        "probs": probs,
-    }
+    probs = _direction_probs(policy, batched_obs)
+    return VectorField.from_probs(grid, legal_mouse_positions, probs)
 
 
 # %%
@@ -1247,43 +1625,29 @@ def map_vf_to_human(vf: dict, account_for_padding: bool = False):
     """Map the vector field vf to the human view coordinate system.
 
     Args:
-        vf: A vector field dict with the maze coordinate system.
+        vf: A VectorField or vfield dict with the maze coordinate system.
         account_for_padding: Whether to account for the padding in the human view coordinate system.
 
     Returns:
-        vf: A vector field dict with the human view coordinate system.
+        vf: A vector field dict with the human view coordinate system, with (N, 2) positions and (N, 5, 2) arrows arrays.
     """
-    legal_mouse_positions, arrows, grid = (
-        vf["legal_mouse_positions"],
-        vf["arrows"],
-        vf["grid"],
-    )
+    vf = _as_vector_field(vf)
+    grid = vf.grid
 
     # We need to transform the arrows to the human view coordinate system
-    human_view = maze.render_outer_grid(grid)
-
     padding = maze.WORLD_DIM - grid.shape[0]
     assert padding % 2 == 0
     padding //= 2
-    rescale = human_view.shape[0] / maze.WORLD_DIM
+    rescale = rendering.HUMAN_SIZE / maze.WORLD_DIM
 
-    legal_mouse_positions = [
-        ((grid.shape[1] - 1) - row, col) for row, col in legal_mouse_positions
-    ]  # flip y axis
+    rows, cols = vf.positions.T.astype(float)
+    positions = np.stack([(grid.shape[1] - 1) - rows, cols], axis=1)  # flip y
     if account_for_padding:
-        legal_mouse_positions = [
-            (row + padding, col + padding)
-            for row, col in legal_mouse_positions
-        ]
-    legal_mouse_positions = [
-        ((row + 0.5) * rescale, (col + 0.5) * rescale)
-        for row, col in legal_mouse_positions
-    ]
-    arrows = [[_tmul(arr, rescale) for arr in arr_list] for arr_list in arrows]
+        positions += padding
 
     return {
-        "arrows": arrows,
-        "legal_mouse_positions": legal_mouse_positions,
+        "arrows": vf.arrows * rescale,
+        "legal_mouse_positions": (positions + 0.5) * rescale,
         "grid": grid,
     }
 
@@ -1310,69 +1674,59 @@ def plot_vf(
     )
 
 
-def get_vf_diff(vf1: dict, vf2: dict):
-    """Get the difference "vf1 - vf2" between two vector fields."""
-
-    def assert_compatibility(vfa, vfb):
-        assert vfa["legal_mouse_positions"] == vfb["legal_mouse_positions"], (
-            "Legal mouse positions must be the same to render the vf"
-            " difference."
+def get_vf_diff(vf1: dict, vf2: dict) -> VectorField:
+    """Get the difference "vf1 - vf2" between two vector fields, at the mouse
+    positions of vf2. If one level has cheese and the other doesn't, the
+    cheese square is left out."""
+    vf1, vf2 = _as_vector_field(vf1), _as_vector_field(vf2)
+    if vf1.grid.shape != vf2.grid.shape:
+        raise ValueError(
+            "Grids must be the same shape to render the vf difference."
         )
-        assert (
-            vfa["grid"].shape == vfb["grid"].shape
-        ), "Grids must be the same shape to render the vf difference."
-        assert len(vfa["arrows"]) == len(
-            vfb["arrows"]
-        ), "Arrows must be the same length to render the vf difference."
-
-    # Remove cheese from the legal mouse positions and arrows, if levels are otherwise the same
-    for i in range(2):
-        try:
-            assert_compatibility(vf1, vf2)
-        except:
-            if (vf1["grid"] == maze.CHEESE).any():
-                cheese_vf_idx = 0
-            elif (vf2["grid"] == maze.CHEESE).any():
-                cheese_vf_idx = 1
-            else:
-                raise ValueError(
-                    "Levels are not the same, but neither has cheese."
-                )
-
-            vfs = [vf1, vf2]
-            cheese_location = maze.get_cheese_pos(vfs[cheese_vf_idx]["grid"])
 
-            # Remove cheese from the legal mouse positions and arrows
-            other_vf_idx = 1 - cheese_vf_idx
-            vfs[other_vf_idx]["arrows"] = [
-                arr
-                for pos, arr in zip(
-                    vfs[other_vf_idx]["legal_mouse_positions"],
-                    vfs[other_vf_idx]["arrows"],
-                )
-                if pos != cheese_location
-            ]
-            vfs[other_vf_idx]["legal_mouse_positions"] = [
-                pos
-                for pos in vfs[other_vf_idx]["legal_mouse_positions"]
-                if pos != cheese_location
-            ]
-
-    arrow_diffs = [
-        [(a1[0] - a2[0], a1[1] - a2[1]) for a1, a2 in zip(arrs1, arrs2)]
-        for arrs1, arrs2 in zip(vf1["arrows"], vf2["arrows"])
-    ]
+    # Remove cheese from the legal mouse positions, if levels are otherwise the same
+    differ = (vf1.row_grid >= 0) != (vf2.row_grid >= 0)
+    if differ.any():
+        has_cheese = (vf1.grid == maze.CHEESE) | (vf2.grid == maze.CHEESE)
+        if not has_cheese.any():
+            raise ValueError(
+                "Levels are not the same, but neither has cheese."
+            )
+        if (differ & ~has_cheese).any():
+            raise ValueError(
+                "Legal mouse positions must be the same to render the vf"
+                " difference."
+            )
+    positions = vf2.positions[vf1.row_grid[tuple(vf2.positions.T)] >= 0]
 
-    return {
-        "arrows": arrow_diffs,
-        "legal_mouse_positions": vf2["legal_mouse_positions"],
-        "grid": vf2["grid"],
-    }
+    return VectorField(
+        vf2.grid,
+        positions,
+        vf1.arrows[vf1.rows(positions)] - vf2.arrows[vf2.rows(positions)],
+    )
 
 
 def vf_diff_magnitude(vf_diff: dict) -> float:
     """Compute the average magnitude of the vector field difference."""
-    return np.linalg.norm(vf_diff["arrows"]) / len(vf_diff["arrows"])
+    arrows = _as_vector_field(vf_diff).arrows
+    return np.linalg.norm(arrows) / len(arrows)
+
+
+def vf_diff_magnitudes(
+    seeds_or_states, policy: nn.Module, patches: dict, **kwargs
+) -> np.ndarray:
+    """
+    vf_diff_magnitude_from_seed for many levels at once, computing the
+    vector fields with vector_fields; kwargs are passed on to it.
+    """
+    original = vector_fields(seeds_or_states, policy, **kwargs)
+    patched = vector_fields(seeds_or_states, policy, patches=patches, **kwargs)
+    return np.array(
+        [
+            vf_diff_magnitude(get_vf_diff(vf1, vf2)) / 2
+            for vf1, vf2 in zip(original, patched)
+        ]
+    )
 
 
 def vf_diff_magnitude_from_seed(seed: int, patches: dict):